@@ -0,0 +1,67 @@
+"""
+Benchmarks what keeping the edit journal costs while typing into a big file.
+
+Run with `python benchmarks/bench_journal.py [megabytes]`.  A file of 100 MB by default is opened the
+way the editor opens it, a few thousand keys are typed into it with the journal written out every
+so often like the main loop does, and how many bytes went to the journal and how long the typing
+took are compared with typing without a journal.  The journal has to grow with what was typed and
+not with the file, and the edits in it have to replay to the same text.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from fixtures import Master, make_file, open_document
+from deadpad.parts.render.document import Document
+from deadpad.parts.render.journal import journal_path
+
+MEGABYTES = 100
+KEYS = 2000
+FLUSH_EVERY = 50
+"How many keys get typed between the journal being written, about a second of fast typing."
+BYTES_PER_KEY = 32
+"The most journal a typed key can cost."
+
+def type_keys(path:str, journal:bool):
+    document = open_document(path, journal=journal)
+    document.cursor.move_to(document.buffer.line_count // 2, 0)
+    start = time.perf_counter()
+    for key in range(KEYS):
+        document._replace(document.cursor.line, document.cursor.col, 0, "\n" if key % 60 == 59 else "x")
+        if journal and key % FLUSH_EVERY == 0:
+            document.journal.flush()
+    if journal:
+        document.journal.flush()
+    return time.perf_counter() - start, document
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else MEGABYTES
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "big.txt")
+        make_file(path, megabytes)
+        plain_elapsed, plain = type_keys(path, False)
+        plain.close()
+        journal_elapsed, document = type_keys(path, True)
+        journal_bytes = os.path.getsize(journal_path(path))
+        expected = document.buffer.slice()
+        # closed with the edits unsaved, so the journal is left for the next time the file is opened
+        document.close()
+        replayed = Document(Master(journal=True), 80, path)
+        if replayed.recovered is None:
+            print("FAIL: the journal was not found again")
+            sys.exit(1)
+        replayed.replay_journal()
+        same = replayed.buffer.slice() == expected
+        replayed.close()
+    print(f"{megabytes} MB file, {KEYS} keys typed")
+    print(f"  without a journal      {plain_elapsed * 1000:>8.1f} ms")
+    print(f"  with a journal         {journal_elapsed * 1000:>8.1f} ms")
+    print(f"  journal                {journal_bytes:>8} bytes, {journal_bytes / KEYS:.1f} a key")
+    if not same:
+        print("FAIL: replaying the journal did not give the same text")
+        sys.exit(1)
+    if journal_bytes > KEYS * BYTES_PER_KEY:
+        print(f"FAIL: the journal took more than {BYTES_PER_KEY} bytes a key")
+        sys.exit(1)
+    print(f"OK: the journal replays to the same text and takes at most {BYTES_PER_KEY} bytes a key")
@@ -0,0 +1,104 @@
+"""
+Measures keystroke to paint latency and idle cpu use of the editor, linux only.
+
+Run with `python benchmarks/bench_latency.py [file]`.  The editor is started in a pseudo terminal,
+then keys are typed one at a time and the time until a frame finishes drawing (the renderer always
+ends one by parking the cursor on the last row) is recorded.  After that the editor is left alone
+for a few seconds to see how much cpu it burns while there is nothing to do.
+"""
+import os
+import pty
+import select
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+    import termios
+except ModuleNotFoundError:
+    print("this benchmark needs a posix pseudo terminal")
+    sys.exit(1)
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from deadpad.parts.render.journal import discard_journal
+
+ROWS, COLS = 50, 160
+FRAME_END = b"\x1b[%d;1H" % ROWS
+KEYS = 200
+IDLE_SECONDS = 3
+
+def cpu_seconds(pid:int):
+    "The user and system time the process has used so far."
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def drain(fd:int, timeout:float):
+    "Reads whatever the editor writes until it goes quiet for `timeout` seconds."
+    while select.select([fd], [], [], timeout)[0]:
+        try:
+            if not os.read(fd, 1 << 16):
+                return
+        except OSError:
+            return
+
+def wait_for_frame(fd:int, timeout:float):
+    "Reads until the end of a frame turns up, returns False if it never does."
+    out = b""
+    end = time.perf_counter() + timeout
+    while FRAME_END not in out:
+        left = end - time.perf_counter()
+        if left <= 0 or not select.select([fd], [], [], left)[0]:
+            return False
+        out += os.read(fd, 1 << 16)
+    return True
+
+def main(path:str):
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ["TERM"] = "xterm-256color"
+        os.chdir(ROOT)
+        os.execvp(sys.executable, [sys.executable, "main.py", path])
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", ROWS, COLS, 0, 0))
+    try:
+        drain(fd, 1.0)
+        latencies = []
+        for i in range(KEYS):
+            key = b"abcdefghij"[i % 10:i % 10 + 1] if i % 20 < 10 else b"\x7f"
+            start = time.perf_counter()
+            os.write(fd, key)
+            if wait_for_frame(fd, 1.0):
+                latencies.append(time.perf_counter() - start)
+            drain(fd, 0.02)
+        latencies.sort()
+        print(f"keystroke to paint over {len(latencies)} keys")
+        print(f"  median {statistics.median(latencies)*1000:.2f} ms")
+        print(f"  p95    {latencies[int(len(latencies)*0.95)]*1000:.2f} ms")
+        print(f"  max    {latencies[-1]*1000:.2f} ms")
+
+        drain(fd, 0.5)
+        before = cpu_seconds(pid)
+        drain(fd, IDLE_SECONDS)
+        used = cpu_seconds(pid) - before
+        print(f"idle cpu over {IDLE_SECONDS} s: {used*1000:.0f} ms ({used/IDLE_SECONDS:.1%})")
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        # the editor was killed with what was typed unsaved, which it keeps a journal of to offer back
+        discard_journal(path)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+            file.write("".join(f"line {i} of some text to type into\n" for i in range(2000)))
+        try:
+            main(file.name)
+        finally:
+            os.unlink(file.name)
@@ -0,0 +1,81 @@
+"""
+Benchmarks editing a big file while its lines are still being indexed, and the memory that takes.
+
+Run with `python benchmarks/bench_mapped.py [megabytes]`.  A file of 1024 MB by default is opened the
+way the editor opens it and a key is typed at the top straight away, while the background thread is
+still counting its newlines.  The key has to go in within a frame instead of waiting for the whole
+index.  Once the index is done the line count and the edited line have to be right, and resident
+memory has to stay far below the size of the file, since only what was looked at gets paged in.
+"""
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from fixtures import Master, make_file
+from deadpad.parts.render.document import Document
+
+MEGABYTES = 1024
+TARGET_MS = 16
+"The longest typing a key while the file is being indexed can take, about a frame."
+MEMORY_TARGET = 0.25
+"The most resident memory the editor can end up with, as a share of the file size."
+
+def resident_mb():
+    "The most resident memory this process has had, in MB."
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else MEGABYTES
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "big.txt")
+        lines = make_file(path, megabytes)
+        # the file was just written, so drop it from the page cache where that can be done
+        if hasattr(os, "posix_fadvise"):
+            with open(path, "rb") as file:
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+        start = time.perf_counter()
+        document = Document(Master(), 80, path)
+        document.poll()
+        open_elapsed = time.perf_counter() - start
+        was_loading = document.loading
+        start = time.perf_counter()
+        document._replace(0, 0, 0, "x")
+        edit_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while document.loading:
+            document.poll()
+            time.sleep(0.01)
+        document.poll()
+        index_elapsed = time.perf_counter() - start
+        line_count = document.buffer.line_count
+        first_line = document.line(0)
+        last_line = document.line(line_count - 1)
+        document.close()
+    resident = resident_mb()
+
+    print(f"{megabytes} MB file, {lines} lines")
+    print(f"  open                   {open_elapsed * 1000:>8.2f} ms")
+    print(f"  key while indexing     {edit_elapsed * 1000:>8.2f} ms{'' if was_loading else ' (the index was already done)'}")
+    print(f"  rest of the index      {index_elapsed:>8.2f} s")
+    print(f"  resident memory        {resident:>8.1f} MB at most")
+    if line_count != lines:
+        print(f"FAIL: the file has {lines} lines but {line_count} were counted")
+        failed = True
+    if not first_line.startswith("xthe quick") or not last_line.startswith("the quick"):
+        print("FAIL: the edited file does not read back right")
+        failed = True
+    if edit_elapsed * 1000 > TARGET_MS:
+        print(f"FAIL: typing a key while the file was being indexed took more than {TARGET_MS} ms")
+        failed = True
+    if resident > megabytes * MEMORY_TARGET:
+        print(f"FAIL: resident memory went over {MEMORY_TARGET:.0%} of the file size")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"OK: a key goes in within {TARGET_MS} ms while indexing and memory stays under {MEMORY_TARGET:.0%} of the file")
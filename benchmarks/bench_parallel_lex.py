@@ -0,0 +1,78 @@
+"""
+Benchmarks the first highlighting pass over a big python file, on one core and split across cores.
+
+Run with `python benchmarks/bench_parallel_lex.py [processes ...]`.  A file of about 100k lines is
+made out of the deadpad sources, then the time until every line of it is highlighted is measured
+lexing it a line at a time like the worker does, and with `lex_in_parallel` for each number of
+processes (every power of two up to the number of cores by default).  The parallel highlighting is
+checked against the sequential one line for line, pieces that guessed their starting state wrong
+are counted.  On a machine with more than one core, the most processes have to be at least half as
+many times faster as there are of them.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from deadpad.extensions.python import Parser
+from deadpad.parts.extension import load_parser
+from deadpad.parts.render.highlight import HighlightCache
+from deadpad.parts.render.parallel_lex import cores, lex_in_parallel
+
+LINES = 100_000
+EFFICIENCY = 0.5
+"How much of a perfect speed up over the sequential pass the parallel one has to get."
+
+def make_source():
+    source = "".join(path.read_text(encoding="utf8") for path in sorted((ROOT / "deadpad").rglob("*.py")))
+    lines = source.splitlines(True)
+    return "".join((lines * (LINES // len(lines) + 1))[:LINES])
+
+def sequential(lines:list[str]):
+    cache = HighlightCache(Parser().lex_line, lambda start, end: lines[start:end], len(lines))
+    start = time.perf_counter()
+    cache.spans(len(lines) - 1)
+    return time.perf_counter() - start, cache
+
+def parallel(path:str, line_count:int, processes:int):
+    cache = HighlightCache(None, lambda start, end: [], line_count)
+    relexed = pieces = 0
+    start = time.perf_counter()
+    for line, piece in lex_in_parallel(path, load_parser, ("module", "python", ""), processes, cache.theme_types):
+        cache.apply_packed(line, piece["packed"], piece["offsets"], piece["states"], piece["theme_types"], line_count)
+        pieces += 1
+        relexed += piece.get("relexed", False)
+    return time.perf_counter() - start, cache, pieces, relexed
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or sorted({1 << power for power in range(cores().bit_length())} | {cores()})
+    source = make_source()
+    lines = source.splitlines(True)
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf8") as file:
+        file.write(source)
+    print(f"{len(lines)} lines, {len(source.encode()) / 1e6:.1f} MB, {cores()} cores")
+    elapsed, expected = sequential(lines)
+    print(f"  one line at a time     {elapsed * 1000:>8.1f} ms")
+    speedups = {}
+    for processes in counts:
+        parallel_elapsed, cache, pieces, relexed = parallel(file.name, len(lines), processes)
+        for line in range(len(lines)):
+            if cache.cached(line) != expected.cached(line):
+                print(f"FAIL: line {line + 1} was highlighted differently with {processes} processes")
+                sys.exit(1)
+        speedups[processes] = elapsed / parallel_elapsed
+        print(f"  {processes:>2} processes           {parallel_elapsed * 1000:>8.1f} ms  {speedups[processes]:.2f}x  {pieces} pieces, {relexed} lexed again")
+    Path(file.name).unlink()
+    most = max(counts)
+    if most > cores():
+        print("OK: highlighting matches, more processes than cores so the speed up is not checked")
+    elif most < 2:
+        print("OK: highlighting matches, only one core so the speed up is not checked")
+    elif speedups[most] < most * EFFICIENCY:
+        print(f"FAIL: {most} processes are only {speedups[most]:.2f}x faster")
+        sys.exit(1)
+    else:
+        print(f"OK: highlighting matches and {most} processes are {speedups[most]:.2f}x faster")
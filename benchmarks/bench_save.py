@@ -0,0 +1,74 @@
+"""
+Benchmarks how long saving a big file holds up the main loop.
+
+Run with `python benchmarks/bench_save.py [megabytes]`.  A file of 200 MB by default is opened the
+way the editor opens it (mapped, since it is over `large_file_size`), edited in a few places and
+saved, with the main loop's part of the save (taking the snapshot and checking on the save) timed
+against how long the whole save takes to be written and synced.  Saving a big file should never
+hold up typing for longer than a frame, and neither should the first key typed after it, the save
+counts the lines of what it writes so the file it was saved to does not get indexed again.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from fixtures import make_file, open_document
+
+MEGABYTES = 200
+EDITS = 1000
+TARGET_MS = 16
+"The longest the main loop can be held up by a save, about a frame."
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else MEGABYTES
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "big.txt")
+        make_file(path, megabytes)
+        document = open_document(path, journal=True)
+        for edit in range(EDITS):
+            document._replace(edit * 97 % document.buffer.line_count, 3, 0, "edit ")
+        blocked = []
+        start = time.perf_counter()
+        document.save()
+        blocked.append(time.perf_counter() - start)
+        while document.saving is not None:
+            time.sleep(0.005)
+            poll_start = time.perf_counter()
+            saving = document.poll_save()
+            blocked.append(time.perf_counter() - poll_start)
+        total = time.perf_counter() - start
+        if saving.error is not None:
+            print(f"FAIL: the save failed: {saving.error}")
+            sys.exit(1)
+        with open(path, "rb") as file:
+            saved = file.read()
+        if saved != document.buffer.slice():
+            print("FAIL: the saved file is not the document")
+            sys.exit(1)
+        reindexing = document.loading
+        line_count = document.buffer.line_count
+        start = time.perf_counter()
+        document._replace(line_count // 2, 0, 0, "x")
+        key = time.perf_counter() - start
+        document.close()
+    print(f"{megabytes} MB with {EDITS} edits")
+    print(f"  whole save             {total * 1000:>8.1f} ms")
+    print(f"  main loop held up      {max(blocked) * 1000:>8.2f} ms at most, {sum(blocked) * 1000:.2f} ms in all")
+    print(f"  key after the save     {key * 1000:>8.2f} ms")
+    failed = False
+    if max(blocked) * 1000 > TARGET_MS:
+        print(f"FAIL: the save held the main loop up for more than {TARGET_MS} ms")
+        failed = True
+    if reindexing:
+        print("FAIL: the saved file was indexed all over again")
+        failed = True
+    if line_count != saved.count(b"\n"):
+        print("FAIL: the lines counted while saving are not the lines of the saved file")
+        failed = True
+    if key * 1000 > TARGET_MS:
+        print(f"FAIL: the first key after the save took more than {TARGET_MS} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"OK: neither the save nor the first key after it held the main loop up for more than {TARGET_MS} ms")
@@ -0,0 +1,95 @@
+"""
+Benchmarks finding the extensions at startup.
+
+Run with `python benchmarks/bench_startup.py`.  Every measurement runs in a fresh interpreter so
+nothing is already imported, and compares importing every extension and building its parser up
+front against reading the manifest and loading nothing until a file needs it.  It is run on the
+extensions that ship with deadpad and on a directory with many copies of them, since the point is
+that startup does not get slower the more languages are installed.
+"""
+import importlib.util
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+EXTENSIONS = ROOT / "deadpad" / "extensions"
+RUNS = 7
+COPIES = 20
+"How many copies of every extension go in the big directory."
+TARGET = 5
+"How many times faster finding the extensions from the manifest has to be than loading them all."
+
+def eager(extensions_path:str):
+    "How startup worked before, every extension imported and its parser built."
+    from deadpad.parts.grammar import load_grammar
+    parsers = {}
+    for entry in os.listdir(extensions_path):
+        path = os.path.join(extensions_path, entry)
+        if entry.endswith(".json"):
+            parsers[entry] = load_grammar(path)
+        elif not entry.startswith("__"):
+            spec = importlib.util.spec_from_file_location(f"bench_{entry}", os.path.join(path, "__init__.py"))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            parsers[entry] = module.Parser(None)
+    return parsers
+
+def lazy(extensions_path:str):
+    from deadpad.parts.extension import load_manifest
+    return load_manifest(extensions_path)
+
+def measure(mode:str, extensions_path:str):
+    "Runs in the child, prints how long finding the extensions took in ms."
+    import deadpad
+    from deadpad.parts import extension, grammar
+    start = time.perf_counter()
+    (eager if mode == "eager" else lazy)(extensions_path)
+    print((time.perf_counter() - start) * 1000)
+
+def run(mode:str, extensions_path:str, cache:str):
+    env = dict(os.environ, XDG_CACHE_HOME=cache, PYTHONPATH=str(ROOT))
+    out = subprocess.run([sys.executable, __file__, "--measure", mode, extensions_path], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip())
+
+def bench(name:str, extensions_path:str):
+    print(f"{name} ({len(os.listdir(extensions_path))} extensions)")
+    with tempfile.TemporaryDirectory() as cache:
+        # the grammars are compiled once first, like they would be from any earlier run
+        run("eager", extensions_path, cache)
+        eager_ms = statistics.median(run("eager", extensions_path, cache) for _ in range(RUNS))
+        cold_ms = run("lazy", extensions_path, cache)
+        warm_ms = statistics.median(run("lazy", extensions_path, cache) for _ in range(RUNS))
+    print(f"  load everything        {eager_ms:>8.2f} ms")
+    print(f"  build the manifest     {cold_ms:>8.2f} ms")
+    print(f"  read the manifest      {warm_ms:>8.2f} ms  {eager_ms / warm_ms:.1f}x faster")
+    return eager_ms / warm_ms
+
+def make_big(path:str):
+    for entry in os.listdir(EXTENSIONS):
+        source = EXTENSIONS / entry
+        for copy in range(COPIES):
+            if entry.endswith(".json"):
+                shutil.copy(source, os.path.join(path, f"{entry[:-5]}_{copy}.json"))
+            elif not entry.startswith("__"):
+                shutil.copytree(source, os.path.join(path, f"{entry}_{copy}"), ignore=shutil.ignore_patterns("__pycache__"))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    speedups = [bench("shipped extensions", str(EXTENSIONS))]
+    with tempfile.TemporaryDirectory() as big:
+        make_big(big)
+        speedups.append(bench(f"{COPIES} copies of every extension", big))
+    if min(speedups) < TARGET:
+        print(f"FAIL: reading the manifest is less than {TARGET}x faster than loading every extension")
+        sys.exit(1)
+    print(f"OK: reading the manifest is at least {TARGET}x faster than loading every extension")
@@ -0,0 +1,84 @@
+"""
+Benchmarks replacing every match in a big file as one transaction against one edit at a time.
+
+Run with `python benchmarks/bench_transaction.py [lines]`.  A word on every line of a file of 50,000
+lines by default gets replaced with `Document.replace_all`, which batches the edits so the wrap
+index and the highlighting hear about them once, and again with every edit left to update them on
+its own.  The batched replace has to be faster, leave the wrap index the same as wrapping the new
+text from scratch does, and undo in one go back to the text the file started with.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from fixtures import open_document
+from deadpad.parts.render.document import Document
+
+LINES = 50_000
+
+def rows(document:Document):
+    "The row every line starts on, to compare one wrap index with another."
+    return [document.wrap.row_of_line(line) for line in range(document.wrap.line_count)]
+
+def replace_unbatched(document:Document, old:str, new:str):
+    "What `replace_all` does, with every edit updating the wrap index on its own."
+    text = document.buffer.slice()
+    offset = text.rfind(old.encode())
+    while offset != -1:
+        document._edit(offset, len(old), new.encode())
+        offset = text.rfind(old.encode(), 0, offset)
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "text.txt")
+        with open(path, "w") as file:
+            file.write("".join(f"line {line} of the file with a fox in it\n" for line in range(lines)))
+
+        document = open_document(path)
+        original = document.buffer.slice()
+        start = time.perf_counter()
+        count = document.replace_all("fox", "much longer word that wraps the line past the width of the screen")
+        batched_elapsed = time.perf_counter() - start
+        replaced = document.buffer.slice()
+        batched_rows = rows(document)
+        document.undo()
+        undone = document.buffer.slice() == original
+        document.close()
+
+        document = open_document(path)
+        start = time.perf_counter()
+        replace_unbatched(document, "fox", "much longer word that wraps the line past the width of the screen")
+        unbatched_elapsed = time.perf_counter() - start
+        same_text = document.buffer.slice() == replaced
+        document.close()
+
+        with open(path, "wb") as file:
+            file.write(replaced)
+        document = open_document(path)
+        same_rows = rows(document) == batched_rows
+        document.close()
+
+    print(f"{count} matches replaced in {lines} lines")
+    print(f"  one transaction        {batched_elapsed * 1000:>8.1f} ms")
+    print(f"  one edit at a time     {unbatched_elapsed * 1000:>8.1f} ms")
+    if count != lines:
+        print("FAIL: not every match was replaced")
+        failed = True
+    if not same_text:
+        print("FAIL: the transaction gave different text than editing one at a time")
+        failed = True
+    if not same_rows:
+        print("FAIL: the wrap index after the transaction is not the one the new text wraps to")
+        failed = True
+    if not undone:
+        print("FAIL: undoing the replace did not give the file back in one go")
+        failed = True
+    if batched_elapsed >= unbatched_elapsed:
+        print("FAIL: the transaction was no faster than editing one at a time")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK: the replace is one update of the wrap index, wraps right and undoes in one go")
@@ -0,0 +1,93 @@
+"""
+Benchmarks undoing and redoing a big paste, and what the undo history costs while typing.
+
+Run with `python benchmarks/bench_undo.py [lines]`.  A paste of 10,000 lines by default goes into the
+middle of a file, gets undone and redone, and each has to be one edit of the buffer (so one rewrap).
+Undoing it has to take no longer than a frame, and redoing it no longer than the paste did, since it
+wraps the same lines again.  Then a lot of keys are typed with a small memory limit on the
+history, which has to stay under it by spilling to disk and still undo back to the text the file
+started with.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from fixtures import open_document
+
+LINES = 10_000
+KEYS = 20_000
+MEMORY_LIMIT = 16 * 1024
+"The memory limit on the history while the keys are typed, small so it has to spill."
+TARGET_MS = 16
+"The longest undoing the paste can take, about a frame."
+
+def timed(edit):
+    "How long `edit` took and how many edits of the buffer it made."
+    edits = document.edits
+    start = time.perf_counter()
+    edit()
+    return time.perf_counter() - start, document.edits - edits
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "text.txt")
+        with open(path, "w") as file:
+            file.write("".join(f"line {line} of the file as it was opened\n" for line in range(lines)))
+        paste = "".join(f"pasted line {line} with some more text on it\n" for line in range(lines)).encode()
+
+        document = open_document(path)
+        original = document.buffer.slice()
+        document.cursor.move_to(lines // 2, 0)
+        paste_elapsed, _ = timed(lambda: document.paste(paste))
+        pasted = document.buffer.slice()
+        undo_elapsed, undo_edits = timed(document.undo)
+        undone = document.buffer.slice() == original
+        redo_elapsed, redo_edits = timed(document.redo)
+        redone = document.buffer.slice() == pasted
+        document.close()
+
+        document = open_document(path, undo_memory=MEMORY_LIMIT)
+        document.cursor.move_to(lines // 2, 0)
+        most_memory = 0
+        start = time.perf_counter()
+        for key in range(KEYS):
+            document._replace(document.cursor.line, document.cursor.col, 0, "\n" if key % 60 == 59 else "x")
+            most_memory = max(most_memory, document.history.memory)
+        typing_elapsed = time.perf_counter() - start
+        spilled = document.history.disk
+        while document.undo():
+            pass
+        typed_undone = document.buffer.slice() == original
+        document.close()
+
+    print(f"{lines} line paste")
+    print(f"  paste                  {paste_elapsed * 1000:>8.2f} ms")
+    print(f"  undo                   {undo_elapsed * 1000:>8.2f} ms, {undo_edits} buffer edit(s)")
+    print(f"  redo                   {redo_elapsed * 1000:>8.2f} ms, {redo_edits} buffer edit(s)")
+    print(f"{KEYS} keys typed with a {MEMORY_LIMIT // 1024} KB history")
+    print(f"  typing                 {typing_elapsed * 1000:>8.1f} ms, {typing_elapsed / KEYS * 1e6:.1f} us a key")
+    print(f"  history                {most_memory:>8} bytes in memory at most, {spilled} spilled")
+    if not undone or not redone:
+        print("FAIL: undoing and redoing the paste did not give the text back")
+        failed = True
+    if undo_edits != 1 or redo_edits != 1:
+        print("FAIL: undoing or redoing the paste took more than one edit")
+        failed = True
+    if undo_elapsed * 1000 > TARGET_MS:
+        print(f"FAIL: undoing the paste took more than {TARGET_MS} ms")
+        failed = True
+    if redo_elapsed > paste_elapsed * 1.5:
+        print("FAIL: redoing the paste took longer than pasting it")
+        failed = True
+    if most_memory > MEMORY_LIMIT:
+        print("FAIL: the history went over its memory limit")
+        failed = True
+    if not typed_undone:
+        print("FAIL: undoing all the typing did not give the file back")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"OK: the paste undoes in one edit within {TARGET_MS} ms, redoes in one and the history stays in its limit")
@@ -0,0 +1,44 @@
+"""
+Benchmarks wrapping a single very long line, like a minified js or json file.
+
+Run with `python benchmarks/bench_wrap.py`.  The time per character should stay flat
+as the line grows, if it climbs with the size of the line the wrapping has gone quadratic.
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from deadpad.parts.render.document import measure_line
+
+SIZES = [1_000_000, 2_000_000, 5_000_000, 10_000_000]
+WIDTH = 120
+
+def make_line(size:int, pattern:str):
+    return (pattern * (size // len(pattern) + 1))[:size] + "\n"
+
+def bench(name:str, pattern:str):
+    print(name)
+    per_char = []
+    for size in SIZES:
+        line = make_line(size, pattern)
+        start = time.perf_counter()
+        rows, width = measure_line(line, WIDTH)
+        elapsed = time.perf_counter() - start
+        per_char.append(elapsed / size)
+        print(f"  {size/1_000_000:>5.1f} MB  {elapsed*1000:>9.1f} ms  {elapsed/size*1e9:>7.1f} ns/char  {len(rows)} rows")
+    growth = per_char[-1] / per_char[0]
+    print(f"  cost per char grew {growth:.2f}x from the smallest to the largest line")
+    return growth
+
+if __name__ == "__main__":
+    growths = [
+        bench("ascii (minified js)", '{"key":[1,2,3],"value":"abc"};function(a){return a+1};'),
+        bench("tabs and wide characters", 'let\tx = "日本語";\tconst y = "é";'),
+    ]
+    # linear wrapping keeps the cost per character flat, allow some noise from the allocator
+    if max(growths) > 2:
+        print("FAIL: wrapping is not linear")
+        sys.exit(1)
+    print("OK: wrapping stays linear")
@@ -0,0 +1,44 @@
+"""
+What the benchmarks that open a `Document` share: a stand in for the editor and a big file to open.
+"""
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from deadpad.parts.render.document import Document
+
+SETTINGS = {
+    "tab": "\t", "tab_size": 4, "large_file_size": 64 * 1024 * 1024, "journal": False,
+    "undo_memory": 16 * 1024 * 1024, "undo_disk": 256 * 1024 * 1024
+}
+
+class Events:
+    def wake(self):
+        pass
+
+class Master:
+    "Stands in for the editor, with only the settings and events a `Document` uses."
+    def __init__(self, **settings) -> None:
+        self.settings = {**SETTINGS, **settings}
+        self.events = Events()
+
+def make_file(path:str, megabytes:int):
+    "Writes `megabytes` of short lines a block at a time, so it takes next to no memory, and returns how many lines there are."
+    line = b"the quick brown fox jumps over the lazy dog, " * 2 + b"\n"
+    block = line * (1024 * 1024 // len(line))
+    with open(path, "wb") as file:
+        for _ in range(megabytes):
+            file.write(block)
+    return block.count(b"\n") * megabytes
+
+def open_document(path:str, **settings):
+    "Opens the file at `path` with `settings` changed from the defaults, and waits for it to be indexed."
+    document = Document(Master(**settings), 80, path)
+    while document.loading:
+        document.poll()
+        time.sleep(0.01)
+    document.poll()
+    return document
@@ -1,15 +1,17 @@
-import datetime
-import importlib
+from collections import deque
 import json
 import os
 import platform
 import sys
 import time
 from types import ModuleType
-from deadpad.parts.extension import Extension
+from deadpad.parts.event_loop import EventLoop
+from deadpad.parts.extension import Extension, GrammarExtension, load_manifest
 from deadpad.parts.render.textscreen import TextScreen
+from deadpad.parts.render.terminal import probe
 import shutil
 from deadpad.parts.render.document import Document
+from deadpad.parts.themes import compile_styles
 try:
     from deadpad.parts.input.windows_input import InputHandler
 except ModuleNotFoundError:
@@ -32,6 +34,13 @@ class Editor:
         # END CLI GUARDS
 
         self.in_handler = InputHandler()
+        self.events = EventLoop()
+        "Wakes the main loop up for input and resizes."
+        self.in_handler.attach(self.events)
+        self.latency:deque[float] = deque(maxlen=1000)
+        "How many seconds each of the last keys took from being read to being drawn."
+        self._unpainted:list[float] = []
+        self._busy = True
         self.term_size = shutil.get_terminal_size()
         self.themes_path = f"{os.path.dirname(__file__)}/themes/"
         self.settings = {
@@ -42,25 +51,41 @@ class Editor:
             # General config
             "theme": f"default",
             "tab": "\t",
-            "scroll_speed": 3
+            "tab_size": 4,
+            "scroll_speed": 3,
+            "large_file_size": 64 * 1024 * 1024,
+            "highlight_budget": 0.5,
+            "journal": True,
+            "undo_memory": 16 * 1024 * 1024,
+            "undo_disk": 256 * 1024 * 1024,
         }
         self.extensions:dict[str, Extension] = self.get_extensions()
+        self.file_types:dict[str, Extension] = {file_ext: extension for extension in self.extensions.values() for file_ext in extension.file_exts}
+        "The extension that highlights each file extension."
 
         self.theme_data = json.load(f_p:=open(f"{self.themes_path}{self.settings['theme']}.json", "r", encoding="utf8"))
         "Contains the config for the current theme in use."
         f_p.close()
+        self.styles = compile_styles(self.theme_data["language"])
+        "The escape code of every entry in the theme's language section."
+        self.terminal = probe()
+        "What the terminal supports, asked before the input handler starts reading stdin."
         self.screen = TextScreen(self, self.term_size.columns, self.term_size.lines, Document(self, self.term_size.columns, sys.argv[1]))
         
     def refresh(self):
         # TODO: make theme_data an attribute of Editor instead.
         self.theme_data = json.load(f_p:=open(f"{self.themes_path}{self.settings['theme']}.json", "r", encoding="utf8"))
         f_p.close()
+        self.styles = compile_styles(self.theme_data["language"])
         self.screen.updated = True
 
     def get_extensions(self):
+        "Every installed extension by name, none of them are loaded until a file they highlight gets opened."
+        extensions_path = f"{os.path.dirname(__file__)}/extensions"
         modules:dict[str, Extension] = {}
-        for extension in os.listdir(f"{os.path.dirname(__file__)}/extensions"):
-            modules[extension] = Extension(self, extension, importlib.import_module(f"deadpad.extensions.{extension}"))
+        for name, entry in load_manifest(extensions_path).items():
+            kind = GrammarExtension if entry["kind"] == "grammar" else Extension
+            modules[name] = kind(self, name, f"{extensions_path}/{entry['entry']}", entry["file_exts"], entry["description"], entry["budget"])
         return modules
 
     def run_command(self, command_str:str):
@@ -69,6 +94,7 @@ class Editor:
             match tokens[0]: # command name
                 case "set": # changes a setting
                     self.settings[tokens[1]] = (val:=self.parse_literal(tokens[2]))
+                    self.screen.document.update_state()
                     self.screen.footer_string = f"Set {tokens[1]} to {repr(val)}"
                 case "toggle": # toggles a setting
                     self.settings[tokens[1]] = not self.settings[tokens[1]]
@@ -76,8 +102,33 @@ class Editor:
                     self.screen.footer_string = f"EXITING"
                     self.screen.running = False
                 case "save":
-                    self.screen.footer_string = f"Last saved '{self.screen.document.file_path[:7]}' at {datetime.datetime.now()}. 📀"
-                    self.screen.document.save()
+                    self.screen.save_document()
+                case "replace": # replaces every match of some text, Ctrl-Z undoes all of them at once
+                    try:
+                        count = self.screen.document.replace_all(tokens[1], tokens[2] if len(tokens) > 2 else "")
+                        self.screen.scroll_to_cursor()
+                        self.screen.footer_string = f"Replaced {count} of {tokens[1]!r}"
+                    except IndexError:
+                        self.screen.footer_string = "Usage: replace <text> [replacement]"
+                case "goto": # moves the cursor to a line number, or to a byte offset with @
+                    try:
+                        if tokens[1].startswith("@"):
+                            self.screen.document.goto_offset(int(tokens[1][1:]))
+                        else:
+                            self.screen.document.goto_line(int(tokens[1]) - 1)
+                        self.screen.scroll_to_cursor(True)
+                    except (IndexError, ValueError):
+                        self.screen.footer_string = "Usage: goto <line> or goto @<offset>"
+                case "latency": # shows how long keys take to get drawn
+                    if self.latency:
+                        samples = sorted(self.latency)
+                        self.screen.footer_string = f"Key to screen: median {samples[len(samples)//2]*1000:.2f} ms, worst {samples[-1]*1000:.2f} ms over the last {len(samples)} keys"
+                    else:
+                        self.screen.footer_string = "No keys drawn yet"
+                case "rowcache": # shows how often rows get drawn from the render cache
+                    cache = self.screen.row_cache
+                    drawn = cache.hits + cache.misses
+                    self.screen.footer_string = f"Row cache: {cache.hits} hits, {cache.misses} misses ({cache.hits / max(drawn, 1):.0%} hit), {len(cache)}/{cache.size} rows held"
                 case "refresh":
                     self.refresh()
                     self.screen.footer_string = f"Dead Pad Themes, Plugins, and Config refreshed."
@@ -185,25 +236,64 @@ class Editor:
         while self.screen.running:
             self._run_update()
         self.in_handler.stop()
+        # waits for a save that is still being written, leaving now would throw it away
+        self.screen.document.close()
+        self.screen.close_highlighter()
+        self.events.close()
         try:
             termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, orig)
         except UnboundLocalError:
             pass
         sys.stdout.write("\033c")
         sys.stdout.write("\033[?25h") # show text cursor
+
+    def _next_timeout(self):
+        "How long the main loop can sleep for if nothing wakes it up."
+        if self._busy or not self.in_handler.input_queue.empty():
+            return 0
+        timeout = None
+        if self.screen.document.loading or self.screen.document.saving is not None:
+            # keep the indexing or saving progress moving
+            timeout = 0.1
+        elif not self.events.watches_resize:
+            # without SIGWINCH the terminal size has to be checked every so often
+            timeout = 0.5
+        # wake up in time to stop a highlighter that runs over its budget
+        highlight_timeout = self.screen.highlight_timeout()
+        if highlight_timeout is not None:
+            timeout = highlight_timeout if timeout is None else min(timeout, highlight_timeout)
+        # and to write the edits waiting to go in the journal
+        journal_timeout = self.screen.document.journal_timeout()
+        if journal_timeout is not None:
+            timeout = journal_timeout if timeout is None else min(timeout, journal_timeout)
+        return timeout
         
     def _run_update(self):
-        self.screen.handle_input(self.in_handler.get())
-        term_size = shutil.get_terminal_size()
-        if self.screen.check_update()\
-         or term_size.lines != self.term_size.lines\
-         or term_size.columns != self.term_size.columns:
-            self.term_size = term_size
-            clear_str = "\033[F\033[K" * (self.term_size.lines)
-            self.screen.render(self.term_size.columns, self.term_size.lines)
-            sys.stdout.write(f"{clear_str}{self.screen.render(self.term_size.columns, self.term_size.lines)}")
+        self.events.wait(self._next_timeout())
+        events = self.in_handler.get_batch()
+        self.screen.handle_events(events)
+        self.screen.poll_highlighting()
+        self.screen.poll_saving()
+        self.screen.document.poll_journal()
+        self._unpainted.extend(event.time for event in events)
+        resized = False
+        if self.events.take_resized():
+            term_size = shutil.get_terminal_size()
+            resized = term_size != self.term_size
+        if self.screen.check_update() or resized:
+            if resized:
+                self.term_size = term_size
+            frame = self.screen.render(self.term_size.columns, self.term_size.lines)
+            sys.stdout.write(self.screen.frame.update(frame))
+            sys.stdout.flush()
+            painted = time.perf_counter()
+            self.latency.extend(painted - read for read in self._unpainted)
+            self._unpainted.clear()
+            # check for leftover work before going to sleep
+            self._busy = True
         else:
-            time.sleep(0.01)
+            self._unpainted.clear()
+            self._busy = self.screen.idle()
 
 
 def main():
@@ -1,12 +1,11 @@
-from dataclasses import dataclass
+from array import array
+from bisect import bisect_right
 from enum import Enum
+import re
 import sys
-from typing import Generic, Iterable, TypeVar
 from deadpad import Editor
 from deadpad.parts.themes import RESET_STYLE, get_style
 
-# TODO add number context so numbers like 0.01 wont have 01 be parsed as syntax errors.
-
 FILE_EXT = "py"
 DESCRIPTION = """
 The official python extension made by the creator of Dead Pad.
@@ -29,26 +28,42 @@ class TokType(Enum):
     kw_while = "while"
     kw_pass = "pass"
     kw_continue = "continue"
+    kw_break = "break"
     kw_return = "return"
+    kw_yield = "yield"
     kw_as = "as"
+    kw_with = "with"
+    kw_lambda = "lambda"
+    kw_assert = "assert"
+    kw_async = "async"
+    kw_await = "await"
     label = 1
+    constant = 3
     wordop_nonlocal = "nonlocal"
     wordop_global = "global"
     wordop_raise = "raise"
     op_add = "+"
     op_sub = "-"
     op_mul = "*"
+    op_pow = "**"
     op_div = "/"
+    op_floordiv = "//"
     op_matmul = "@"
     op_bitor = "|"
     op_bitnot = "~"
     op_bitand = "&"
+    op_bitxor = "^"
+    op_lshift = "<<"
+    op_rshift = ">>"
     op_mod = "%"
     wordop_or = "or"
     wordop_and = "and"
     wordop_not = "not"
     wordop_in = "in"
     op_assign = "="
+    op_walrus = ":="
+    op_arrow = "->"
+    op_augassign = 2
     wordop_del = "del"
     op_eq = "=="
     op_gt = ">"
@@ -63,6 +78,7 @@ class TokType(Enum):
     format_string = 7
     byte_string = 8
     raw_string = 9
+    escape = 10
     litkw_bool_true = "True"
     litkw_bool_false = "False"
     litkw_none = "None"
@@ -73,8 +89,10 @@ class TokType(Enum):
     bracket_par_start = "("
     bracket_par_end = ")"
     delim_semi_colon = ":"
+    delim_semicolon = ";"
     delim_comma = ","
     delim_dot = "."
+    delim_ellipsis = "..."
     type_str = "str"
     type_int = "int"
     type_float = "float"
@@ -92,6 +110,7 @@ class TokType(Enum):
     misc_newline = "\n"
     misc_backslash = "\\"
     misc_unclosed_str = 12
+    misc_error = 13
 
     @property
     def is_keyword(self):
@@ -113,12 +132,100 @@ class TokType(Enum):
     def is_operator_word(self):
         return self.name.startswith("wordop")
 
+    @property
+    def is_string(self):
+        return self in {TokType.string, TokType.format_string, TokType.byte_string, TokType.raw_string, TokType.misc_unclosed_str}
+
+WORDS:dict[str, TokType] = {tok.value: tok for tok in TokType if isinstance(tok.value, str) and tok.value.isidentifier()}
+"Keywords, word operators, literal keywords and types by their text, every other word is a label."
+
+OPERATORS:dict[str, TokType] = {tok.value: tok for tok in TokType if isinstance(tok.value, str) and not tok.value.isidentifier() and not tok.value.isspace()}
+"Operators, brackets and delimiters by their text, an operator followed by = that is missing from here is an augmented assignment."
+
+def _theme_type(tok_type:TokType):
+    if tok_type.is_string:
+        return "string"
+    if tok_type in {TokType.integer, TokType.float}:
+        return "number"
+    for test, theme_type in (
+        (tok_type.is_keyword, "keyword"),
+        (tok_type.is_bracket, "bracket"),
+        (tok_type.is_literal_keyword, "literal_keyword"),
+        (tok_type.is_type, "type"),
+        (tok_type.is_operator_word, "operator_keyword"),
+    ):
+        if test:
+            return theme_type
+    return {
+        TokType.escape: "escape",
+        TokType.misc_comment: "comment",
+        TokType.misc_error: "error",
+        TokType.label: "label",
+        TokType.constant: "constant",
+    }.get(tok_type, "default")
+
+THEME_TYPES:dict[TokType, str] = {tok: _theme_type(tok) for tok in TokType}
+"The entry in the theme's language section that each kind of token is drawn with."
+
+_TOKEN = re.compile(r"""
+    [ \t\f]*(?:
+    (?P<name>(?!(?:[rRbBuUfF]|[rR][bBfF]|[bBfF][rR])?['"])[^\W\d]\w*)
+    |(?P<op>\*\*=?|//=?|>>=?|<<=?|->|:=|\.\.\.|[-+*/%@&|^~<>=!]=?|[][(){}:;,\\]|\.(?!\d))
+    |(?P<number>
+        0[xX](?:_?[0-9a-fA-F])+
+        |0[bB](?:_?[01])+
+        |0[oO](?:_?[0-7])+
+        |(?:\d(?:_?\d)*(?:\.(?:\d(?:_?\d)*)?)?|\.\d(?:_?\d)*)(?:[eE][+-]?\d(?:_?\d)*)?[jJ]?
+    )
+    |(?P<string>(?:(?<!\w)(?:[rRbBuUfF]|[rR][bBfF]|[bBfF][rR]))?(?:'''|\"\"\"|'|"))
+    |(?P<comment>\#.*)
+    |(?P<error>\S)
+    )
+""", re.VERBOSE)
+"""
+One pattern for every token that can come up outside of a string, the group that matched says what it is.
+Whitespace is skipped over in front of each token instead of being a token of its own.  Names and
+operators are by far the most common tokens so they are tried first, a name is never a string prefix
+and a dot is never the start of a number.
+"""
+_NAME, _OP, _NUMBER, _STRING, _COMMENT, _ERROR = (_TOKEN.groupindex[name] for name in ("name", "op", "number", "string", "comment", "error"))
+
+_STRING_END = {
+    quote: re.compile(r"(?:[^\\]|\\.)*?" + quote if len(quote) == 3 else r"(?:[^\\" + quote + r"]|\\.)*" + quote + "?")
+    for quote in ("'''", '"""', "'", '"')
+}
+"Finds the end of a string from just after its opening quote, raw strings end the same way since a backslash still keeps a quote from closing them."
+
+_STRING_OR_COMMENT = re.compile(r"""[#'"]""")
+"Finds where the next string or comment could start, for when only the state a line ends in is needed."
+
+_WORD_BEFORE = re.compile(r"\w{0,3}$")
+_RAW_PREFIXES = {"r", "rb", "br", "rf", "fr"}
+
+_ESCAPE = re.compile(r"\\(?:N\{[^}]*\}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|x[0-9a-fA-F]{2}|[0-7]{1,3}|.)")
+
+_SAME_KINDS = {tok: tok for tok in TokType}
+
+TOKEN_TYPES:tuple[TokType, ...] = tuple(TokType)
+"Every kind of token, the type ids a `TokenStream` stores index into this."
+
+TYPE_IDS:dict[TokType, int] = {tok: type_id for type_id, tok in enumerate(TOKEN_TYPES)}
+
+_STRING_TYPES = {"": TokType.string, "u": TokType.string, "f": TokType.format_string, "b": TokType.byte_string, "r": TokType.raw_string}
+
+def _text_kinds(kinds:dict[TokType, any]):
+    "Every word and operator that has a type of its own by its text, with the type looked up in `kinds`."
+    return {text: kinds[tok] for text, tok in (WORDS | OPERATORS).items()}
+
+_TEXT_KINDS = {id(kinds): _text_kinds(kinds) for kinds in (_SAME_KINDS, TYPE_IDS, THEME_TYPES)}
+"The words and operators already looked up in the kinds the parser calls `lex` with, by the id of the kinds."
+
 class PyExcept:
     def __init__(self, typ:str, description:str, metadata:dict[str,any] = None):
         self.type = typ
         self.description = description
         self.metadata = metadata
-    
+
     def __repr__(self):
         return f"e'{self.type}'"
 
@@ -126,13 +233,16 @@ class PyExcept:
         return f"{self.type}: {self.description}"
 
 class Token:
-    def __init__(self, tok_type:TokType, tok_value, col_num:int, line_num:int):
+    __slots__ = ("tok_type", "tok_value", "raw", "col_num", "line_num", "exception")
+
+    def __init__(self, tok_type:TokType, tok_value, col_num:int, line_num:int, raw:str = None):
         self.tok_type = tok_type
         self.tok_value = tok_value
+        self.raw = str(tok_value) if raw is None else raw
         self.col_num = col_num
         self.line_num = line_num
         self.exception:PyExcept = None
-    
+
 
     def __repr__(self):
         return f"t'{self.tok_value}'"
@@ -148,242 +258,278 @@ class Token:
         # str and bytes literals are handled by override_type
         if override_type:
             return Token(override_type, raw_str, col_num, line_num)
-        
-        try:
-            return Token(TokType(raw_str), raw_str, col_num, line_num)
-        except ValueError:
-            
-            # This is where we will do type parsing
-            assume_num_str = raw_str.lstrip("-")
-            if assume_num_str.isdigit():
-                # now that we know the string is all integers, check if it isa valid integer
-                if assume_num_str[0] == '0' and len(assume_num_str) > 1:
-                    bad_int = Token(TokType.integer, raw_str, col_num, line_num)
-                    bad_int.exception = PyExcept("SyntaxError", "Integers cannotbegin with a leading 0.")
-                    return bad_int
-                else:
-                    # valid integer
-                    return Token(TokType.integer, int(raw_str), col_num, line_num)
+        tok_type = WORDS.get(raw_str) or OPERATORS.get(raw_str)
+        if tok_type is None:
+            match = _TOKEN.fullmatch(raw_str)
+            if match and match.lastgroup == "number":
+                tok_type = _number_type(raw_str)
             else:
-                try:
-                    val = float(raw_str)
-                    return Token(TokType.float, val, col_num, line_num)
-                except ValueError:
-                    return Token(TokType.label, raw_str, col_num, line_num)
-
-T = TypeVar('T')
-
-class Src(Generic[T]):
-    def __init__(self, collection:Iterable[T]) -> None:
-        self.iter = iter(collection)
-        self.l_n = 1
-        self.c_n = 1
+                tok_type = TokType.constant if raw_str.isupper() else TokType.label
+        token = Token(tok_type, raw_str, col_num, line_num)
+        if tok_type == TokType.integer and _bad_int(raw_str):
+            token.exception = PyExcept("SyntaxError", "Integers cannot begin with a leading 0.")
+        return token
+
+class TokenStream:
+    """
+    The tokens of a source, kept column by column instead of as an object each.
+
+    Every token is three numbers in parallel arrays, where it starts in the source, how long it is
+    and the id of its type in `TOKEN_TYPES`.  Its text is only sliced out of the source when it is
+    asked for, and the few tokens with an error keep it in a dict by their index.  Indexing or
+    iterating still gives back `Token`s, made on the spot.
+    """
+    __slots__ = ("src", "starts", "lengths", "types", "errors", "line_starts")
+
+    def __init__(self, src:str) -> None:
+        self.src = src
+        self.starts = array("I")
+        self.lengths = array("I")
+        self.types = array("I")
+        self.errors:dict[int, PyExcept] = {}
+        "The error of each token that has one, by the token's index."
+        self.line_starts = array("I", [0])
+        "Where each line of the source starts, to work out the line and column of a token."
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, index:int) -> TokType:
+        return TOKEN_TYPES[self.types[index]]
+
+    def value(self, index:int) -> str:
+        start = self.starts[index]
+        return self.src[start:start + self.lengths[index]]
+
+    def __getitem__(self, index:int) -> Token:
+        if index < 0:
+            index += len(self)
+        start = self.starts[index]
+        line = bisect_right(self.line_starts, start) - 1
+        raw = self.src[start:start + self.lengths[index]]
+        token = Token(TOKEN_TYPES[self.types[index]], raw, start - self.line_starts[line] + 1, line + 1)
+        token.exception = self.errors.get(index)
+        return token
 
     def __iter__(self):
-        return self.iter
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        "Roughly how much memory the token columns take up."
+        return sum(column.itemsize * len(column) for column in (self.starts, self.lengths, self.types, self.line_starts))
+
+def _number_type(text:str):
+    if text[:2].lower() in {"0x", "0b", "0o"}:
+        return TokType.integer
+    return TokType.float if any(char in text for char in ".eEjJ") else TokType.integer
+
+def _bad_int(text:str):
+    "True for decimal integers with a leading zero, like 007."
+    digits = text.replace("_", "")
+    return len(digits) > 1 and digits[0] == "0" and digits.isdigit() and digits.strip("0") != ""
+
+def _string_end(text:str, pos:int, quote:str, raw:bool):
+    """
+    Finds the end of a string whose body starts at `pos`.  Returns where it ends, the state after it
+    and False if it is a one line string that was never closed.
+    """
+    match = _STRING_END[quote].match(text, pos)
+    if match is None:
+        # a triple quoted string that goes on past this line
+        return len(text), ("r" if raw else "") + quote, True
+    end = match.end()
+    if len(quote) == 1 and not text.endswith(quote, pos, end):
+        if end < len(text):
+            # a backslash at the end of the line carries the string on to the next one
+            return len(text), ("r" if raw else "") + quote, True
+        return end, None, False
+    return end, None, True
 
 class Parser:
 
     def __init__(self, master:Editor = None):
         """
-        This parses the src str into a python astso it can be used for syntax highlighting and other tooling.
+        This parses the src str into python tokens so they can be used for syntax highlighting and other tooling.
         """
         self.master = master
-        
+        self._style_table:tuple[dict[str, str], list[str]] | None = None
 
     def highlight(self, src:str):
         "This syntax highlights the string and returns it."
         return self.render(self.tokenize(src))
 
-    def tokenize(self, src:str):
-        # This function returns a list of `Token`s
-        src:Src[str] = Src(src)
-        tokens:list[Token] = []
-        self.tokenize_code_context(tokens, src)
-        
+    def tokenize(self, src:str) -> TokenStream:
+        "Splits the whole source into tokens, the whitespace and newlines between them are left in the source."
+        tokens = TokenStream(src)
+        starts, lengths, types = tokens.starts, tokens.lengths, tokens.types
+        bad_number = TYPE_IDS[TokType.misc_error]
+        state = None
+        offset = 0
+        append_start, append_length, append_type = starts.append, lengths.append, types.append
+        for line in src.split("\n"):
+            spans, state = self.lex(line.replace("\r", " "), state, TYPE_IDS)
+            for start, end, type_id in spans:
+                if type_id == bad_number and line[start].isdigit():
+                    tokens.errors[len(types)] = PyExcept("SyntaxError", "Integers cannot begin with a leading 0.")
+                    type_id = TYPE_IDS[TokType.integer]
+                append_start(offset + start)
+                append_length(end - start)
+                append_type(type_id)
+            offset += len(line) + 1
+            if offset <= len(src):
+                # the split leaves a line on the end that has no newline
+                tokens.line_starts.append(offset)
         return tokens
-    
-    def tokenize_code_context(self, tokens:list[Token], src:Src[str]):
-        tok_buff = ""
-        for char in src:
-            match char:
-                case '\r':
-                    pass
-                case '+'|'-'|'*'|'/'|'@'|'='|'~'|'(' \
-                |')'|'{'|'}'|'['|']'|':'|'.'|'&'|' '|'\t'|'\\'|',':
-                    append_tok(tokens, src.c_n, src.l_n, tok_buff=tok_buff)
-                    tok_buff = ""
-                    append_tok(tokens, src.c_n, src.l_n, char)
-                case '"'|'\'':
-                    append_tok(tokens, src.c_n, src.l_n, tok_buff=tok_buff)
-                    tok_buff = ""
-                    self.tokenize_str_context(tokens, src, char)
-                case '#':
-                    append_tok(tokens, src.c_n, src.l_n, tok_buff=tok_buff)
-                    tok_buff = ""
-                    self.tokenize_comment_context(tokens, src)
-                case '\n':
-                    append_tok(tokens, src.c_n, src.l_n, tok_buff=tok_buff)
-                    tok_buff = ""
-                    append_tok(tokens, src.c_n, src.l_n, '\n')
-                    src.c_n = 1
-                    src.l_n += 1
-                case _:
-                    tok_buff += char
-
-            src.c_n += 1
-        append_tok(tokens, src.c_n, src.l_n, tok_buff=tok_buff)
-
-    def tokenize_comment_context(self, tokens:list[Token], src:Src[str]):
-        tok_buff = "#"
-        for char in src:
-            match char:
-                case '\n':
-                    # end comment
-                    tokens.append(Token.from_raw(tok_buff, src.c_n, src.l_n, TokType.misc_comment))
-                    append_tok(tokens, src.c_n, src.l_n, '\n')
-                    src.l_n += 1
-                    src.c_n = 1
-                    return
-                case _:
-                    tok_buff += char
-
-            src.c_n += 1
-        tokens.append(Token.from_raw(tok_buff, src.c_n, src.l_n, TokType.misc_comment))
-    
-    def tokenize_str_context(self, tokens:list[Token], src:Src[str], str_tok:str):
-        tok_buff = ""
-        escape = False
-        for char in src:
-            match char:
-                case '\''|'"':
-                    # end string
-                    if char == str_tok and not escape:
-                        
-                        tokens.append(Token.from_raw(str_tok+ tok_buff + str_tok, src.c_n, src.l_n, TokType.string))
-                        return
-                    else:
-                        tok_buff += char
-                        escape = False
-                case '\n':
-                    tok_buff += '\n'
-                    src.c_n = 1
-                    src.l_n += 1
-                case _:
-                    if char == '\\':
-                        # TODO BUG escape not working
-                        escape = not escape
-                    elif escape:
-                        escape = False
-                    tok_buff += char
-
-            src.c_n += 1
-        tokens.append(Token.from_raw(str_tok + tok_buff, src.c_n, src.l_n, TokType.misc_unclosed_str))
-        src.c_n = 1
-        src.l_n += 1
-
-    def render(self, tokens:list[Token]):
-        language_theme = self.master.theme_data["language"]
-        ret_str = ""
-        for tok in tokens:
-            if isinstance(tok, PyExcept):
-                raise RuntimeError(f"The following error occured in the extension ext_python...\n{tok}")
-            match tok.tok_type:
-                case TokType.string | TokType.misc_unclosed_str:
-                    theme_type = "string"
-                    ret_str += tok.render(
-                        language_theme[theme_type]["color_fg"],
-                        language_theme[theme_type]["color_bg"],
-                        language_theme[theme_type]["style"]
-                    )
-                case _:
-                    if tok.exception:
-                        theme_type = "error"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type == TokType.misc_comment:
-                        theme_type = "comment"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type == TokType.label:
-                        if tok.tok_value.isupper():
-                            theme_type = "constant"
-                            ret_str += tok.render(
-                                language_theme[theme_type]["color_fg"],
-                                language_theme[theme_type]["color_bg"],
-                                language_theme[theme_type]["style"]
-                            )
-                        else:
-                            theme_type = "label"
-                            ret_str += tok.render(
-                                language_theme[theme_type]["color_fg"],
-                                language_theme[theme_type]["color_bg"],
-                                language_theme[theme_type]["style"]
-                            )
-                    elif tok.tok_type in {TokType.integer, TokType.float}:
-                        theme_type = "number"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type.is_keyword:
-                        theme_type = "keyword"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type.is_bracket:
-                        theme_type = "bracket"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type.is_literal_keyword:
-                        theme_type = "literal_keyword"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type.is_type:
-                        theme_type = "type"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    elif tok.tok_type.is_operator_word:
-                        theme_type = "operator_keyword"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-                    else:
-                        theme_type = "default"
-                        ret_str += tok.render(
-                            language_theme[theme_type]["color_fg"],
-                            language_theme[theme_type]["color_bg"],
-                            language_theme[theme_type]["style"]
-                        )
-        return ret_str
-
-
-def append_tok(tokens:list[Token], c_n:int, l_n:int, tok_str:str = None, tok_buff:str = ""):
-    if tok_str == None:
-        if tok_buff != "":
-            tokens.append(Token.from_raw(tok_buff, c_n, l_n))
-    else:
-        tokens.append(Token.from_raw(tok_str, c_n, l_n))
+
+    def lex(self, text:str, state:str | None = None, kinds:dict[TokType, any] = None) -> tuple[list[tuple[int, int, any]], str | None]:
+        """
+        Splits one line (without its newline) into tokens, as (start column, end column, type).
+        Whitespace between tokens is left out.
+
+        `state` is the opening quote of a string that an earlier line left open, with an r in front if
+        it is raw, or None.  Returns the tokens and the state the line ends in.  If `kinds` is given
+        each type is looked up in it and the tokens carry that instead.
+        """
+        kinds = _SAME_KINDS if kinds is None else kinds
+        spans = []
+        append = spans.append
+        pos = 0
+        end = len(text)
+        if state:
+            raw = state[0] == "r"
+            pos, state = self._string_body(text, 0, 0, state.lstrip("r"), raw, kinds[TokType.raw_string if raw else TokType.string], kinds, spans)
+        by_text = _TEXT_KINDS.get(id(kinds)) or _text_kinds(kinds)
+        name, constant, augassign = kinds[TokType.label], kinds[TokType.constant], kinds[TokType.op_augassign]
+        comment, error = kinds[TokType.misc_comment], kinds[TokType.misc_error]
+        while pos < end and state is None:
+            for match in _TOKEN.finditer(text, pos):
+                group = match.lastindex
+                start, stop = match.span(group)
+                if group <= _OP:
+                    word = text[start:stop]
+                    kind = by_text.get(word)
+                    if kind is None:
+                        # an operator missing from the table is an augmented assignment
+                        kind = augassign if group == _OP else constant if word.isupper() else name
+                    append((start, stop, kind))
+                elif group == _STRING:
+                    opening = text[start:stop]
+                    quote = opening.lstrip("rRbBuUfF")
+                    prefix = opening[:len(opening) - len(quote)].lower()
+                    raw = "r" in prefix
+                    tok_type = _STRING_TYPES[prefix.replace("r", "") or ("r" if raw else "")]
+                    pos, state = self._string_body(text, start, stop, quote, raw, kinds[tok_type], kinds, spans)
+                    # carry on after the string with a new search
+                    break
+                elif group == _NUMBER:
+                    number = text[start:stop]
+                    tok_type = TokType.misc_error if number[0] == "0" and _bad_int(number) else _number_type(number)
+                    append((start, stop, kinds[tok_type]))
+                else:
+                    append((start, stop, comment if group == _COMMENT else error))
+            else:
+                break
+        return spans, state
+
+    def end_state(self, line:str, state:str | None = None) -> str | None:
+        """
+        The state `line` ends in, the same as `lex_line` would give back but without working out any spans.
+        Only strings and comments need to be looked at for that, so this is a lot quicker.
+        """
+        text = line.rstrip("\r\n")
+        pos = 0
+        if state:
+            pos, state, _ = _string_end(text, 0, state.lstrip("r"), state[0] == "r")
+        search = _STRING_OR_COMMENT.search
+        while state is None:
+            match = search(text, pos)
+            if match is None or match[0] == "#":
+                # nothing left or the rest is a comment
+                return None
+            start = match.start()
+            quote = match[0] * 3 if text.startswith(match[0] * 3, start) else match[0]
+            prefix = _WORD_BEFORE.search(text, max(start - 3, 0), start)[0].lower()
+            pos, state, _ = _string_end(text, start + len(quote), quote, prefix in _RAW_PREFIXES)
+        return state
+
+    def _string_body(self, text:str, start:int, pos:int, quote:str, raw:bool, kind, kinds:dict[TokType, any], spans:list):
+        "Adds the spans of a string that starts at `start` and whose body starts at `pos`, returns where it ends and the state after."
+        end, state, closed = _string_end(text, pos, quote, raw)
+        if not closed:
+            kind = kinds[TokType.misc_unclosed_str]
+        if not raw and "\\" in text:
+            for escape in _ESCAPE.finditer(text, pos, end):
+                if escape.start() > start:
+                    spans.append((start, escape.start(), kind))
+                spans.append((escape.start(), escape.end(), kinds[TokType.escape]))
+                start = escape.end()
+        if end > start:
+            spans.append((start, end, kind))
+        return end, state
+
+    def lex_line(self, line:str, state:str | None = None) -> tuple[list[tuple[int, int, str]], str | None]:
+        """
+        Highlights one logical line for the editor's highlight cache.
+
+        Returns the spans of the line as (start column, end column, theme type) and the state it ends in.
+        """
+        return self.lex(line.rstrip("\r\n"), state, THEME_TYPES)
+
+    def theme_type(self, tok:Token):
+        "The entry in the theme's language section that `tok` is drawn with."
+        if tok.exception:
+            return "error"
+        return THEME_TYPES[tok.tok_type]
+
+    def style_table(self) -> list[str]:
+        "The escape code of every kind of token by its type id, built once for each theme the editor loads."
+        styles = self.master.styles
+        if self._style_table is None or self._style_table[0] is not styles:
+            default = styles["default"]
+            self._style_table = (styles, [styles.get(THEME_TYPES[tok], default) for tok in TOKEN_TYPES])
+        return self._style_table[1]
+
+    def render(self, tokens:TokenStream | list[Token]):
+        "Draws the tokens in their theme's styles, a style is only written where it changes."
+        table = self.style_table()
+        error = self.master.styles.get("error", table[TYPE_IDS[TokType.misc_error]])
+        out = []
+        drawn = None
+        if isinstance(tokens, TokenStream):
+            src, starts, lengths, types, errors = tokens.src, tokens.starts, tokens.lengths, tokens.types, tokens.errors
+            space = table[TYPE_IDS[TokType.misc_space]]
+            end = 0
+            for index in range(len(types)):
+                start = starts[index]
+                if start > end:
+                    # the whitespace between tokens is not a token of its own
+                    if space != drawn:
+                        out.append(space)
+                        drawn = space
+                    out.append(src[end:start])
+                style = error if index in errors else table[types[index]]
+                if style != drawn:
+                    out.append(style)
+                    drawn = style
+                end = start + lengths[index]
+                out.append(src[start:end])
+            if end < len(src):
+                if space != drawn:
+                    out.append(space)
+                out.append(src[end:])
+        else:
+            for tok in tokens:
+                if isinstance(tok, PyExcept):
+                    raise RuntimeError(f"The following error occured in the extension ext_python...\n{tok}")
+                style = error if tok.exception else table[TYPE_IDS[tok.tok_type]]
+                if style != drawn:
+                    out.append(style)
+                    drawn = style
+                out.append(tok.raw)
+        out.append(RESET_STYLE)
+        return "".join(out)
 
 
 if __name__ == "__main__":
@@ -393,5 +539,3 @@ if __name__ == "__main__":
     src_file.close()
     tokens = parser.tokenize(src)
     print(parser.render(tokens))
-
-
@@ -0,0 +1,29 @@
+from __future__ import annotations
+import json
+import os
+from typing import Any
+
+def cache_dir(*parts:str):
+    "Where things that are kept between runs go, under the user's cache directory."
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "deadpad", *parts)
+
+def read_cache(path:str) -> Any:
+    "What was cached at `path`, or None if there is nothing there that can be read."
+    try:
+        with open(path, "r", encoding="utf8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_cache(path:str, data:Any):
+    "Caches `data` at `path` as json, if there is nowhere to put it it just does not get cached."
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to where it goes and swapped in, so a half written cache is never read
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf8") as file:
+            json.dump(data, file)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
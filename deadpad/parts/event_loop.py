@@ -0,0 +1,74 @@
+from __future__ import annotations
+import selectors
+import signal
+import socket
+from typing import Callable
+
+class EventLoop:
+    """
+    Sleeps until there is something to do instead of polling.
+
+    The editor wakes up for input (anything registered with `add_reader`, or another thread
+    calling `wake`), for a terminal resize (SIGWINCH, through a self pipe) or when the timeout
+    it asked for runs out.  With none of those it blocks in the selector and uses no cpu at all.
+    """
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        # a socket pair instead of os.pipe so it can be selected on windows as well
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self.selector.register(self._wake_read, selectors.EVENT_READ)
+        self._resized = True
+        self.watches_resize = hasattr(signal, "SIGWINCH")
+        "False where there is no SIGWINCH, the terminal size has to be checked on every wake up there."
+        if self.watches_resize:
+            self._old_wakeup_fd = signal.set_wakeup_fd(self._wake_write.fileno())
+            self._old_handler = signal.signal(signal.SIGWINCH, self._on_resize)
+
+    def _on_resize(self, signum, frame):
+        self._resized = True
+
+    def take_resized(self):
+        "True if the terminal might have changed size since the last time this was asked."
+        resized = self._resized or not self.watches_resize
+        self._resized = False
+        return resized
+
+    def add_reader(self, fileobj, callback:Callable[[], None]):
+        "Calls `callback` whenever `fileobj` has something to read."
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fileobj):
+        self.selector.unregister(fileobj)
+
+    def wake(self):
+        "Wakes the loop up from any thread."
+        try:
+            self._wake_write.send(b"\0")
+        except (BlockingIOError, OSError):
+            # already full of wake ups, or closed on the way out
+            pass
+
+    def wait(self, timeout:float | None = None):
+        """
+        Blocks until there is input, a resize or a wake up, or `timeout` runs out, then runs the
+        callbacks of whatever happened.  A timeout of None waits for as long as it takes.
+        """
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self._wake_read:
+                try:
+                    while self._wake_read.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                key.data()
+
+    def close(self):
+        if self.watches_resize:
+            signal.signal(signal.SIGWINCH, self._old_handler)
+            signal.set_wakeup_fd(self._old_wakeup_fd)
+        self.selector.close()
+        self._wake_read.close()
+        self._wake_write.close()
@@ -1,15 +1,153 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
+import ast
+import hashlib
+import importlib
+import json
+import os
 from types import ModuleType
+from deadpad.parts.cache import cache_dir, read_cache, write_cache
+from deadpad.parts.grammar import GrammarLexer, load_grammar
 if TYPE_CHECKING:
     from deadpad import Editor
 
+MANIFEST_VERSION = 2
+"Goes up whenever what goes in the manifest changes, so an older one gets rebuilt."
+
+def load_parser(kind:str, name:str, path:str):
+    "Builds an extension's parser without an editor, for lexing in another process."
+    if kind == "grammar":
+        return load_grammar(path)
+    return importlib.import_module(f"deadpad.extensions.{name}").Parser(None)
+
 class Extension:
-    def __init__(self, master, name:str, module:ModuleType) -> None:
-        "Holds metadata and type information for the extensions."
+    kind = "module"
+
+    def __init__(self, master, name:str, path:str, file_exts:list[str], description:str, budget:float | None = None) -> None:
+        """
+        Holds metadata and type information for the extensions.
+
+        The metadata comes from the manifest, the module is only imported and the parser only built
+        the first time a file the extension highlights gets opened.
+        """
         self.master:Editor = master
         self.name = name
-        self.module = module
-        self.DESCRIPTION:str = self.module.DESCRIPTION
-        self.FILE_EXT:str = self.module.FILE_EXT
-        self.parser:self.module.Parser | None = self.module.Parser(master) if hasattr(self.module, "Parser") else None
\ No newline at end of file
+        self.path = path
+        self.DESCRIPTION:str = description
+        self.FILE_EXT:str = file_exts[0]
+        self.file_exts:set[str] = set(file_exts)
+        "Every file extension the extension highlights."
+        self.budget = budget
+        "How many seconds the extension gets to lex what one frame needs, None for the `highlight_budget` setting."
+        self._module:ModuleType | None = None
+        self._parser = None
+        self._loaded = False
+
+    @property
+    def module(self) -> ModuleType | None:
+        if self._module is None:
+            self._module = importlib.import_module(f"deadpad.extensions.{self.name}")
+        return self._module
+
+    @property
+    def parser(self):
+        "The extension's parser, built the first time it is asked for."
+        if not self._loaded:
+            self._parser = self._load_parser()
+            self._loaded = True
+        return self._parser
+
+    @property
+    def loaded(self):
+        "True once the parser has been built."
+        return self._loaded
+
+    def _load_parser(self):
+        return self.module.Parser(self.master) if hasattr(self.module, "Parser") else None
+
+class GrammarExtension(Extension):
+    "An extension that is just a grammar file, its parser is the lexer compiled from the grammar."
+    kind = "grammar"
+
+    @property
+    def module(self) -> None:
+        return None
+
+    def _load_parser(self) -> GrammarLexer:
+        return load_grammar(self.path)
+
+def _module_metadata(path:str) -> dict[str, Any]:
+    "Reads `FILE_EXT`, `DESCRIPTION` and `HIGHLIGHT_BUDGET` out of an extension's source without running any of it."
+    with open(path, "rb") as file:
+        tree = ast.parse(file.read(), path)
+    metadata = {}
+    for node in tree.body:
+        match node:
+            case ast.Assign(targets=[ast.Name(id=("FILE_EXT" | "DESCRIPTION" | "HIGHLIGHT_BUDGET") as name)], value=value) | \
+                 ast.AnnAssign(target=ast.Name(id=("FILE_EXT" | "DESCRIPTION" | "HIGHLIGHT_BUDGET") as name), value=value) if value is not None:
+                try:
+                    metadata[name] = ast.literal_eval(value)
+                except ValueError:
+                    # worked out when the module runs, so it has to be imported to find out
+                    pass
+    return metadata
+
+def _signature(extensions_path:str) -> list[list]:
+    "What the extensions directory looks like, if any of it changes the manifest gets rebuilt."
+    signature = []
+    for entry in sorted(os.listdir(extensions_path)):
+        path = os.path.join(extensions_path, entry)
+        if os.path.isdir(path):
+            path = os.path.join(path, "__init__.py")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signature.append([entry, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+def scan_extensions(extensions_path:str) -> dict[str, dict[str, Any]]:
+    "Finds every extension in `extensions_path` and what files it is for, the only modules imported are ones whose metadata is not written out plainly."
+    extensions = {}
+    for entry in sorted(os.listdir(extensions_path)):
+        path = os.path.join(extensions_path, entry)
+        if entry.endswith(".json"):
+            # a grammar, highlighting without any python
+            with open(path, "r", encoding="utf8") as file:
+                grammar = json.load(file)
+            name, kind, file_ext, description, budget = entry[:-5], "grammar", grammar["file_ext"], grammar.get("description", ""), grammar.get("budget")
+        elif not entry.startswith(("__", ".")) and os.path.isfile(os.path.join(path, "__init__.py")):
+            metadata = _module_metadata(os.path.join(path, "__init__.py"))
+            if "FILE_EXT" not in metadata or "DESCRIPTION" not in metadata:
+                module = importlib.import_module(f"deadpad.extensions.{entry}")
+                metadata = {"FILE_EXT": module.FILE_EXT, "DESCRIPTION": module.DESCRIPTION, "HIGHLIGHT_BUDGET": getattr(module, "HIGHLIGHT_BUDGET", None)}
+            name, kind, file_ext, description, budget = entry, "module", metadata["FILE_EXT"], metadata["DESCRIPTION"], metadata.get("HIGHLIGHT_BUDGET")
+        else:
+            continue
+        extensions[name] = {
+            "kind": kind,
+            "entry": entry,
+            "file_exts": [file_ext] if isinstance(file_ext, str) else list(file_ext),
+            "description": description,
+            "budget": budget,
+        }
+    return extensions
+
+def load_manifest(extensions_path:str) -> dict[str, dict[str, Any]]:
+    """
+    The extensions in `extensions_path` by name, with the kind of extension, its file in the directory,
+    the file extensions it highlights, its description and its highlighting budget.
+
+    It is cached between runs and only scanned again when something in the directory changed, so
+    starting up costs a stat per extension no matter how big they are.
+    """
+    extensions_path = os.path.abspath(extensions_path)
+    signature = _signature(extensions_path)
+    key = hashlib.sha256(extensions_path.encode()).hexdigest()
+    manifest_path = cache_dir("extensions", f"{key}.json")
+    manifest = read_cache(manifest_path)
+    if isinstance(manifest, dict) and manifest.get("version") == MANIFEST_VERSION and manifest.get("signature") == signature:
+        return manifest["extensions"]
+    extensions = scan_extensions(extensions_path)
+    write_cache(manifest_path, {"version": MANIFEST_VERSION, "signature": signature, "extensions": extensions})
+    return extensions
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import hashlib
+import json
+import re
+from typing import Any
+from deadpad.parts.cache import cache_dir, read_cache, write_cache
+
+GRAMMAR_VERSION = 1
+"Goes up whenever the way grammars are compiled changes, so lexers cached by an older version are not used."
+
+MAX_STALLS = 16
+"How many times in a row a line can switch context without moving on before the rest of it is left alone."
+
+def compile_grammar(grammar:dict[str, Any]) -> tuple[dict[str, Any], dict[str, re.Pattern]]:
+    """
+    Turns a grammar into what a `GrammarLexer` runs on, and the pattern of each context compiled.
+
+    Every context's rules become one pattern, each rule a named group in it in the order they are
+    written so the first rule that matches wins, next to a list of what each group means: the theme
+    type to draw it with, the context to push and whether to pop back to the context before.  The
+    first part is plain data that can be cached, the compiled patterns can't be.
+    """
+    contexts:dict[str, tuple[str, list]] = {}
+    patterns:dict[str, re.Pattern] = {}
+    for context, rules in grammar["contexts"].items():
+        parts = []
+        sources = []
+        actions = []
+        for index, rule in enumerate(rules):
+            if "words" in rule:
+                # longest first, so a word is never cut short by one that starts it
+                words = sorted(rule["words"], key=len, reverse=True)
+                pattern = r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b"
+            else:
+                pattern = rule["match"]
+            if rule.get("ignore_case"):
+                pattern = f"(?i:{pattern})"
+            push = rule.get("push")
+            if push is not None and push not in grammar["contexts"]:
+                raise ValueError(f"Rule {index} of the \"{context}\" context in the {grammar['name']} grammar pushes \"{push}\", which is not a context.")
+            sources.append(pattern)
+            parts.append(f"(?P<rule{index}>{pattern})")
+            actions.append((rule.get("token"), push, bool(rule.get("pop", False))))
+        contexts[context] = ("|".join(parts), actions)
+        try:
+            patterns[context] = re.compile(contexts[context][0])
+        except re.error as error:
+            # only compile the rules one by one to find the one that is wrong
+            for index, pattern in enumerate(sources):
+                try:
+                    re.compile(pattern)
+                except re.error as rule_error:
+                    raise ValueError(f"Rule {index} of the \"{context}\" context in the {grammar['name']} grammar does not compile: {rule_error}")
+            raise ValueError(f"The \"{context}\" context in the {grammar['name']} grammar does not compile: {error}")
+    return {
+        "name": grammar["name"],
+        "description": grammar.get("description", ""),
+        "file_ext": grammar["file_ext"],
+        "start": grammar.get("start", "main"),
+        "contexts": contexts,
+    }, patterns
+
+def load_grammar(path:str) -> GrammarLexer:
+    """
+    Loads the grammar at `path`.  What `compile_grammar` makes of a grammar, its rules checked and
+    folded into one pattern a context, is cached on disk by the hash of the grammar file, so an edited
+    grammar gets compiled again.  Regexes can't be cached, so the patterns of a cached grammar still
+    get compiled by the regex engine on every load.
+    """
+    with open(path, "rb") as file:
+        source = file.read()
+    key = hashlib.sha256(source + b"\0" + str(GRAMMAR_VERSION).encode()).hexdigest()
+    cache_path = cache_dir("grammars", f"{key}.json")
+    compiled = read_cache(cache_path)
+    if compiled is not None:
+        return GrammarLexer(compiled)
+    compiled, patterns = compile_grammar(json.loads(source))
+    write_cache(cache_path, compiled)
+    return GrammarLexer(compiled, patterns)
+
+class GrammarLexer:
+    """
+    Highlights a line at a time by a compiled grammar, all of the scanning is done by the regex engine.
+
+    The state between lines is the stack of contexts that are open, as a tuple, or None when only the
+    starting context is.  Text that no rule matches is left without a span.
+    """
+    def __init__(self, compiled:dict[str, Any], patterns:dict[str, re.Pattern] | None = None) -> None:
+        self.name:str = compiled["name"]
+        self.description:str = compiled["description"]
+        file_ext = compiled["file_ext"]
+        self.file_exts:list[str] = [file_ext] if isinstance(file_ext, str) else list(file_ext)
+        self.start:str = compiled["start"]
+        self.contexts:dict[str, tuple[re.Pattern, dict[int, tuple[str | None, str | None, bool]]]] = {}
+        "The pattern of each context and what each of its rules does, by the number of the rule's group."
+        for context, (pattern, actions) in compiled["contexts"].items():
+            # the patterns come already compiled when the grammar was just compiled
+            compiled_pattern = patterns[context] if patterns is not None else re.compile(pattern)
+            self.contexts[context] = (compiled_pattern, {
+                compiled_pattern.groupindex[f"rule{index}"]: tuple(action)
+                for index, action in enumerate(actions)
+            })
+
+    def lex_line(self, line:str, state:tuple[str, ...] | None = None) -> tuple[list[tuple[int, int, str]], tuple[str, ...] | None]:
+        "Returns the spans of `line` as (start column, end column, theme type) and the state it ends in."
+        text = line.rstrip("\r\n")
+        stack = state or (self.start,)
+        spans = []
+        pos = 0
+        stalls = 0
+        while stalls < MAX_STALLS:
+            pattern, actions = self.contexts[stack[-1]]
+            for match in pattern.finditer(text, pos):
+                token, push, pop = actions[match.lastindex]
+                start, end = match.span()
+                if token is not None and end > start:
+                    if spans and spans[-1][1] == start and spans[-1][2] == token:
+                        # one span for a run of the same thing, like a string and its escapes
+                        spans[-1] = (spans[-1][0], end, token)
+                    else:
+                        spans.append((start, end, token))
+                if push is not None or pop:
+                    if pop and len(stack) > 1:
+                        stack = stack[:-1]
+                    if push is not None:
+                        stack = stack + (push,)
+                    stalls = stalls + 1 if end == pos else 0
+                    pos = end
+                    break
+            else:
+                break
+        return spans, None if stack == (self.start,) else stack
@@ -0,0 +1,97 @@
+from __future__ import annotations
+from deadpad.parts.input import keys
+
+class EscapeParser:
+    """
+    Splits the raw bytes read from a terminal into keys.
+
+    It is fed whatever each read returned and keeps anything that was cut off (half of an
+    escape sequence or of a utf8 character) until the rest of it shows up in a later read.
+    Keys come out in the same form the rest of the editor compares against in `keys`:
+    a character, an escape sequence like `\\x1b[A`, or an SGR mouse report like `\\x1b[<0;3;4M`.
+    A bracketed paste comes out as one key, `keys.PASTE_START` followed by the pasted bytes.
+    """
+    def __init__(self) -> None:
+        self._pending = b""
+        self._paste:bytearray | None = None
+        "What has been pasted so far while inside of a bracketed paste."
+
+    def feed(self, data:bytes) -> list[bytes]:
+        "Parses `data` and returns every key that is complete, a whole paste comes out as one."
+        found = []
+        if self._paste is not None:
+            data = self._collect_paste(data, found)
+        data = self._pending + data
+        pos = 0
+        while pos < len(data):
+            size = self._key_size(data, pos)
+            if size == 0:
+                break
+            key = data[pos:pos + size]
+            pos += size
+            if key == keys.PASTE_START:
+                # everything up to the end marker is text, even if it looks like keys
+                self._paste = bytearray()
+                data = self._collect_paste(data[pos:], found)
+                pos = 0
+                continue
+            if key.startswith(b"\x1bO"):
+                # SS3 keys (arrows, home and end in application mode) mean the same as their CSI forms
+                key = b"\x1b[" + key[2:]
+            elif key.startswith(b"\x1b[M") and len(key) == 6:
+                key = self._x10_mouse(key)
+            found.append(key)
+        self._pending = data[pos:]
+        return found
+
+    def _collect_paste(self, data:bytes, found:list[bytes]) -> bytes:
+        "Adds `data` to the paste, returns whatever comes after the end of it (nothing if it has not ended)."
+        paste = self._paste
+        # the end marker could have been cut in half by the last read
+        start = max(len(paste) - len(keys.PASTE_END) + 1, 0)
+        paste += data
+        index = paste.find(keys.PASTE_END, start)
+        if index == -1:
+            return b""
+        found.append(keys.PASTE_START + bytes(paste[:index]))
+        self._paste = None
+        return bytes(paste[index + len(keys.PASTE_END):])
+
+    def _key_size(self, data:bytes, pos:int) -> int:
+        "How many bytes the key starting at `pos` takes up, or 0 if it is not all there yet."
+        end = len(data)
+        first = data[pos]
+        if first != 0x1b:
+            if first < 0x80:
+                return 1
+            # utf8, the lead byte says how long the character is
+            size = 2 if first < 0xe0 else 3 if first < 0xf0 else 4
+            if first < 0xc0:
+                # a stray continuation byte, pass it on by itself
+                size = 1
+            return size if pos + size <= end else 0
+        if pos + 1 >= end:
+            return 0
+        second = data[pos + 1]
+        if second == ord("O"):
+            return 3 if pos + 2 < end else 0
+        if second != ord("["):
+            # escape followed by a key, the way the terminal sends alt+key and how esc esc quits
+            return 2
+        # CSI, parameters and intermediates until a final byte from @ to ~
+        index = pos + 2
+        while index < end:
+            byte = data[index]
+            if 0x40 <= byte <= 0x7e:
+                if byte == ord("M") and index == pos + 2:
+                    # an old style mouse report, three raw bytes follow the M
+                    return 6 if pos + 6 <= end else 0
+                return index - pos + 1
+            index += 1
+        return 0
+
+    def _x10_mouse(self, key:bytes):
+        "Rewrites an old style mouse report as the SGR report the editor understands."
+        button, col, row = key[3] - 32, key[4] - 32, key[5] - 32
+        state = "m" if button & 3 == 3 else "M"
+        return f"\x1b[<{button};{col};{row}{state}".encode()
@@ -1,8 +1,13 @@
+from __future__ import annotations
 import platform
 import threading as th
-from queue import Queue
+import time
+from collections import deque
 from enum import Enum
+from typing import TYPE_CHECKING, Callable
 from deadpad.parts.input import keys
+if TYPE_CHECKING:
+    from deadpad.parts.event_loop import EventLoop
 
 opsys = platform.system()
 
@@ -13,6 +18,7 @@ opsys = platform.system()
 class InputType(Enum):
     MOUSE = 0
     KEYBOARD = 1
+    PASTE = 2
 
 KEY_FILTER = {
             b'\r':b'\n'
@@ -35,9 +41,18 @@ class MouseData:
 
 class InputEvent:
     def __init__(self, inp:str | tuple[int,int,int,int]) -> None:
+        self.time = time.perf_counter()
+        "When the input was read, used to measure how long it takes to show up on screen."
+        self.count = 1
+        "How many times in a row this input came in, repeats get merged into one event."
         if isinstance(inp, str):
             inp = inp.encode()
         self.inp = KEY_FILTER[inp] if inp in KEY_FILTER.keys() else inp
+        if isinstance(self.inp, bytes) and self.inp.startswith(keys.PASTE_START):
+            # the whole paste is the input
+            self.inp = self.inp[len(keys.PASTE_START):]
+            self.type = InputType.PASTE
+            return
         
         if opsys == 'Linux':
             if self.inp.startswith(keys.MOUSE_PREFIX):
@@ -54,16 +69,84 @@ class InputEvent:
                 # parse mouse into metadata here
                 self.mouse_data:MouseData | None = MouseData(self.inp)
 
+REPEATABLE_KEYS = {keys.UP, keys.DOWN, keys.LEFT, keys.RIGHT, keys.PAGE_UP, keys.PAGE_DOWN}
+"Keys where pressing them a few times does the same as pressing them once with a count."
+
+def _merges_into(last:InputEvent, event:InputEvent):
+    "True if `event` can be folded into `last`, the event queued right before it."
+    if last.type != event.type:
+        return False
+    if event.type != InputType.MOUSE:
+        return event.inp == last.inp and event.inp in REPEATABLE_KEYS
+    last_type, event_type = last.mouse_data.event_type, event.mouse_data.event_type
+    if last_type != event_type or last.mouse_data.event_state != event.mouse_data.event_state:
+        return False
+    return event_type in {keys.MOUSE_SCROLL_UP, keys.MOUSE_SCROLL_DOWN} or bool(event_type & keys.MOUSE_MOTION)
+
+class EventQueue:
+    """
+    The queue input events wait in until the main loop gets to them.
+
+    Nothing is ever dropped.  Instead, runs of the same thing are merged as they come in:
+    mouse motion only keeps where the mouse ended up, and scroll ticks and arrow keys
+    are counted up on one event.  So a flood of motion or a held down key stays a handful
+    of events, and the keys typed in between all still make it through.
+    """
+    def __init__(self) -> None:
+        self._events:deque[InputEvent] = deque()
+        self._lock = th.Lock()
+
+    def put(self, event:InputEvent):
+        with self._lock:
+            last = self._events[-1] if self._events else None
+            if last is None or not _merges_into(last, event):
+                self._events.append(event)
+            elif event.type == InputType.MOUSE and event.mouse_data.event_type & keys.MOUSE_MOTION:
+                # only where the mouse is now matters, but keep the time of the first motion
+                event.time = last.time
+                self._events[-1] = event
+            else:
+                last.count += event.count
+
+    def get(self) -> InputEvent | None:
+        with self._lock:
+            return self._events.popleft() if self._events else None
+
+    def get_batch(self) -> list[InputEvent]:
+        "Takes every event that is waiting."
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def empty(self):
+        return not self._events
+
+    def __len__(self):
+        return len(self._events)
+
 class BaseInputHandler:
 
     def __init__(self) -> None:
         self._processing_thread = th.Thread(target=self._detect_keys, daemon=True)
         self.checking_for_input = True
-        self.input_queue:Queue[InputEvent] = Queue(2)
+        self.input_queue = EventQueue()
+        self.on_input:Callable[[], None] | None = None
+        "Called from the input thread whenever an event gets queued, so the main loop can wake up."
 
     def _detect_keys(self):
         "While true and queue keys."
 
+    def attach(self, events:EventLoop):
+        "Hooks the handler up to the main loop so input wakes it up."
+        self.on_input = events.wake
+
+    def put(self, event:InputEvent):
+        "Queues an input event and lets the main loop know about it."
+        self.input_queue.put(event)
+        if self.on_input:
+            self.on_input()
+
 
     def start(self):
         "Start recording inputs."
@@ -76,5 +159,8 @@ class BaseInputHandler:
 
     def get(self):
         "Get the next input in the input queue"
-        if not self.input_queue.empty():
-            return self.input_queue.get(False)
\ No newline at end of file
+        return self.input_queue.get()
+
+    def get_batch(self):
+        "Get every input waiting in the input queue, in order."
+        return self.input_queue.get_batch()
\ No newline at end of file
@@ -9,10 +9,17 @@ UP = b'\x1b[A' if opsys == 'Linux' else b'\xe0H'
 DOWN = b'\x1b[B' if opsys == 'Linux' else b'\xe0P'
 HOME = b'\x1b[H' if opsys == 'Linux' else b'\xe0G'
 END = b'\x1b[F' if opsys == 'Linux' else b'\xe0O'
+PAGE_UP = b'\x1b[5~' if opsys == 'Linux' else b'\xe0I'
+PAGE_DOWN = b'\x1b[6~' if opsys == 'Linux' else b'\xe0Q'
 ESC = b'\x1b\x1b' if opsys == 'Linux' else b'\x1b'
 BACKSPACE = b'\x7f' if opsys == 'Linux' else b'\x08'
 CTRL_O = b'\x0f' if opsys == 'Linux' else b'\x0f'
 CTRL_W = b'\x17' if opsys == 'Linux' else b'\x17'
+CTRL_Y = b'\x19' if opsys == 'Linux' else b'\x19'
+CTRL_Z = b'\x1a' if opsys == 'Linux' else b'\x1a'
 MOUSE_PREFIX = b'\x1b[<' if opsys == 'Linux' else b'MOUSE' # TODO decide what header windows will use for mouse events
 MOUSE_SCROLL_UP  = 64 if opsys == 'Linux' else 0 # TODO decide what header windows will use for mouse events
-MOUSE_SCROLL_DOWN  = 65 if opsys == 'Linux' else 0 # TODO decide what header windows will use for mouse events
\ No newline at end of file
+MOUSE_SCROLL_DOWN  = 65 if opsys == 'Linux' else 0 # TODO decide what header windows will use for mouse events
+MOUSE_MOTION = 32 if opsys == 'Linux' else 0 # TODO decide what header windows will use for mouse events
+PASTE_START = b'\x1b[200~' if opsys == 'Linux' else b'PASTE' # TODO decide what header windows will use for pastes
+PASTE_END = b'\x1b[201~'
@@ -1,80 +1,90 @@
+from __future__ import annotations
 import sys
 import termios
-import time
 import tty
+from typing import TYPE_CHECKING
+from deadpad.parts.input.escape_parser import EscapeParser
 from deadpad.parts.input.input_handler import BaseInputHandler, InputEvent
 import os
-import io
+if TYPE_CHECKING:
+    from deadpad.parts.event_loop import EventLoop
 
+MOUSE_ON = "\x1b[?1000h\x1b[?1003h\x1b[?1015h\x1b[?1006h"
+MOUSE_OFF = "\x1b[?1000l\x1b[?1003l\x1b[?1015l\x1b[?1006l"
+PASTE_ON = "\x1b[?2004h"
+"Bracketed paste, so a paste comes in as one block of text instead of a key per character."
+PASTE_OFF = "\x1b[?2004l"
 
+class InputHandler(BaseInputHandler):
+    """
+    Reads the terminal straight from the main loop, no thread.
 
-def getch():
-    fd = sys.stdin.fileno()
-    orig = termios.tcgetattr(fd)
-    
-    try:
-        tty.setcbreak(fd)
-        sys.stdout.write("\x1b[?1000h\x1b[?1003h\x1b[?1015h\x1b[?1006h") # enable mouse mode
-        sys.stdout.flush()
-        inp = sys.stdin.read(1)
-        if inp == "\x1b":# if it is an escape code read the rest of the bytes
-            inp += (ch2 := sys.stdin.read(1))
-            if ch2 == '[':
-                # escape sequence
-                while not (chn := sys.stdin.read(1)).isalpha():
-                    inp += chn
-                else:
-                    inp += chn
-        sys.stdin.flush()
-        sys.stdout.write("\x1b[?1000l\x1b[?1003l\x1b[?1015l\x1b[?1006l") # stop mouse mode
-        sys.stdout.flush()
-    finally:
-        termios.tcsetattr(fd, termios.TCSAFLUSH, orig)
-    return inp
-    
+    The terminal is put in raw mode (with mouse reporting and bracketed paste turned on) once for
+    the whole session, then every time stdin is readable whatever is there gets read in one go and
+    split into keys.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.fd = sys.stdin.fileno()
+        self.parser = EscapeParser()
+        self._orig_attr = None
+        self._events:EventLoop | None = None
 
-class InputHandler(BaseInputHandler):
+    def attach(self, events:EventLoop):
+        self._events = events
 
     def start(self):
-        # disable stdin echo
-        fd = sys.stdin.fileno()
-        new_term_attr = termios.tcgetattr(fd)
-        new_term_attr[3] &= ~termios.ECHO
-        termios.tcsetattr(fd, termios.TCSANOW, new_term_attr)
-        # end disable stdin echo
-        #sys.stdout.write("\x1b[?1000h\x1b[?1003h\x1b[?1015h\x1b[?1006h") # enable mouse mode
-        #sys.stdout.flush()
-        super().start()
+        if not sys.stdin.isatty():
+            return
+        self._orig_attr = termios.tcgetattr(self.fd)
+        tty.setraw(self.fd)
+        # keep output processing so a stray newline still goes back to the start of the row
+        attr = termios.tcgetattr(self.fd)
+        attr[1] |= termios.OPOST
+        termios.tcsetattr(self.fd, termios.TCSANOW, attr)
+        sys.stdout.write(MOUSE_ON + PASTE_ON)
+        sys.stdout.flush()
+        self.checking_for_input = True
+        if self._events:
+            self._events.add_reader(self.fd, self._read)
 
     def stop(self):
-        sys.stdout.write("\x1b[?1000l\x1b[?1003l\x1b[?1015l\x1b[?1006l") # stop mouse mode
+        self.checking_for_input = False
+        if self._orig_attr is None:
+            return
+        if self._events:
+            self._events.remove_reader(self.fd)
+        sys.stdout.write(MOUSE_OFF + PASTE_OFF)
         sys.stdout.flush()
-        super().stop()
-
-    def _detect_keys(self):
-        while self.checking_for_input:
-            if self.input_queue.full():
-                self.input_queue.get(False)
-                self.input_queue.get(False)
-            if sys.stdin.isatty():
-                key = getch()
-                if key:
-                    self.input_queue.put(InputEvent(key), False)
-            
+        termios.tcsetattr(self.fd, termios.TCSAFLUSH, self._orig_attr)
+        self._orig_attr = None
 
+    def _read(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        if not data:
+            # the terminal went away, stop listening so the loop does not spin on it
+            self._events.remove_reader(self.fd)
+            return
+        for key in self.parser.feed(data):
+            self.put(InputEvent(key))
 
 
 if __name__ == "__main__":
-    fd = sys.stdin.fileno()
-    orig = termios.tcgetattr(fd)
+    from deadpad.parts.event_loop import EventLoop
+    events = EventLoop()
     ih = InputHandler()
+    ih.attach(events)
     ih.start()
-    while True:
-        if (char := ih.get()) != None:
-            print(repr(char))
-            if char == b'~':
-                break
-        time.sleep(0.1)
-    ih.stop()
-    termios.tcsetattr(fd, termios.TCSAFLUSH, orig)
-        
+    try:
+        while True:
+            events.wait()
+            while (event := ih.get()) != None:
+                print(repr(event.inp), end="\r\n")
+                if event.inp == b'~':
+                    raise SystemExit
+    finally:
+        ih.stop()
+        events.close()
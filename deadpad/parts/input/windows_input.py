@@ -12,13 +12,10 @@ class InputHandler(BaseInputHandler):
     
     def _detect_keys(self):
         while self.checking_for_input:
-            if self.input_queue.full():
-                self.input_queue.get(False)
-                self.input_queue.get(False)
             raw_inp = c_inp.get_key()
             sys.stdin.flush()
             if raw_inp:
-                self.input_queue.put(InputEvent(raw_inp), False)
+                self.put(InputEvent(raw_inp))
         
 if __name__ == "__main__":
     def t1():
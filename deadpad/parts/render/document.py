@@ -1,146 +1,776 @@
 from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from enum import Enum
+import random
+import re
 import sys
+import threading as th
 import datetime
-from typing import TYPE_CHECKING
+import os
+import unicodedata
+from typing import TYPE_CHECKING, Iterator
 
 from deadpad.parts.input import keys
 from deadpad.parts.input.input_handler import InputEvent
+from deadpad.parts.render.wrap_index import WrapIndex
+from deadpad.parts.render.mapped_file import MappedFile
+from deadpad.parts.render.history import EditHistory
+from deadpad.parts.render.journal import Edit, EditJournal, discard_journal, read_journal
+from deadpad.parts.render.save import BackgroundSave
 if TYPE_CHECKING:
+    from deadpad.parts.render.highlight import HighlightCache
     from deadpad.parts.render.textscreen import TextScreen
     from deadpad import Editor
 
 # TODO Add line class to keep track of line numbers (should have all string functions implemented)
 
 
-def chrweight(char:str):
+TAB_SIZE = 4
+
+_char_widths:dict[str, int] = {}
+
+# characters that might not be exactly one cell wide
+_SPECIAL_CHARS = re.compile("[\t\r\u0300-\U0010ffff]")
+
+def chrweight(char:str, col:int = 0, tab_size:int = TAB_SIZE):
+    "How many cells `char` takes up on screen when it is drawn at column `col`."
     match char:
         case "\t":
-            return 3
+            return tab_size - col % tab_size
         case None: # equivalent of space in textscreen
             return 1
+        case "\r": # drawn as part of the newline after it
+            return 0
         case _:
-            return 1
+            if char < "\u0300":
+                return 1
+            weight = _char_widths.get(char)
+            if weight is None:
+                if unicodedata.combining(char):
+                    weight = 0
+                elif unicodedata.east_asian_width(char) in {"W", "F"}:
+                    weight = 2
+                else:
+                    weight = 1
+                _char_widths[char] = weight
+            return weight
         
-def str_weight(string:str):
+def str_weight(string:str, tab_size:int = TAB_SIZE):
+    "How many cells `string` takes up on screen, with tabs lined up to tab stops."
+    if string.isascii() and "\t" not in string and "\r" not in string:
+        return len(string)
     weight = 0
     for char in string:
-        weight += chrweight(char)
+        if char is not None:
+            weight += chrweight(char, weight, tab_size)
+        else:
+            weight += 1
     return weight
 
-def chunk_str_by_weight(string:str, chunk_size:int):
-    chunks:list[str] = []
-    str_buff = ""
-    chr_ind = 0
-    while chr_ind < len(string):
-        str_buff = ""
-        while (str_weight(str_buff) + chrweight(string[chr_ind])) < chunk_size \
-        if chr_ind < len(string) else False:
-            str_buff += string[chr_ind]
-            chr_ind += 1
-        chunks.append(str_buff)
-        
-    return chunks
+def measure_line(line:str, width:int, tab_size:int = TAB_SIZE) -> tuple[list[str], int]:
+    "Wraps `line` into rows of at most `width` cells, and says how wide it is unwrapped."
+    width = max(width, 2)
+    if line.isascii() and "\t" not in line and "\r" not in line:
+        # every character is one cell wide so the rows can just be sliced out
+        if len(line) <= width:
+            return [line], len(line)
+        return [line[i:i + width] for i in range(0, len(line), width)], len(line)
+
+    rows:list[str] = []
+    row_start = 0
+    col = 0
+    total = 0
+    pos = 0
+    # runs of plain characters are one cell each, so only the characters between them get looked at one by one
+    for match in _SPECIAL_CHARS.finditer(line + "\r"):
+        i = match.start()
+        run = i - pos
+        total += run
+        while col + run > width:
+            take = max(width - col, 0)
+            rows.append(line[row_start:pos + take])
+            row_start = pos = pos + take
+            run -= take
+            col = 0
+        col += run
+        if i == len(line):
+            break
+        char = match.group()
+        if char == "\t":
+            total += tab_size - total % tab_size
+            weight = tab_size - col % tab_size
+        else:
+            weight = chrweight(char)
+            total += weight
+        if col + weight > width and i > row_start:
+            rows.append(line[row_start:i])
+            row_start = i
+            col = 0
+            if char == "\t":
+                weight = tab_size
+        col += weight
+        pos = i + 1
+    rows.append(line[row_start:])
+    return rows, total
+
+def chunk_str_by_weight(string:str, chunk_size:int, tab_size:int = TAB_SIZE):
+    return measure_line(string, chunk_size, tab_size)[0]
 
-def newline_chunkstring(string:str, length:int):
+def newline_chunkstring(string:str, length:int, tab_size:int = TAB_SIZE):
     
     ret:list[str] = []
     for chunk in string.splitlines(True):
-        # TODO split into chunks based on actual size since tabs are bigger
-        chunks = []
-        if str_weight(chunk) > length:
-            chunks = chunk_str_by_weight(chunk, length)
-        else:
-            chunks = [chunk]
-        for sub_chunk in chunks:
-            ret.append(sub_chunk)
+        ret.extend(chunk_str_by_weight(chunk, length, tab_size))
     return ret
 
 if __name__ == "__main__":
     for chunk in newline_chunkstring("\t\t\twjdkjwkj       djk wdja hwhdgjiwa dj \t \t\twjdjwkjdkk\n", 20):
         print(repr(chunk))
 
+class NewlineIndex:
+    "The offset of every `\\n` in a buffer, for finding lines inside of the pieces of a `PieceTable`."
+    def __init__(self, data:bytes = b"") -> None:
+        self.offsets = array('q')
+        self.extend(data, 0)
+
+    def extend(self, data:bytes, base:int):
+        "Adds the newlines in `data`, which was appended to the buffer at `base`."
+        offsets = self.offsets
+        find = data.find
+        pos = find(b"\n")
+        while pos != -1:
+            offsets.append(base + pos)
+            pos = find(b"\n", pos + 1)
+
+    def count(self, start:int, end:int):
+        "The number of newlines between `start` and `end`."
+        return bisect_left(self.offsets, end) - bisect_left(self.offsets, start)
+
+    def find(self, start:int, nth:int):
+        "The offset of the `nth` newline (counting from 0) at or after `start`."
+        return self.offsets[bisect_left(self.offsets, start) + nth]
+
+# the most bytes `PieceTable.pieces` hands out at once
+PIECE_CHUNK = 1 << 20
+
+class _Piece:
+    "A node in the `PieceTable` treap, `size` and `lines` are totals of its subtree."
+    __slots__ = ("buf", "start", "length", "newlines", "priority", "left", "right", "size", "lines")
+
+    def __init__(self, buf:int, start:int, length:int, newlines:int) -> None:
+        self.buf = buf
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.priority = random.random()
+        self.left:_Piece | None = None
+        self.right:_Piece | None = None
+        self.size = length
+        self.lines = newlines
+
+    def update(self):
+        size = self.length
+        lines = self.newlines
+        if self.left:
+            size += self.left.size
+            lines += self.left.lines
+        if self.right:
+            size += self.right.size
+            lines += self.right.lines
+        self.size = size
+        self.lines = lines
+
+class PieceTable:
+    "The text of a `Document` as pieces of the original and an append only add buffer, offsets are in bytes."
+    ORIGINAL = 0
+    ADD = 1
+
+    def __init__(self, original:bytes | MappedFile = b"") -> None:
+        self._buffers:list[bytes | bytearray | MappedFile] = [original, bytearray()]
+        # the mapped file while its newlines are still being counted, see `_recount`
+        self._loading:MappedFile | None = None
+        self._counted_to = 0
+        if isinstance(original, MappedFile):
+            self._newlines:list[NewlineIndex | MappedFile] = [original, NewlineIndex()]
+            self._loading = original
+            self._counted_to = original.indexed
+        else:
+            self._newlines = [NewlineIndex(original), NewlineIndex()]
+        self._root:_Piece | None = self._new_piece(self.ORIGINAL, 0, len(original)) if original else None
+
+    def __len__(self):
+        return self._root.size if self._root else 0
+
+    @property
+    def line_count(self):
+        "The number of newlines in the buffer, found so far while a mapped file is loading."
+        if self._loading:
+            self._recount()
+        return self._root.lines if self._root else 0
+
+    @property
+    def loading(self):
+        "True while a mapped original is still having its newlines counted."
+        return self._loading is not None and not self._loading.done.is_set()
+
+    def _recount(self):
+        "Catches the newline counts of the pieces up with the mapped file's index."
+        done = self._loading.done.is_set()
+        indexed = self._loading.indexed
+        if indexed == self._counted_to and not done:
+            return
+        self._recount_node(self._root, self._counted_to)
+        self._counted_to = indexed
+        if done:
+            self._loading = None
+
+    def _recount_node(self, node:_Piece | None, counted_to:int):
+        if node is None:
+            return
+        self._recount_node(node.left, counted_to)
+        self._recount_node(node.right, counted_to)
+        if node.buf == self.ORIGINAL and node.start + node.length > counted_to:
+            node.newlines = self._loading.counted(node.start, node.start + node.length)
+        node.update()
+
+    def _new_piece(self, buf:int, start:int, length:int):
+        if buf == self.ORIGINAL and self._loading:
+            # only the part of the piece the index has got to can be counted without waiting for it
+            return _Piece(buf, start, length, self._loading.counted(start, start + length))
+        return _Piece(buf, start, length, self._newlines[buf].count(start, start + length))
+
+    def _merge(self, left:_Piece | None, right:_Piece | None) -> _Piece | None:
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            left.update()
+            return left
+        right.left = self._merge(left, right.left)
+        right.update()
+        return right
+
+    def _split(self, node:_Piece | None, offset:int) -> tuple[_Piece | None, _Piece | None]:
+        "Splits the tree so the left side holds exactly `offset` bytes."
+        if node is None:
+            return None, None
+        left_size = node.left.size if node.left else 0
+        # what comes back up can have a piece split in two at the top, with a new priority that
+        # could be higher than this node's, so it gets merged back in to keep the tree balanced
+        if offset <= left_size:
+            left, inner = self._split(node.left, offset)
+            node.left = None
+            node.update()
+            return left, self._merge(inner, node)
+        offset -= left_size
+        if offset >= node.length:
+            inner, right = self._split(node.right, offset - node.length)
+            node.right = None
+            node.update()
+            return self._merge(node, inner), right
+        # the split point lands inside of this piece
+        head = self._new_piece(node.buf, node.start, offset)
+        tail = self._new_piece(node.buf, node.start + offset, node.length - offset)
+        return self._merge(node.left, head), self._merge(tail, node.right)
+
+    def insert(self, offset:int, data:bytes):
+        "Inserts `data` at the byte `offset`."
+        if not data:
+            return
+        add = self._buffers[self.ADD]
+        start = len(add)
+        add += data
+        self._newlines[self.ADD].extend(data, start)
+
+        left, right = self._split(self._root, offset)
+        if left is not None:
+            # typing runs straight on from the last insert, so grow that piece instead of adding one.
+            path:list[_Piece] = []
+            last = left
+            while last.right:
+                path.append(last)
+                last = last.right
+            if last.buf == self.ADD and last.start + last.length == start:
+                newlines = data.count(b"\n")
+                last.length += len(data)
+                last.newlines += newlines
+                last.update()
+                for node in path:
+                    node.size += len(data)
+                    node.lines += newlines
+                self._root = self._merge(left, right)
+                return
+        self._root = self._merge(self._merge(left, self._new_piece(self.ADD, start, len(data))), right)
+
+    def delete(self, offset:int, length:int):
+        "Deletes `length` bytes starting at the byte `offset`."
+        if length <= 0:
+            return
+        left, right = self._split(self._root, offset)
+        _, right = self._split(right, length)
+        self._root = self._merge(left, right)
+
+    def pieces(self, start:int = 0, end:int = None) -> Iterator[bytes]:
+        "Yields the text between `start` and `end` piece by piece, without joining it."
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        stack:list[tuple[_Piece, int]] = []
+        node, base = self._root, 0
+        while True:
+            while node:
+                piece_start = base + (node.left.size if node.left else 0)
+                stack.append((node, piece_start))
+                if piece_start <= start:
+                    # everything to the left ends before `start`
+                    break
+                node = node.left
+            if not stack:
+                return
+            node, piece_start = stack.pop()
+            piece_end = piece_start + node.length
+            if piece_start >= end:
+                return
+            if piece_end > start:
+                lo = node.start + max(start, piece_start) - piece_start
+                hi = node.start + min(end, piece_end) - piece_start
+                buf = self._buffers[node.buf]
+                # big pieces are handed out a bit at a time so they never get copied all at once
+                for chunk_start in range(lo, hi, PIECE_CHUNK):
+                    yield buf[chunk_start:min(hi, chunk_start + PIECE_CHUNK)]
+            node, base = node.right, piece_end
+
+    def slice(self, start:int = 0, end:int = None) -> bytes:
+        return b"".join(self.pieces(start, end))
+
+    def ranges(self) -> list[tuple[bytes | bytearray | MappedFile, int, int]]:
+        "The buffer, start and end of every piece in order, they stay readable after more edits."
+        ranges = []
+        stack:list[_Piece] = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            ranges.append((self._buffers[node.buf], node.start, node.start + node.length))
+            node = node.right
+        return ranges
+
+    def line_start(self, line:int) -> int:
+        "The byte offset that `line` starts at."
+        if line <= 0:
+            return 0
+        line_count = self.line_count
+        if line > line_count:
+            if self._loading is None:
+                return len(self)
+            # past the newlines counted so far, so look for the rest in the text after them
+            return self._scan_lines(self.line_start(line_count), line - line_count)
+        # find the offset of the line'th newline and step past it
+        node, base, remaining = self._root, 0, line
+        while node:
+            left_lines = node.left.lines if node.left else 0
+            if remaining <= left_lines:
+                node = node.left
+                continue
+            remaining -= left_lines
+            base += node.left.size if node.left else 0
+            if remaining <= node.newlines:
+                pos = self._newlines[node.buf].find(node.start, remaining - 1)
+                return base + pos - node.start + 1
+            remaining -= node.newlines
+            base += node.length
+            node = node.right
+        return len(self)
+
+    def _scan_lines(self, start:int, lines:int):
+        "The offset just after the `lines`th newline from `start` on, without the index."
+        for chunk in self.pieces(start):
+            count = chunk.count(b"\n")
+            if count >= lines:
+                pos = -1
+                for _ in range(lines):
+                    pos = chunk.find(b"\n", pos + 1)
+                return start + pos + 1
+            lines -= count
+            start += len(chunk)
+        return len(self)
+
+    def line_of(self, offset:int) -> int:
+        "The line that the byte at `offset` is on."
+        line = 0
+        node = self._root
+        while node:
+            left_size = node.left.size if node.left else 0
+            if offset < left_size:
+                node = node.left
+                continue
+            offset -= left_size
+            line += node.left.lines if node.left else 0
+            if offset < node.length:
+                return line + self._newlines[node.buf].count(node.start, node.start + offset)
+            offset -= node.length
+            line += node.newlines
+            node = node.right
+        return line
+
+    def line(self, line:int) -> bytes:
+        "The bytes of `line` including its newline."
+        return self.slice(self.line_start(line), self.line_start(line + 1))
+
 class CursorPosition:
+    "The cursor of a `Document` as a logical line and column, `x` and `y` are worked out on screen."
     def __init__(self, x:int, y:int, owner:Document) -> None:
-        self._x = x
-        self._y = y
+        self.line = y
+        self.col = x
         self.owner = owner
 
+    def _row(self):
+        "The index of the row the cursor is on inside of its line, and the column that row starts at."
+        chunks = self.owner.line_rows(self.line)
+        start = 0
+        for sub_row, chunk in enumerate(chunks):
+            if self.col < start + len(chunk) or sub_row == len(chunks) - 1:
+                return sub_row, start
+            start += len(chunk)
+
     @property
     def x(self):
-        return self._x
+        return self.col - self._row()[1]
     
     @property
     def y(self):
-        return self._y
+        return self.owner.wrap.row_of_line(self.line) + self._row()[0]
     
     @y.setter
     def y(self, val:int):
-        h = self.owner.height-1
-        state = self.owner.state
-        if val < 0:
-            self._y = 0
-        elif val > h:
-            self._y = h-1
-        else:
-            self._y = val
-        # reset the x cursor to its position
-        self.x = min(len(state[self.y])-1, self.x)
+        # keep the x cursor where it was, as long as the new row is long enough
+        self.place(self.x, min(max(val, 0), self.owner.height-1))
 
     @x.setter
     def x(self, val:int):
-        h = self.owner.height
-        state = self.owner.state
-        while (val >= len(state[self.y])) if self.y < h else False:
-            val -= len(state[self.y])
-            self.y += 1
-        
-        
-        while val < 0:
-            self.y -= 1
-            val += len(state[self.y])
+        col = self._row()[1] + val
+        length = len(self.owner.line(self.line))
+        if 0 <= col < length:
+            self.col = col
+        # anything past either end of the line carries over into the lines around it by offset
+        elif col < 0:
+            self.offset = self.owner.buffer.line_start(self.line) + col
+        else:
+            self.offset = self.owner.buffer.line_start(self.line + 1) + col - length
+
+    @property
+    def offset(self):
+        "The byte offset of the cursor in the document."
+        return self.owner.offset_of(self.line, self.col)
+
+    @offset.setter
+    def offset(self, val:int):
+        self.line, self.col = self.owner.position_of(val)
+
+    def place(self, x:int, y:int):
+        "Moves the cursor to column `x` of row `y` on screen."
+        line, sub_row = self.owner.wrap.locate(y)
+        chunks = self.owner.line_rows(line)
+        self.line = line
+        self.col = sum(len(chunk) for chunk in chunks[:sub_row]) + min(max(x, 0), len(chunks[sub_row])-1)
+
+    def move_to(self, line:int, col:int):
+        "Moves the cursor to column `col` of the logical line `line`."
+        self.line = line
+        self.col = col
+
+class DocumentRows:
+    "A read only, list like view of the rows that a `Document` wraps onto."
+    def __init__(self, owner:Document) -> None:
+        self.owner = owner
+
+    def __len__(self):
+        return self.owner.wrap.rows
+
+    def __getitem__(self, row:int):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.owner.row(row)
 
-        self._x = val
+    def __iter__(self):
+        for _, _, row in self.owner.rows_from(0):
+            yield row
 
 escapes = b''.join([chr(char).encode() for char in range(1, 32)])
+_PASTE_CONTROLS = {char: None for char in range(32) if chr(char) not in "\t\n"}
 
 class Document:
     def __init__(self, master:Editor, render_width:int, file_path:str) -> None:
         self.file_path = file_path
-        self.state:list[str] = [""]
+        self.master = master
         self.cursor = CursorPosition(0,0,self)
         self._recording_arrow = False
         self.render_width = render_width - 2
-        self.file = open(self.file_path, "r+", encoding="utf8")
-        t_str_state = self.file.read()
-        if t_str_state == "":
-            self.str_state = "\n"
-        else:
-            self.str_state = t_str_state if t_str_state[-1] == "\n" else t_str_state + "\n"
-        self.state = newline_chunkstring(self.str_state, self.render_width)
-        self.master = master
+        # the memory map when the file is too big to load
+        self.mapped:MappedFile | None = None
+        self._missing_newline = False
+        self._open_buffer()
+        # keep using whatever line ending the file already uses
+        first_line = self.buffer.line(0)
+        self.newline = b"\r\n" if first_line.endswith(b"\r\n") else b"\n"
+        self.wrap = WrapIndex(self._fetch_lines, measure_line, self.render_width, self.master.settings["tab_size"], self.buffer.line_count)
+        self.state = DocumentRows(self)
+        # set by the screen when an extension handles the file type
+        self.syntax:HighlightCache | None = None
         self.updated = True
+        self.edits = 0
+        # what `edits` was when the text in the file now was snapshotted
+        self._saved_edits = 0
+        self.saving:BackgroundSave | None = None
+        # what `edits` was when the save being written was snapshotted
+        self._saving_edits = 0
+        self._save_again = False
+        self.journal:EditJournal | None = EditJournal(file_path) if self.master.settings["journal"] else None
+        self._journal_mark = 0
+        # edits an earlier run left in the journal without saving, until they are replayed or discarded
+        self.recovered:tuple[list[Edit], float] | None = read_journal(file_path) if self.journal is not None else None
+        self.history = EditHistory(self.master.settings["undo_memory"], self.master.settings["undo_disk"])
+        # see `transaction`
+        self._deferring = 0
+        # the first line the open transaction edited, how many lines that was before and how many now
+        self._deferred_lines:tuple[int, int, int] | None = None
 
+    def _open_buffer(self):
+        if os.path.getsize(self.file_path) >= self.master.settings["large_file_size"]:
+            # big files get mapped instead of read, the lines are indexed in the background
+            self.mapped = MappedFile(self.file_path)
+            self.buffer = PieceTable(self.mapped)
+            # can't look at the end of the file without waiting for the index, so add the newline once it's done
+            self._missing_newline = self.mapped[len(self.mapped) - 1:] != b"\n"
+            return
+        with open(self.file_path, "rb") as file:
+            self.buffer = PieceTable(file.read())
+        if len(self.buffer) == 0 or self.buffer.slice(len(self.buffer) - 1) != b"\n":
+            self.buffer.insert(len(self.buffer), b"\n")
 
     def __del__(self):
-        self.file.close()
+        # only the map, the journal can't be written safely while the interpreter is shutting down
+        if self.saving is not None:
+            self.saving.wait()
+        self._close_map()
+
+    def close(self):
+        "Lets go of the memory map once the save reading from it is done, and of the journal unless it has unsaved edits."
+        while self.saving is not None:
+            self.saving.wait()
+            self.poll_save()
+        if self.journal is not None and self.recovered is None:
+            self.journal.close(discard=not self.dirty)
+        self.history.close()
+        self._close_map()
+
+    def _close_map(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    @property
+    def loading(self):
+        "True while a big file is still being indexed."
+        return self.buffer.loading
+
+    @property
+    def load_progress(self):
+        return self.mapped.progress if self.mapped is not None else 1
+
+    def poll(self):
+        "Picks up the lines a big file has had indexed since the last poll, returns True if there were any."
+        if self.mapped is None:
+            return False
+        line_count = self.buffer.line_count
+        grew = line_count > self.wrap.line_count
+        if grew:
+            self.wrap.grow(line_count)
+        if self._missing_newline and not self.buffer.loading:
+            self._missing_newline = False
+            self.buffer.insert(len(self.buffer), b"\n")
+            self.wrap.grow(self.buffer.line_count)
+            grew = True
+        return grew
+
+    @property
+    def str_state(self):
+        "The whole document as a string."
+        return self.buffer.slice().decode("utf8", "replace")
+
+    def line(self, line:int):
+        "The text of the logical line `line`, including its newline."
+        return self.buffer.line(line).decode("utf8", "replace")
+
+    def offset_of(self, line:int, col:int):
+        "The byte offset of column `col` on the logical line `line`."
+        return self.buffer.line_start(line) + len(self.line(line)[:col].encode())
+
+    def position_of(self, offset:int):
+        "The logical line and column that the byte `offset` falls on, in the middle of a character rounds down."
+        offset = min(max(offset, 0), len(self.buffer) - 1)
+        line = self.buffer.line_of(offset)
+        start = self.buffer.line_start(line)
+        return line, len(self.buffer.slice(start, offset).decode("utf8", "ignore"))
+
+    def goto_line(self, line:int):
+        "Moves the cursor to the start of the logical line `line`."
+        self.cursor.move_to(min(max(line, 0), self.wrap.line_count - 1), 0)
+        self.updated = True
+
+    def goto_offset(self, offset:int):
+        "Moves the cursor to the byte `offset`."
+        self.cursor.offset = offset
+        self.updated = True
+
+    def _fetch_lines(self, start:int, end:int):
+        "The text of the logical lines from `start` up to `end`."
+        text = self.buffer.slice(self.buffer.line_start(start), self.buffer.line_start(end)).decode("utf8", "replace")
+        return [line + "\n" for line in text.split("\n")[:-1]]
+
+    def line_rows(self, line:int):
+        "The rows that the logical line `line` wraps onto."
+        return self.wrap.chunks(self.line(line))
+
+    def row(self, row:int):
+        "The text of the row `row` on screen."
+        line, sub_row = self.wrap.locate(row)
+        return self.line_rows(line)[sub_row]
+
+    def rows_from(self, row:int):
+        "Yields the line, the index of the row in that line and the text of every row from `row` down."
+        if row >= self.height:
+            return
+        line, sub_row = self.wrap.locate(row)
+        while line < self.buffer.line_count:
+            for text in self._fetch_lines(line, line + 64):
+                for index, chunk in enumerate(self.wrap.chunks(text)[sub_row:], sub_row):
+                    yield line, index, chunk
+                sub_row = 0
+                line += 1
+
+    @property
+    def dirty(self):
+        "True if the document was edited since the last save."
+        return self.edits != self._saved_edits
 
     def save(self):
-        "Saves the document."
-        self.file.seek(0)
-        self.file.write(self.str_state)
-        self.file.truncate()
+        "Starts saving the document in the background, returns False if there was nothing to save."
+        if self.saving is not None:
+            self._save_again = self._save_again or self.edits != self._saving_edits
+            return True
+        if not self.dirty and os.path.exists(self.file_path):
+            return False
+        self.poll()
+        self._saving_edits = self.edits
+        if self.journal is not None:
+            self._journal_mark = self.journal.mark()
+        self.saving = BackgroundSave(self.file_path, self.buffer.ranges(), len(self.buffer), self.master.events.wake, index=self.mapped is not None)
+        return True
+
+    def poll_save(self):
+        "Returns the save being written once it is over, otherwise None."
+        saving = self.saving
+        if saving is None or not saving.done.is_set():
+            return None
+        saving.wait()
+        self.saving = None
+        if saving.error is None:
+            self._saved_edits = self._saving_edits
+            if self.journal is not None:
+                self.journal.compact(self._journal_mark)
+            if self.mapped is not None and not self.dirty:
+                # the pieces still point into the map of the file that was replaced, the text is the same so
+                # the wrap index and cursor are still right, only the buffer changes, and the save counted its lines
+                replaced = self.mapped
+                self.mapped = MappedFile(self.file_path, saving.index)
+                self.buffer = PieceTable(self.mapped)
+                # letting go of the replaced file frees its blocks on the disk, which takes a while for a big one
+                th.Thread(target=replaced.close, daemon=True).start()
+        if self._save_again:
+            self._save_again = False
+            self.save()
         self.updated = True
+        return saving
+
+    def undo(self):
+        "Takes back the last unit of edits, returns False if there was nothing to undo."
+        deltas = self.history.undo()
+        if deltas is None:
+            return False
+        with self._deferred():
+            for offset, deleted, inserted in reversed(deltas):
+                self._edit(offset, len(inserted), deleted, record=False)
+        # the cursor goes back to where the first of the edits was made
+        offset, deleted, _ = deltas[0]
+        self.cursor.offset = offset + len(deleted)
+        return True
+
+    def redo(self):
+        "Makes the last unit of edits that was undone again, returns False if there was nothing to redo."
+        deltas = self.history.redo()
+        if deltas is None:
+            return False
+        with self._deferred():
+            for offset, deleted, inserted in deltas:
+                self._edit(offset, len(deleted), inserted, record=False)
+        offset, _, inserted = deltas[-1]
+        self.cursor.offset = offset + len(inserted)
+        return True
+
+    def poll_journal(self):
+        "Writes the edits waiting to go into the journal once they have waited long enough."
+        if self.journal is not None:
+            self.journal.poll()
+
+    def journal_timeout(self):
+        "How long until the journal has edits to write, None if it has none."
+        return self.journal.time_left() if self.journal is not None else None
+
+    def replay_journal(self):
+        "Makes the edits an earlier run left in the journal again, as one unit of undo."
+        edits, _ = self.recovered
+        self.recovered = None
+        # the offsets are into the whole file, so it has to be done loading
+        if self.mapped is not None:
+            self.mapped.done.wait()
+        self.poll()
+        with self.transaction():
+            for offset, delete, data in edits:
+                if offset + delete >= len(self.buffer):
+                    # can't be an edit made to this text, the journal is broken from here on
+                    break
+                self._edit(offset, delete, data)
+                self.cursor.offset = offset + len(data)
+
+    def discard_journal(self):
+        "Drops the edits an earlier run left in the journal."
+        self.recovered = None
+        discard_journal(self.file_path)
 
     def update_state(self):
-        self.str_state = "".join(self.state)
-        self.str_state = self.str_state if self.str_state[-1] == "\n" else self.str_state + "\n"
-        self.state = newline_chunkstring(self.str_state, self.render_width)
+        "Lets the wrap index know about the render width and tab size."
+        self.wrap.set_width(self.render_width, self.master.settings["tab_size"])
         self.updated = True
 
+    def reflow_step(self):
+        "Rewraps a few of the lines still waiting on a resize, returns True if there were any."
+        if self.mapped is not None:
+            # wrapping everything would page the whole file in, big files only wrap what gets looked at
+            return False
+        return self.wrap.reflow_step()
+
     @property
     def height(self):
-        return len(self.state)
+        return self.wrap.rows
     
     def check_update(self):
         updated = self.updated
@@ -153,65 +783,183 @@ class Document:
             
             match key:
                 case keys.UP: # up
-                    self.cursor.y -= 1
+                    self.cursor.y -= event.count
                 case keys.DOWN: # down
                     if not (self.cursor.y == len(self.state)-1):
-                        self.cursor.y += 1
+                        self.cursor.y += event.count
                 case keys.LEFT: # left
                     if not (self.cursor.x == 0 and \
                     self.cursor.y == 0):
-                        self.cursor.x -= 1
+                        self.cursor.x -= event.count
                 case keys.RIGHT: # right
                     if not (self.cursor.x == len(self.state[-1])-1 and \
                     self.cursor.y == len(self.state)-1):
-                        self.cursor.x += 1
+                        self.cursor.x += event.count
                     
-                case keys.CTRL_W: # ctrl w
-                    self.save()
+                case keys.HOME: # home
+                    self.cursor.move_to(self.cursor.line, 0)
+                case keys.END: # end
+                    line_text = self.line(self.cursor.line)
+                    self.cursor.move_to(self.cursor.line, len(line_text.rstrip("\r\n")))
+                case keys.CTRL_Z:
+                    self.undo()
+                case keys.CTRL_Y:
+                    self.redo()
                 case b'\n': # enter
-                    # TODO Make it drop text to the next line
-                    self._insert_character(key, self.cursor.x, self.cursor.y)
-                    if self.cursor.x == len(self.state[-1])-2 and \
-                    self.cursor.y == len(self.state)-1:
-                        self.update_state()
-                        self.cursor.x += 1
-                    else:
-                        self.cursor.x = 0
-                        self.cursor.y += 1
-                        self.update_state()
+                    self._insert_character(self.newline, self.cursor.x, self.cursor.y)
                 case keys.BACKSPACE: # backspace
-                    if self.cursor.x == 0 and self.cursor.y == 0:
-                        pass
-                    elif self.cursor.x == 0:
-                        line_len = len(self.state[self.cursor.y])
-                        self.state[self.cursor.y-1] = self.state[self.cursor.y-1][:-1]
-                        
-                        self.update_state()
-                        self.cursor.x -= line_len
-                    else:
-                        self.state[self.cursor.y] = self.state[self.cursor.y][:self.cursor.x-1] + self.state[self.cursor.y][self.cursor.x:]
-                        self.cursor.x -= 1
-                        self.update_state()
+                    if not (self.cursor.x == 0 and self.cursor.y == 0):
+                        self._delete_character(self.cursor.x, self.cursor.y)
                 case b'\t':
-                    
                     self._insert_character(self.master.settings["tab"].encode(), self.cursor.x, self.cursor.y)
-                    self.cursor.x += len(self.master.settings["tab"])
-                    self.update_state()
                 case _:
                     try:
-                        
                         key = key.translate(None, escapes)
                         self._insert_character(key, self.cursor.x, self.cursor.y)
-                        self.cursor.x += 1
-                        self.update_state()
                     except UnicodeDecodeError:
                         pass
-            
-            
-        
+
+    def paste(self, data:bytes):
+        "Inserts a whole paste at the cursor as one edit, so it only gets rewrapped once."
+        text = data.decode("utf8", "replace").replace("\r\n", "\n").replace("\r", "\n")
+        # drop control characters other than tabs and newlines, like typing does
+        text = text.translate(_PASTE_CONTROLS)
+        if not text:
+            return
+        # its own unit of undo, never run together with what was typed around it
+        with self.transaction():
+            self._replace(self.cursor.line, self.cursor.col, 0, text.replace("\n", self.newline.decode()))
+
+    def _locate(self, x:int, y:int):
+        "Turns column `x` of row `y` on screen into a logical line and a column in that line."
+        line, sub_row = self.wrap.locate(y)
+        return line, x + sum(len(chunk) for chunk in self.line_rows(line)[:sub_row])
+
+    def _replace(self, line:int, col:int, delete:int, text:str):
+        "Replaces `delete` characters from `col` on `line` with `text` and moves the cursor to the end of it."
+        line_text = self.line(line)
+        offset = self.buffer.line_start(line) + len(line_text[:col].encode())
+        # a delete can run past the end of the line and into the lines after it
+        end_line = line
+        tail = line_text[col:]
+        while delete >= len(tail) and end_line + 1 < self.buffer.line_count:
+            end_line += 1
+            tail += self.line(end_line)
+        deleted = tail[:delete].encode()
+        if not deleted and not text:
+            return
+        texts = self._edit(offset, len(deleted), text.encode(), line, end_line)
+        if texts is None:
+            texts = self._fetch_lines(line, line + text.count("\n") + 1)
+
+        # put the cursor just after the inserted text
+        pos = col + len(text)
+        for index, new_text in enumerate(texts):
+            if pos < len(new_text):
+                break
+            pos -= len(new_text)
+        self.cursor.move_to(line + index, pos)
+
+    def _edit(self, offset:int, delete:int, data:bytes, line:int | None = None, end_line:int | None = None, record:bool = True):
+        "Replaces the `delete` bytes at `offset` with `data`, returns the new text of the lines from `line` to `end_line`."
+        if line is None:
+            line = self.buffer.line_of(offset)
+            end_line = min(self.buffer.line_of(offset + delete), self.buffer.line_count - 1)
+        deleted_lines = self.buffer.line_of(offset + delete) - self.buffer.line_of(offset) if delete else 0
+        if record:
+            self.history.record(offset, self.buffer.slice(offset, offset + delete), data)
+
+        self.buffer.delete(offset, delete)
+        self.buffer.insert(offset, data)
+        self.edits += 1
+        if self.journal is not None:
+            self.journal.record(offset, delete, data)
+
+        new_lines = end_line - line + 1 + data.count(b"\n") - deleted_lines
+        if self._deferring:
+            # nothing needs the lines until the transaction is over
+            self._defer_lines(line, end_line - line + 1, new_lines)
+            return None
+        texts = self._fetch_lines(line, line + new_lines)
+        self._splice(line, end_line - line + 1, texts)
+        return texts
+
+    def _splice(self, line:int, remove:int, texts:list[str]):
+        "Lets the wrap index and the highlighting know that the `remove` lines from `line` on are now `texts`."
+        self.wrap.splice(line, remove, texts)
+        if self.syntax is not None:
+            self.syntax.splice(line, remove, len(texts))
+        self.updated = True
+
+    def _defer_lines(self, line:int, remove:int, insert:int):
+        "Adds the `remove` lines from `line` on, `insert` lines now, to the lines the open transaction edited."
+        if self._deferred_lines is None:
+            self._deferred_lines = (line, remove, insert)
+            return
+        first, before, now = self._deferred_lines
+        # the lines edited so far and this edit become one run of lines, from the first to the last touched
+        start = min(first, line)
+        end = max(first + now, line + remove)
+        # past the lines edited so far, lines are only shifted by how many those edits added
+        self._deferred_lines = (start, end + before - now - start, end + insert - remove - start)
+
+    @contextmanager
+    def _deferred(self):
+        "Holds back splicing edited lines into the wrap index and the highlighting until the outermost one is over."
+        self._deferring += 1
+        try:
+            yield
+        finally:
+            self._deferring -= 1
+            if not self._deferring and self._deferred_lines is not None:
+                line, remove, insert = self._deferred_lines
+                self._deferred_lines = None
+                self._splice(line, remove, self._fetch_lines(line, line + insert))
+
+    @contextmanager
+    def transaction(self):
+        "Makes the edits inside of it one splice of the wrap index and the highlighting and one unit of undo."
+        self.history.begin()
+        try:
+            with self._deferred():
+                yield self
+        finally:
+            self.history.end()
+
+    def replace_all(self, old:str, new:str):
+        "Replaces every `old` in the document with `new` as one transaction, and returns how many there were."
+        if not old:
+            return 0
+        old_bytes, new_bytes = old.encode(), new.encode()
+        text = self.buffer.slice()
+        offsets = []
+        offset = text.find(old_bytes)
+        while offset != -1:
+            offsets.append(offset)
+            offset = text.find(old_bytes, offset + len(old_bytes))
+        cursor = self.cursor.offset
+        with self.transaction():
+            # last to first, so the offsets of the ones still to go stay put
+            for offset in reversed(offsets):
+                self._edit(offset, len(old_bytes), new_bytes)
+        # keep the cursor on the same text
+        before_cursor = bisect_right(offsets, cursor - len(old_bytes))
+        self.cursor.offset = cursor + before_cursor * (len(new_bytes) - len(old_bytes))
+        return len(offsets)
+
     def _insert_character(self, char:bytes, x:int, y:int):
         """
         inserts a character at the provided position in the state
         """
-        
-        self.state[y] = self.state[y][:x] + char.decode() + self.state[y][x:]
\ No newline at end of file
+        line, col = self._locate(x, y)
+        self._replace(line, col, 0, char.decode())
+
+    def _delete_character(self, x:int, y:int):
+        "Deletes the character before the provided position in the state."
+        line, col = self._locate(x, y)
+        if col == 0:
+            # join with the line above
+            line -= 1
+            col = len(self.line(line))
+        width = 2 if self.line(line)[col-2:col] == "\r\n" else 1
+        self._replace(line, col - width, width, "")
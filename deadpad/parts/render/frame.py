@@ -0,0 +1,146 @@
+from __future__ import annotations
+import re
+
+from deadpad.parts.render.document import chrweight
+from deadpad.parts.render.terminal import Terminal
+from deadpad.parts.themes import RESET_STYLE
+
+_ESCAPE_OR_CHAR = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|.", re.S)
+_SGR = re.compile(r"\x1b\[[0-9;]*m")
+
+def move_cursor(y:int, x:int):
+    return "\033[%d;%dH" % (y, x)
+
+# a full reset (ESC c) would also turn mouse reporting and bracketed paste off and show the cursor
+CLEAR_SCREEN = RESET_STYLE + "\033[2J\033[H"
+
+def _apply_style(style:str, seq:str):
+    "The style that is active after the SGR escape `seq` is written while `style` is active."
+    params = seq[2:-1]
+    if params in {"", "0"}:
+        return ""
+    if params.startswith("0;"):
+        # starts with a reset, so nothing from before it is left
+        return seq
+    return style + seq
+
+def _end_style(style:str, row:str):
+    "The style that is active at the end of `row` if it started with `style`."
+    for seq in _SGR.findall(row):
+        style = _apply_style(style, seq)
+    return style
+
+def _cells(style:str, row:str):
+    "Splits a row into [style, text, width] cells, zero width characters stick to the cell before them."
+    cells = []
+    for token in _ESCAPE_OR_CHAR.findall(row):
+        if len(token) > 1:
+            if token[-1] == "m":
+                style = _apply_style(style, token)
+            continue
+        width = chrweight(token)
+        if width == 0 and cells:
+            cells[-1][1] += token
+            continue
+        cells.append([style, token, width])
+    return cells
+
+def _draw(cells:list[list]):
+    out = [RESET_STYLE]
+    current = ""
+    for style, text, _ in cells:
+        if style != current:
+            # a style that starts with a reset needs no reset in front of it
+            out.append(style if style.startswith("\x1b[0;") else RESET_STYLE + style)
+            current = style
+        out.append(text)
+    out.append(RESET_STYLE)
+    return "".join(out)
+
+class Frame:
+    """
+    What was last written to the terminal, one string per row.
+
+    Every new frame is compared to the last one row by row, and only the cells that changed
+    get written, with the cursor moved to them directly.  So moving the cursor a column over
+    only sends the couple of cells around it instead of the whole screen.
+
+    When the terminal can do it, scrolling shifts the rows already on screen with a scroll
+    region and only draws the ones that came into view, and every update is sent as one
+    synchronized frame so it never shows half drawn.
+    """
+    def __init__(self, terminal:Terminal = None) -> None:
+        self.terminal = terminal or Terminal()
+        self.rows:list[tuple[str, str] | None] = []
+        "The style each row started with and the text of the row, as it is on screen now."
+        self._scroll:tuple[int, int, int] | None = None
+
+    def reset(self):
+        "Forgets what is on screen, for after the terminal got cleared, so the next update draws everything."
+        self.rows = []
+        self._scroll = None
+
+    def scroll(self, top:int, bottom:int, count:int):
+        "Lets the next update know the rows from `top` up to `bottom` moved up by `count` (down if negative)."
+        self._scroll = (top, bottom, count) if count else None
+
+    def _shift(self):
+        "Shifts the rows on screen to match the last `scroll`, returns the escapes that do it."
+        top, bottom, count = self._scroll
+        self._scroll = None
+        if not self.terminal.scroll_region or bottom > len(self.rows) or abs(count) >= bottom - top:
+            return ""
+        kept = self.rows[top:bottom]
+        if count > 0:
+            self.rows[top:bottom] = kept[count:] + [None] * count
+            move = "\033[%dS" % count
+        else:
+            self.rows[top:bottom] = [None] * -count + kept[:count]
+            move = "\033[%dT" % -count
+        # the rows scrolled in get erased in the current style, so reset it first
+        return f"{RESET_STYLE}\033[{top + 1};{bottom}r{move}\033[r"
+
+    def update(self, frame:str) -> str:
+        "What has to be written to the terminal to turn the last frame into `frame`, whose rows are split by newlines."
+        rows = []
+        out = [self._shift()] if self._scroll else []
+        style = ""
+        for y, text in enumerate(frame.split("\n")):
+            row = (style, text)
+            rows.append(row)
+            old = self.rows[y] if y < len(self.rows) else None
+            if row != old:
+                out.append(self._patch(y, old, row))
+            style = _end_style(style, text)
+        for y in range(len(rows), len(self.rows)):
+            out.append(move_cursor(y + 1, 1) + "\033[K")
+        self.rows = rows
+        if not any(out):
+            return ""
+        # leave the cursor on the last row, the command bar is written from there
+        out.append(move_cursor(len(rows), 1))
+        if self.terminal.sync_output:
+            return f"\033[?2026h{''.join(out)}\033[?2026l"
+        return "".join(out)
+
+    def _patch(self, y:int, old:tuple[str, str] | None, new:tuple[str, str]):
+        new_cells = _cells(*new)
+        if old is None:
+            return move_cursor(y + 1, 1) + _draw(new_cells) + "\033[K"
+        old_cells = _cells(*old)
+        limit = min(len(old_cells), len(new_cells))
+        start = 0
+        while start < limit and old_cells[start] == new_cells[start]:
+            start += 1
+        end = 0
+        while end < limit - start and old_cells[-1 - end] == new_cells[-1 - end]:
+            end += 1
+        changed = new_cells[start:len(new_cells) - end]
+        replaced = old_cells[start:len(old_cells) - end]
+        if not changed and not replaced:
+            return ""
+        col = sum(cell[2] for cell in new_cells[:start]) + 1
+        if end and sum(cell[2] for cell in changed) == sum(cell[2] for cell in replaced):
+            # the rest of the row did not move, so only the middle has to be written
+            return move_cursor(y + 1, col) + _draw(changed)
+        return move_cursor(y + 1, col) + _draw(new_cells[start:]) + "\033[K"
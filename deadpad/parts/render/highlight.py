@@ -0,0 +1,229 @@
+from __future__ import annotations
+from array import array
+import sys
+from typing import Any, Callable, Hashable, Iterable
+
+# lines fetched from the document at a time while lexing
+LEX_BATCH = 64
+
+# the most lines handed to a worker at once, so a far off jump is lexed a piece at a time
+JOB_LINES = 2048
+
+# start column, end column, theme type
+Span = tuple[int, int, str]
+
+# the spans of a line whose end state is known but that has not been lexed yet
+_UNLEXED = array("I")
+
+class HighlightCache:
+    "The spans and end state of every logical line, an edit only relexes until a line ends in the state it had before."
+    def __init__(self, lex_line:Callable[[str, Hashable], tuple[list[Span], Hashable]] | None, fetch:Callable[[int, int], list[str]], line_count:int, end_state:Callable[[str, Hashable], Hashable] | None = None, theme_types:Iterable[str] = ()) -> None:
+        # None when the lexing is done somewhere else
+        self._lex_line = lex_line
+        self._end_state = end_state
+        self._fetch = fetch
+        # packed three numbers a span, an edited line keeps its old spans until it gets lexed again
+        self._spans:list[array | None] = [None] * line_count
+        self._states:list[Any] = [None] * line_count
+        self._dirty = bytearray(b"\1") * line_count
+        self._valid = 0
+        # see `watch`
+        self._watches:dict[int, int] = {}
+        self._next_watch = 0
+        self.version = 0
+        # what each packed theme id stands for
+        self._theme_types:list[str] = list(theme_types)
+        self._theme_ids:dict[str, int] = {theme_type: theme_id for theme_id, theme_type in enumerate(self._theme_types)}
+
+    @property
+    def valid(self):
+        "How many lines from the top are highlighted and up to date."
+        return self._valid
+
+    def splice(self, line:int, remove:int, insert:int):
+        "Lets the cache know that the `remove` lines from `line` on were replaced with `insert` new ones."
+        # the edited lines keep the old spans to be drawn with until they are lexed again
+        self._spans[line:line + remove] = (self._spans[line:line + remove] + [None] * insert)[:insert]
+        self._states[line:line + remove] = [None] * insert
+        self._dirty[line:line + remove] = b"\1" * insert
+        if not insert and line < len(self._dirty):
+            # the line after the removed ones now follows a different line, so it has to be lexed again
+            self._dirty[line] = 1
+        self._valid = min(self._valid, line)
+        for key, edited in self._watches.items():
+            self._watches[key] = min(edited, line)
+        self.version += 1
+
+    def watch(self) -> int:
+        "Starts keeping track of the first line that gets edited, returns the key for `edited_since`."
+        self._next_watch += 1
+        self._watches[self._next_watch] = sys.maxsize
+        return self._next_watch
+
+    def edited_since(self, key:int, stop:bool = True) -> int:
+        "The first line edited since the watch `key` was started, and stops keeping track unless told not to."
+        return self._watches.pop(key) if stop else self._watches[key]
+
+    def _grow(self, line_count:int):
+        "Makes room for lines the document got without an edit, like a big file that is still being indexed."
+        extra = line_count - len(self._spans)
+        if extra > 0:
+            self._spans.extend([None] * extra)
+            self._states.extend([None] * extra)
+            self._dirty.extend(b"\1" * extra)
+
+    def spans(self, line:int) -> list[Span]:
+        "The spans of the logical line `line`, lexing whatever is needed to get to it."
+        return self._unpack(self._lexed(line))
+
+    def _lexed(self, line:int) -> array:
+        self._grow(line + 1)
+        if line >= self._valid:
+            self._lex_to(line)
+        packed = self._spans[line]
+        if packed is _UNLEXED:
+            spans, _ = self._lex_line(self._fetch(line, line + 1)[0], self.state_before(line))
+            packed = self._spans[line] = self._pack(spans)
+        return packed
+
+    def cached(self, line:int) -> list[Span]:
+        "The spans there are for `line` without lexing anything."
+        packed = self._spans[line] if line < len(self._spans) else None
+        return self._unpack(packed) if packed else []
+
+    def span_key(self, line:int, lex:bool = False) -> bytes:
+        "The spans of `line` as bytes, to tell whether they changed without unpacking them."
+        packed = self._lexed(line) if lex else (self._spans[line] if line < len(self._spans) else None)
+        return packed.tobytes() if packed else b""
+
+    def state_before(self, line:int):
+        "The state the line before `line` ends in, where lexing `line` starts from."
+        return self._states[line - 1] if line else None
+
+    def _unpack(self, packed:array):
+        theme_types = self._theme_types
+        return [(packed[index], packed[index + 1], theme_types[packed[index + 2]]) for index in range(0, len(packed), 3)]
+
+    def next_job(self, first:int, last:int) -> tuple[int, int, int] | None:
+        "The line to start lexing at, the first that needs its spans and the one to stop before, to draw `first` to `last`."
+        self._grow(last + 1)
+        if self._valid <= last:
+            start = self._valid
+            return start, max(first, start), min(last + 1, start + JOB_LINES)
+        # everything is lexed that far, but the lines only passed on the way have no spans yet
+        unlexed = [line for line in range(first, last + 1) if self._spans[line] is _UNLEXED]
+        if not unlexed:
+            return None
+        return unlexed[0], unlexed[0], unlexed[-1] + 1
+
+    def apply(self, start:int, results:list[tuple[list[Span] | None, Hashable]], limit:int):
+        "Takes the spans and end states lexed somewhere else for the lines from `start` up to `limit`."
+        count = max(0, min(limit, len(self._spans)) - start)
+        return self._store(start, [(_UNLEXED if spans is None else self._pack(spans), end_state) for spans, end_state in results[:count]])
+
+    def apply_packed(self, start:int, packed:array, offsets:array, states:list, theme_types:list[str], limit:int):
+        "Like `apply`, with line `start + n` packed between `offsets[n]` and `offsets[n + 1]` of `packed`."
+        count = max(0, min(limit, len(self._spans), start + len(states)) - start)
+        remap = [self._theme_id(theme_type) for theme_type in theme_types]
+        if remap != list(range(len(remap))):
+            # packed from a different list of theme types, so the ids have to be swapped for ours
+            packed = array("I", packed)
+            for index in range(2, len(packed), 3):
+                packed[index] = remap[packed[index]]
+        return self._store(start, [(packed[offsets[line]:offsets[line + 1]], states[line]) for line in range(count)])
+
+    def _store(self, start:int, results:list[tuple[array, Hashable]]):
+        if start > self._valid:
+            # something before these was edited, so they were lexed from the wrong state
+            return False
+        line = start
+        known = False
+        for packed, end_state in results:
+            if line < self._valid:
+                # only the spans were missing, the state was already known
+                self._spans[line] = packed
+            else:
+                known = not self._dirty[line] and self._states[line] == end_state
+                self._spans[line] = packed
+                self._states[line] = end_state
+                self._dirty[line] = 0
+            line += 1
+        if line == start:
+            return False
+        if line > self._valid:
+            count = len(self._spans)
+            if known and line < count and not self._dirty[line]:
+                # nothing changes from here to the next edit
+                line = self._dirty.find(1, line)
+                if line == -1:
+                    line = count
+            elif line < count and not known:
+                self._dirty[line] = 1
+            self._valid = line
+        self.version += 1
+        return True
+
+    def _theme_id(self, theme_type:str):
+        theme_id = self._theme_ids.get(theme_type)
+        if theme_id is None:
+            theme_id = self._theme_ids[theme_type] = len(self._theme_types)
+            self._theme_types.append(theme_type)
+        return theme_id
+
+    @property
+    def theme_types(self):
+        "The theme types the ids in packed spans stand for, in order."
+        return list(self._theme_types)
+
+    def _pack(self, spans:list[Span]):
+        packed = array("I")
+        theme_ids = self._theme_ids
+        for start, end, theme_type in spans:
+            theme_id = theme_ids.get(theme_type)
+            if theme_id is None:
+                theme_id = self._theme_id(theme_type)
+            packed.append(start)
+            packed.append(end)
+            packed.append(theme_id)
+        return packed
+
+    @property
+    def nbytes(self):
+        "Roughly how much memory the cached highlighting takes up."
+        return sum(packed.itemsize * len(packed) + 64 for packed in self._spans if packed) + 16 * len(self._spans)
+
+    def _lex_to(self, target:int):
+        line = self._valid
+        count = len(self._spans)
+        state = self._states[line - 1] if line else None
+        texts:list[str] = []
+        known = False
+        while line <= target and line < count:
+            if not texts:
+                texts = self._fetch(line, min(line + LEX_BATCH, count))[::-1]
+                if not texts:
+                    break
+            if line < target and self._end_state is not None:
+                spans, end_state = _UNLEXED, self._end_state(texts.pop(), state)
+            else:
+                spans, end_state = self._lex_line(texts.pop(), state)
+                spans = self._pack(spans)
+            # a line that was not edited and still ends the way it did means nothing after it changes
+            known = not self._dirty[line] and self._states[line] == end_state
+            self._spans[line] = spans
+            self._states[line] = end_state
+            self._dirty[line] = 0
+            state = end_state
+            line += 1
+            if known and line < count and not self._dirty[line]:
+                # skip to the next edit
+                line = self._dirty.find(1, line)
+                if line == -1:
+                    line = count
+                state = self._states[line - 1]
+                texts = []
+        if line < count and not known:
+            # the line after the last one lexed was cached from a different start, so lex it again next time
+            self._dirty[line] = 1
+        self._valid = max(self._valid, line)
+        self.version += 1
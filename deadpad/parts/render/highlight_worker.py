@@ -0,0 +1,189 @@
+from __future__ import annotations
+from collections import deque
+import multiprocessing
+import os
+import sys
+import threading as th
+import time
+import traceback
+from typing import Any, Callable
+from deadpad.parts.render.highlight import HighlightCache
+from deadpad.parts.render.parallel_lex import PARALLEL_BYTES, cores, lex_in_parallel
+
+START_TIMEOUT = 10
+"How many seconds the worker gets to start up and build its lexer."
+
+APPLY_LINES = 4096
+"How many lines of the first pass go into the cache each time around the main loop."
+
+def silence_output():
+    "Sends whatever a lexer process prints nowhere, the editor owns the terminal and it would be drawn over it."
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+def _serve(conn, load:Callable[..., Any], args:tuple):
+    "What the worker process runs: builds the lexer, then lexes every job it gets sent until the editor goes away."
+    silence_output()
+    try:
+        lexer = load(*args)
+        lex_line = lexer.lex_line
+        end_state = getattr(lexer, "end_state", None)
+        conn.send(("ready",))
+        while True:
+            job_id, start, state, full_from, texts = conn.recv()
+            results = []
+            for line, text in enumerate(texts, start):
+                if line < full_from and end_state is not None:
+                    state = end_state(text, state)
+                    results.append((None, state))
+                else:
+                    spans, state = lex_line(text, state)
+                    results.append((spans, state))
+            conn.send(("spans", job_id, start, results))
+    except EOFError:
+        return
+    except Exception:
+        conn.send(("error", traceback.format_exc(limit=-1).strip().splitlines()[-1]))
+
+class HighlightWorker:
+    """
+    Lexes the highlighting of a document in another process, so a slow or broken lexer can't hold up typing.
+
+    The screen asks for the lines it is about to draw with `request` and draws whatever the cache has
+    for them straight away, the old spans of a line that was just edited or plain text.  The worker gets
+    a copy of the text it has to lex, so the document can keep being edited while it works, and when the
+    spans come back the ones for lines that were not edited in the meantime go into the cache and `poll`
+    says the screen has to be drawn again.
+
+    Every job has `budget` seconds to come back.  A job is never more than what one frame needs, so if
+    it runs over the lexer is stuck, the process gets killed and `failed` says what happened.
+
+    Given the `path` of a big file that was just opened, the whole of it also gets lexed across every
+    core at once (see `lex_in_parallel`), so it is all highlighted long before the worker would get there.
+    """
+    def __init__(self, name:str, cache:HighlightCache, fetch:Callable[[int, int], list[str]], wake:Callable[[], None], load:Callable[..., Any], args:tuple, budget:float, path:str | None = None) -> None:
+        self.name = name
+        self.cache = cache
+        self._fetch = fetch
+        self._wake = wake
+        "Wakes the main loop up when something comes back."
+        self.budget = budget
+        self.failed:str | None = None
+        "Why the lexer was given up on, None while it is working."
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_serve, args=(child_conn, load, args), daemon=True)
+        self._process.start()
+        # so the worker going away shows up as the end of the pipe
+        child_conn.close()
+        self._received:deque[tuple] = deque()
+        self._receiver = th.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+        self._ready = False
+        self._job:tuple[int, int] | None = None
+        "The id of the job the worker is on and the cache's watch on edits made since it was sent."
+        self._job_id = 0
+        self._deadline:float | None = time.perf_counter() + START_TIMEOUT
+        self._closed = False
+        self._pass_watch:int | None = None
+        "The cache's watch on edits made since the first pass started, None once it is done."
+        if path is not None and os.path.getsize(path) >= PARALLEL_BYTES and cores() > 1:
+            self._pass_watch = cache.watch()
+            th.Thread(target=self._first_pass, args=(path, load, args, cores()), daemon=True).start()
+
+    def _first_pass(self, path:str, load:Callable[..., Any], args:tuple, processes:int):
+        "Runs on its own thread, lexes the whole file across every core and hands it to the main loop a slice at a time."
+        try:
+            for line, piece in lex_in_parallel(path, load, args, processes, self.cache.theme_types, lambda: self._closed):
+                offsets, states = piece["offsets"], piece["states"]
+                for first in range(0, len(states), APPLY_LINES):
+                    last = min(first + APPLY_LINES, len(states))
+                    self._received.append(("piece", line + first, piece["packed"], offsets[first:last + 1], states[first:last], piece["theme_types"]))
+                    self._wake()
+        except Exception:
+            # a lexer that breaks breaks in the worker too, which is where it gets reported
+            pass
+        self._received.append(("pass done",))
+        self._wake()
+
+    def _receive(self):
+        "Runs on its own thread, waits for whatever the worker sends back and hands it to the main loop."
+        try:
+            while True:
+                self._received.append(self._conn.recv())
+                self._wake()
+        except (EOFError, OSError):
+            self._conn.close()
+            self._received.append(("closed",))
+            self._wake()
+
+    def request(self, first:int, last:int):
+        "Sends off whatever is still needed to draw the lines from `first` to `last`, unless the worker is busy."
+        if self.failed or not self._ready or self._job is not None:
+            return
+        job = self.cache.next_job(first, last)
+        if job is None:
+            return
+        start, full_from, end = job
+        texts = self._fetch(start, end)
+        if not texts:
+            return
+        self._job_id += 1
+        self._job = (self._job_id, self.cache.watch())
+        self._deadline = time.perf_counter() + self.budget
+        self._conn.send((self._job_id, start, self.cache.state_before(start), full_from, texts))
+
+    def poll(self):
+        "Takes in whatever the worker sent back and stops it if it ran over its budget, returns True if the screen needs drawing again."
+        redraw = False
+        while self._received:
+            match self._received.popleft():
+                case ("ready",):
+                    self._ready = True
+                    self._deadline = None
+                    redraw = True
+                case ("spans", job_id, start, results) if self._job is not None and job_id == self._job[0]:
+                    _, watch = self._job
+                    self._job = None
+                    self._deadline = None
+                    # lines edited after they were sent off get asked for again on the next frame
+                    self.cache.apply(start, results, self.cache.edited_since(watch))
+                    redraw = True
+                case ("error", error):
+                    self._give_up(f"{self.name} highlighting failed: {error}")
+                    redraw = True
+                case ("closed",) if not self.failed:
+                    self._give_up(f"{self.name} highlighting stopped")
+                    redraw = True
+                case ("piece", start, packed, offsets, states, theme_types) if self._pass_watch is not None:
+                    self.cache.apply_packed(start, packed, offsets, states, theme_types, self.cache.edited_since(self._pass_watch, stop=False))
+                    redraw = True
+                    # one slice at a time, the rest waits for the next time around so typing never does
+                    break
+                case ("pass done",) if self._pass_watch is not None:
+                    self.cache.edited_since(self._pass_watch)
+                    self._pass_watch = None
+        if self._deadline is not None and time.perf_counter() > self._deadline and not self.failed:
+            self._give_up(f"{self.name} highlighting took over {self.budget:g}s")
+            redraw = True
+        return redraw
+
+    def time_left(self):
+        "How long until the job the worker is on runs over its budget, None if it is not on one."
+        if self._received:
+            # there is still some of the first pass to put in the cache
+            return 0
+        if self._deadline is None or self.failed:
+            return None
+        return max(0, self._deadline - time.perf_counter())
+
+    def _give_up(self, reason:str):
+        self.failed = reason
+        self._deadline = None
+        self.close()
+
+    def close(self):
+        "Kills the worker and stops the first pass, the receiving thread stops once the pipe closes."
+        self._closed = True
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join(1)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+from collections import deque
+import struct
+import tempfile
+import time
+
+# keys typed closer together than this are undone together
+GROUP_SECONDS = 1.0
+
+# about what a delta costs in memory besides its bytes
+_DELTA_OVERHEAD = 64
+
+# offset, deleted length and inserted length, the bytes follow it in the spill file
+_SPILL_RECORD = struct.Struct("<QII")
+
+# offset, deleted bytes, inserted bytes
+Delta = tuple[int, bytes, bytes]
+
+class _Unit:
+    "One step of undo, its deltas are None while it is spilled to disk."
+    __slots__ = ("deltas", "size", "spilled")
+
+    def __init__(self, deltas:list[Delta]) -> None:
+        self.deltas:list[Delta] | None = deltas
+        self.size = sum(len(deleted) + len(inserted) + _DELTA_OVERHEAD for _, deleted, inserted in deltas)
+        # where in the spill file the unit is and how long it is there
+        self.spilled:tuple[int, int] | None = None
+
+class EditHistory:
+    "The undo and redo history of a document as deltas, the oldest units spill to disk past `memory_limit`."
+    def __init__(self, memory_limit:int, disk_limit:int) -> None:
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._undo:deque[_Unit] = deque()
+        self._redo:list[_Unit] = []
+        # how many of the oldest units in `_undo` are spilled
+        self._spilled = 0
+        self.memory = 0
+        self._spill_file = None
+        self._spill_size = 0
+        # bytes of the spill file that belong to units that can still be undone
+        self.disk = 0
+        self._last_edit = 0.0
+        self._grouping = False
+        # see `begin`
+        self._depth = 0
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def record(self, offset:int, deleted:bytes, inserted:bytes):
+        "Adds an edit that was just made, and forgets everything there was to redo."
+        for unit in self._redo:
+            self.memory -= unit.size
+        self._redo.clear()
+        now = time.perf_counter()
+        if self._depth:
+            self._undo[-1].deltas.append((offset, deleted, inserted))
+            self._grow(self._undo[-1], len(deleted) + len(inserted) + _DELTA_OVERHEAD)
+        elif self._grouping and now - self._last_edit < GROUP_SECONDS and self._follows(offset, deleted, inserted):
+            last_offset, last_deleted, last_inserted = self._undo[-1].deltas[-1]
+            if inserted:
+                self._undo[-1].deltas[-1] = (last_offset, last_deleted, last_inserted + inserted)
+            else:
+                # a backspace, the new delta is just before the last one
+                self._undo[-1].deltas[-1] = (offset, deleted + last_deleted, last_inserted)
+            self._grow(self._undo[-1], len(deleted) + len(inserted))
+        else:
+            self._push(_Unit([(offset, deleted, inserted)]))
+        self._grouping = self._depth == 0 and b"\n" not in inserted and b"\n" not in deleted
+        self._last_edit = now
+        self._limit()
+
+    def _follows(self, offset:int, deleted:bytes, inserted:bytes):
+        "True if the edit carries on from the newest one, typing straight on after it or backspacing into it."
+        unit = self._undo[-1] if self._undo else None
+        if unit is None or unit.deltas is None or len(unit.deltas) != 1 or b"\n" in inserted or b"\n" in deleted:
+            return False
+        last_offset, last_deleted, last_inserted = unit.deltas[-1]
+        if inserted and not deleted and last_inserted and not last_deleted:
+            return offset == last_offset + len(last_inserted)
+        if deleted and not inserted and last_deleted and not last_inserted:
+            return offset + len(deleted) == last_offset
+        return False
+
+    def begin(self):
+        "Starts putting every edit in one unit until the matching `end`, they nest."
+        if self._depth == 0:
+            self._push(_Unit([]))
+        self._depth += 1
+
+    def end(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._grouping = False
+            if not self._undo[-1].deltas:
+                # nothing was edited
+                self.memory -= self._undo.pop().size
+            self._limit()
+
+    def undo(self) -> list[Delta] | None:
+        "The deltas of the newest unit, to be taken back newest first."
+        if not self._undo or self._depth:
+            return None
+        unit = self._undo.pop()
+        if unit.spilled is not None:
+            self._load(unit)
+            self._spilled -= 1
+            self.memory += unit.size
+        self._redo.append(unit)
+        self._grouping = False
+        return unit.deltas
+
+    def redo(self) -> list[Delta] | None:
+        "The deltas of the unit undone last, to be made again in order."
+        if not self._redo or self._depth:
+            return None
+        unit = self._redo.pop()
+        deltas = unit.deltas
+        self._undo.append(unit)
+        self._grouping = False
+        # might spill the unit straight back out
+        self._limit()
+        return deltas
+
+    def _push(self, unit:_Unit):
+        self._undo.append(unit)
+        self.memory += unit.size
+
+    def _grow(self, unit:_Unit, size:int):
+        unit.size += size
+        self.memory += size
+
+    def _limit(self):
+        "Spills the oldest units to fit in memory, then forgets the oldest to fit on disk."
+        while self.memory > self.memory_limit and self._spilled < len(self._undo) - (self._depth > 0):
+            self._spill(self._undo[self._spilled])
+            self._spilled += 1
+        while self.disk > self.disk_limit and self._spilled:
+            self.disk -= self._undo.popleft().size
+            self._spilled -= 1
+        if self._spill_file is not None and self._spill_size > 2 * self.disk + (1 << 20):
+            self._compact_spill_file()
+
+    def _spill(self, unit:_Unit):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="deadpad-undo-")
+            self._spill_size = 0
+        data = bytearray()
+        for offset, deleted, inserted in unit.deltas:
+            data += _SPILL_RECORD.pack(offset, len(deleted), len(inserted))
+            data += deleted
+            data += inserted
+        self._spill_file.seek(self._spill_size)
+        self._spill_file.write(data)
+        unit.spilled = (self._spill_size, len(data))
+        unit.deltas = None
+        self._spill_size += len(data)
+        self.memory -= unit.size
+        self.disk += unit.size
+
+    def _load(self, unit:_Unit):
+        "Reads a spilled unit back into memory."
+        position, length = unit.spilled
+        self._spill_file.seek(position)
+        data = self._spill_file.read(length)
+        deltas = []
+        pos = 0
+        while pos < len(data):
+            offset, deleted, inserted = _SPILL_RECORD.unpack_from(data, pos)
+            pos += _SPILL_RECORD.size
+            deltas.append((offset, data[pos:pos + deleted], data[pos + deleted:pos + deleted + inserted]))
+            pos += deleted + inserted
+        unit.deltas = deltas
+        unit.spilled = None
+        self.disk -= unit.size
+
+    def _compact_spill_file(self):
+        "Copies the units that are still spilled to a new file, so forgotten ones stop taking up disk."
+        old_file = self._spill_file
+        self._spill_file = tempfile.TemporaryFile(prefix="deadpad-undo-")
+        self._spill_size = 0
+        for index in range(self._spilled):
+            unit = self._undo[index]
+            position, length = unit.spilled
+            old_file.seek(position)
+            self._spill_file.write(old_file.read(length))
+            unit.spilled = (self._spill_size, length)
+            self._spill_size += length
+        old_file.close()
+
+    def close(self):
+        "Deletes the spill file."
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
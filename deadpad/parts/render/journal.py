@@ -0,0 +1,186 @@
+from __future__ import annotations
+import os
+import struct
+import time
+
+JOURNAL_MAGIC = b"DPJ1"
+
+_HEADER = struct.Struct("<4sQQ")
+"The magic, then the size and modification time (in ns) of the file the edits in the journal go on top of."
+
+_RECORD = struct.Struct("<QQI")
+"An edit, the byte offset it is at, how many bytes it deleted and how many it inserted, which follow it."
+
+FLUSH_SECONDS = 1.0
+"The longest an edit waits in memory before it is written to the journal."
+
+FLUSH_BYTES = 64 * 1024
+"How much can wait in memory before it is written straight away, like after a big paste."
+
+Edit = tuple[int, int, bytes]
+"An edit in a journal, the byte offset it is at, how many bytes it deleted and what it inserted."
+
+def journal_path(path:str):
+    "Where the journal of the file at `path` goes, a hidden file next to it."
+    directory, name = os.path.split(os.path.realpath(path))
+    return os.path.join(directory, f".{name}.deadpad-journal")
+
+def _base(path:str):
+    info = os.stat(path)
+    return _HEADER.pack(JOURNAL_MAGIC, info.st_size, info.st_mtime_ns)
+
+def read_journal(path:str) -> tuple[list[Edit], float] | None:
+    """
+    The edits in a journal left behind for the file at `path` by an editor that never saved them, and
+    when the last one was written.  None if there is no journal, or it is for the file as it was before
+    something else changed it, since the offsets in it would not mean anything any more.
+    """
+    try:
+        with open(journal_path(path), "rb") as file:
+            data = file.read()
+        mtime = os.path.getmtime(journal_path(path))
+        if data[:_HEADER.size] != _base(path):
+            return None
+    except OSError:
+        return None
+    edits:list[Edit] = []
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(data):
+        offset, deleted, inserted = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + inserted > len(data):
+            # the editor went away half way through writing this one
+            break
+        edits.append((offset, deleted, data[pos:pos + inserted]))
+        pos += inserted
+    return (edits, mtime) if edits else None
+
+def discard_journal(path:str):
+    "Deletes the journal of the file at `path`, if there is one."
+    try:
+        os.unlink(journal_path(path))
+    except OSError:
+        pass
+
+class EditJournal:
+    """
+    Every edit made to a document since it was last saved, appended to a file next to it so the edits
+    can be replayed if the editor goes away without saving them (see `read_journal`).
+
+    Edits wait in memory and get written a batch at a time, at most `FLUSH_SECONDS` after they were
+    made, so typing costs a write a second whatever the size of the file.  They are written out to
+    the operating system but not synced, which is enough for the editor crashing or the terminal being
+    closed on it.
+
+    The journal only gets made on the first edit.  After a save it is rewritten to just the edits made
+    since the text that was saved, on top of the new file, or deleted if there are none.
+    """
+    def __init__(self, path:str) -> None:
+        self.file_path = os.path.realpath(path)
+        self.path = journal_path(path)
+        self._file = None
+        self._pending = bytearray()
+        "Edits that have not been written to the journal yet."
+        self._since:float | None = None
+        "When the oldest of the pending edits was made."
+        self._written = 0
+        "How many bytes of edits are in the journal file."
+        self.failed = False
+        "True once the journal could not be written, the document just goes without one from then on."
+        try:
+            self._base = _base(path)
+            "The file the edits go on top of, as it was when it was opened or last saved."
+        except OSError:
+            self.failed = True
+
+    def record(self, offset:int, deleted:int, inserted:bytes):
+        if self.failed:
+            return
+        if not self._pending:
+            self._since = time.perf_counter()
+        self._pending += _RECORD.pack(offset, deleted, len(inserted))
+        self._pending += inserted
+        if len(self._pending) >= FLUSH_BYTES:
+            self.flush()
+
+    def time_left(self):
+        "How long until the pending edits have to be written, None if there are none."
+        if not self._pending:
+            return None
+        return max(0, self._since + FLUSH_SECONDS - time.perf_counter())
+
+    def poll(self):
+        "Writes the pending edits if they have waited long enough."
+        if self._pending and self.time_left() == 0:
+            self.flush()
+
+    def flush(self):
+        if not self._pending or self.failed:
+            return
+        try:
+            if self._file is None:
+                # swapped in whole, so a journal left from before is never half overwritten
+                self._rewrite(bytes(self._pending))
+            else:
+                self._file.write(self._pending)
+                self._file.flush()
+                self._written += len(self._pending)
+        except OSError:
+            self.failed = True
+            self._close_file()
+        self._pending.clear()
+
+    def mark(self) -> int:
+        "Where the journal is up to, for `compact` once the text as it is now has been saved."
+        return self._written + len(self._pending)
+
+    def compact(self, mark:int):
+        "Forgets the edits made before `mark`, they are in the file now, the ones made after it go on top of it."
+        if self.failed:
+            return
+        try:
+            self._base = _base(self.file_path)
+            if mark >= self._written:
+                tail = bytes(self._pending[mark - self._written:])
+            else:
+                # some of what came after the mark was written already
+                with open(self.path, "rb") as file:
+                    file.seek(_HEADER.size + mark)
+                    tail = file.read(self._written - mark) + self._pending
+            self._pending.clear()
+            if tail:
+                self._rewrite(tail)
+            else:
+                self._close_file()
+                self._written = 0
+                discard_journal(self.file_path)
+        except OSError:
+            self.failed = True
+            self._close_file()
+
+    def _rewrite(self, edits:bytes):
+        "Replaces the journal with one holding `edits`, and keeps it open to add to."
+        self._close_file()
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(self._base)
+            file.write(edits)
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._written = len(edits)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self, discard:bool = False):
+        "Writes what is pending and closes the journal file, or deletes it if `discard`."
+        if discard:
+            self._pending.clear()
+            self._close_file()
+            self._written = 0
+            discard_journal(self.file_path)
+            return
+        self.flush()
+        self._close_file()
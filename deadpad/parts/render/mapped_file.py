@@ -0,0 +1,101 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+import mmap
+import threading
+
+# bytes of the file covered by each entry of the newline index
+INDEX_BLOCK = 1 << 14
+INDEX_READ = INDEX_BLOCK * 64
+
+class MappedFile:
+    "A read only memory map of a big file, its newlines get counted on a background thread."
+    def __init__(self, path:str, index:array | None = None) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # newlines before the start of each block
+        self._block_lines = array('q', [0]) if index is None else index
+        self.lines = self._block_lines[-1]
+        self.done = threading.Event()
+        self._closed = False
+        self._thread:threading.Thread | None = None
+        if self.indexed >= len(self.data):
+            # the index that was passed in already covers the whole file
+            self.done.set()
+        else:
+            self._thread = threading.Thread(target=self._build_index, daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key:slice):
+        return self.data[key]
+
+    @property
+    def progress(self):
+        "How much of the file has been indexed, from 0 to 1."
+        return min(1, (len(self._block_lines) - 1) * INDEX_BLOCK / max(len(self.data), 1))
+
+    @property
+    def indexed(self):
+        "How many bytes from the start of the file have had their newlines counted."
+        return min(len(self.data), (len(self._block_lines) - 1) * INDEX_BLOCK)
+
+    def _build_index(self):
+        lines = self.lines
+        # read past the map so counting never keeps the file in memory
+        buffer = bytearray(INDEX_READ)
+        try:
+            with open(self.path, "rb", buffering=0) as file:
+                file.seek((len(self._block_lines) - 1) * INDEX_BLOCK)
+                while not self._closed:
+                    read = file.readinto(buffer)
+                    if not read:
+                        return
+                    for start in range(0, read, INDEX_BLOCK):
+                        lines += buffer.count(b"\n", start, min(start + INDEX_BLOCK, read))
+                        self._block_lines.append(lines)
+                    self.lines = lines
+        finally:
+            self.done.set()
+
+    def _rank(self, offset:int):
+        "The number of newlines before `offset`."
+        block = offset // INDEX_BLOCK
+        if block >= len(self._block_lines):
+            self.done.wait()
+            block = min(block, len(self._block_lines) - 1)
+        start = block * INDEX_BLOCK
+        return self._block_lines[block] + self.data[start:offset].count(b"\n")
+
+    def count(self, start:int, end:int):
+        "The number of newlines between `start` and `end`."
+        return self._rank(end) - self._rank(start)
+
+    def counted(self, start:int, end:int):
+        "The number of newlines between `start` and `end` counted so far."
+        end = min(end, self.indexed)
+        return self._rank(end) - self._rank(start) if start < end else 0
+
+    def find(self, start:int, nth:int):
+        "The offset of the `nth` newline (counting from 0) at or after `start`."
+        target = self._rank(start) + nth
+        # `lines` only moves after a whole read, the blocks are counted sooner
+        if target >= self._block_lines[-1]:
+            self.done.wait()
+            if target >= self._block_lines[-1]:
+                return -1
+        block = bisect_right(self._block_lines, target) - 1
+        pos = block * INDEX_BLOCK - 1
+        for _ in range(target - self._block_lines[block] + 1):
+            pos = self.data.find(b"\n", pos + 1)
+        return pos
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join()
+        self.data.close()
+        self._file.close()
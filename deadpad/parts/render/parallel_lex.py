@@ -0,0 +1,145 @@
+from __future__ import annotations
+from array import array
+import multiprocessing
+import os
+import re
+from typing import Any, Callable, Hashable, Iterator
+
+PARALLEL_BYTES = 1 << 20
+"Files at least this big get their first highlighting pass split across every core."
+
+MIN_CHUNK_BYTES = 256 * 1024
+"The smallest piece of a file that is worth sending to a process of its own."
+
+CHUNKS_PER_PROCESS = 4
+"How many pieces each process gets on average, so one slow piece does not leave the others waiting."
+
+RESYNC_LOOKBACK = 4096
+"How far before where a piece is cut to look for the blank line a resync point needs."
+
+RESYNC_BLOCK = 64 * 1024
+
+_RESYNC = re.compile(rb"\n[ \t\r]*\n(?=[A-Za-z_@#])")
+"""
+A blank line followed by a line that starts right at the left edge, where most languages are back at the
+top level and outside of any string.  The lexing state there is guessed to be the starting one.
+"""
+
+_lexer = None
+"The lexer of a pool process."
+
+def cores():
+    "How many cores the editor is allowed to run on."
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _init_process(load:Callable[..., Any], args:tuple):
+    global _lexer
+    # highlight_worker imports this module, so this can only be imported once both are loaded
+    from deadpad.parts.render.highlight_worker import silence_output
+    silence_output()
+    _lexer = load(*args)
+
+def _resync_after(file, offset:int, size:int):
+    "The first resync point at or after the byte `offset`, or the end of the file if there is none."
+    if offset <= 0 or offset >= size:
+        return min(max(offset, 0), size)
+    # the blank line can start a little before `offset`, always looking from the same place keeps
+    # the piece before and the piece after agreeing on where they meet
+    base = max(0, offset - RESYNC_LOOKBACK)
+    file.seek(base)
+    data = file.read(offset - base + RESYNC_BLOCK)
+    while True:
+        for match in _RESYNC.finditer(data):
+            if base + match.end() >= offset:
+                return base + match.end()
+        if base + len(data) >= size:
+            return size
+        # keep the tail, a blank line can be cut in half by the end of a block
+        keep = data[-RESYNC_LOOKBACK:]
+        base += len(data) - len(keep)
+        data = keep + file.read(RESYNC_BLOCK)
+
+def lex_piece(path:str, start:int, end:int, state:Hashable, theme_types:list[str], snap:bool = True):
+    """
+    Runs in a pool process: lexes the lines of the file between the bytes `start` and `end` starting
+    from `state`.  With `snap` both ends are moved on to the next resync point first.
+
+    The spans come back packed like the highlight cache keeps them, into one array for the whole
+    piece, so handing them back costs next to nothing.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if snap:
+            start, end = _resync_after(file, start, size), _resync_after(file, end, size)
+        file.seek(start)
+        data = file.read(end - start)
+    lines = data.decode("utf8", "replace").split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    theme_types = list(theme_types)
+    theme_ids = {theme_type: theme_id for theme_id, theme_type in enumerate(theme_types)}
+    packed = array("I")
+    offsets = array("I", [0])
+    states = []
+    entry_state = state
+    lex_line = _lexer.lex_line
+    for line in lines:
+        spans, state = lex_line(line + "\n", state)
+        for span_start, span_end, theme_type in spans:
+            theme_id = theme_ids.get(theme_type)
+            if theme_id is None:
+                theme_id = theme_ids[theme_type] = len(theme_types)
+                theme_types.append(theme_type)
+            packed.append(span_start)
+            packed.append(span_end)
+            packed.append(theme_id)
+        offsets.append(len(packed))
+        states.append(state)
+    return {
+        "start": start, "end": end, "entry_state": entry_state,
+        "packed": packed, "offsets": offsets, "states": states, "theme_types": theme_types,
+    }
+
+def lex_in_parallel(path:str, load:Callable[..., Any], args:tuple, processes:int, theme_types:list[str], stopped:Callable[[], bool] = lambda: False) -> Iterator[tuple[int, dict]]:
+    """
+    Lexes the whole file at `path` across `processes` processes, yielding every piece in order with the
+    line it starts at.
+
+    The file is cut into pieces at resync points, which are lexed at the same time, each guessing it
+    starts in the starting state.  Going through them in order the state the piece before really
+    ended in is known, and a piece that guessed wrong gets lexed again from it.  The pool is torn
+    down as soon as `stopped` says so or the generator is closed.
+    """
+    size = os.path.getsize(path)
+    piece_size = max(MIN_CHUNK_BYTES, size // (processes * CHUNKS_PER_PROCESS) + 1)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes, _init_process, (load, args)) as pool:
+        pending = [pool.apply_async(lex_piece, (path, start, min(start + piece_size, size), None, theme_types)) for start in range(0, size, piece_size)]
+        line = 0
+        state = None
+        for result in pending:
+            piece = _wait(result, stopped)
+            if piece is None:
+                return
+            if not piece["states"]:
+                # there was no resync point in it, the piece before took all of it
+                continue
+            if piece["entry_state"] != state:
+                piece = _wait(pool.apply_async(lex_piece, (path, piece["start"], piece["end"], state, theme_types, False)), stopped)
+                if piece is None:
+                    return
+                piece["relexed"] = True
+            yield line, piece
+            line += len(piece["states"])
+            state = piece["states"][-1]
+
+def _wait(result, stopped:Callable[[], bool]):
+    "What a pool job gave back, None if the pass was stopped before it was done."
+    while not stopped():
+        try:
+            return result.get(0.1)
+        except multiprocessing.TimeoutError:
+            pass
+    return None
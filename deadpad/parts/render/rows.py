@@ -0,0 +1,166 @@
+from __future__ import annotations
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Hashable
+from deadpad.parts.render.document import str_weight
+from deadpad.parts.themes import RESET_STYLE
+if TYPE_CHECKING:
+    from deadpad.parts.render.highlight import Span
+
+NBSP = "\xa0"
+"What a space is drawn as, so the terminal never skips over it."
+
+ROW_CACHE_ROWS = 4096
+"How many composed rows the render cache holds on to, a few screens of scrolling either way."
+
+def tab_glyph(tab_sym:str, width:int, show_tabs:bool):
+    "What a tab that reaches `width` cells to the next tab stop is drawn as."
+    if not show_tabs:
+        return NBSP * width
+    if width >= len(tab_sym):
+        glyph = tab_sym[:-1] + tab_sym[-2] * (width - len(tab_sym)) + tab_sym[-1]
+    else:
+        glyph = tab_sym[:width-1] + tab_sym[-1]
+    return glyph.replace(" ", NBSP)
+
+class RowComposer:
+    """
+    Turns a row of the document and the highlighting of its line into the string it is drawn as.
+
+    Everything that only depends on the settings and the theme is worked out up front: a table to
+    `str.translate` spaces, newlines and carriage returns with, and the glyph of a tab for every
+    width it can have.  A row then costs a translate for each run of one style, a look up for each
+    tab and a slice around the cursor, instead of a step for every cell.
+    """
+    def __init__(self, width:int, tab_size:int, show_tabs:bool, show_newlines:bool, theme_data:dict) -> None:
+        self.width = width
+        self.tab_size = tab_size
+        newline = theme_data["paragraph_sym"].replace(" ", NBSP) if show_newlines else ""
+        self._table = str.maketrans({" ": NBSP, "\n": newline, "\r": ""})
+        self._tabs = [""] + [tab_glyph(theme_data["tab_sym"], width, show_tabs) for width in range(1, tab_size + 1)]
+        "The glyph of a tab by how many cells it takes up."
+        self.cursor_sym = theme_data["cursor_sym"].replace(" ", NBSP)
+
+    def _tab_glyphs(self, text:str):
+        "Where every tab in `text` is and what it is drawn as, tabs reach to the next tab stop so it depends on the cells before them."
+        positions = []
+        glyphs = []
+        cell = 0
+        start = 0
+        tab = text.find("\t")
+        while tab != -1:
+            cell += str_weight(text[start:tab])
+            weight = self.tab_size - cell % self.tab_size
+            positions.append(tab)
+            glyphs.append(self._tabs[weight])
+            cell += weight
+            start = tab + 1
+            tab = text.find("\t", start)
+        return positions, glyphs
+
+    def _text(self, text:str, start:int, end:int, tabs:tuple[list[int], list[str]] | None, out:list[str]):
+        "Adds what the characters of `text` from `start` to `end` are drawn as to `out`."
+        if tabs is None:
+            out.append(text[start:end].translate(self._table))
+            return
+        positions, glyphs = tabs
+        index = bisect_left(positions, start)
+        while index < len(positions) and positions[index] < end:
+            tab = positions[index]
+            out.append(text[start:tab].translate(self._table))
+            out.append(glyphs[index])
+            start = tab + 1
+            index += 1
+        out.append(text[start:end].translate(self._table))
+
+    def compose(self, text:str, start_col:int, spans:list[Span], styles:dict[str, str], plain:str | None, cursor:int | None = None) -> str:
+        """
+        What the row `text` is drawn as.  `start_col` is the column of its line the row starts at, which
+        is what the `spans` of the line count from, `plain` the style of text no span covers and
+        `cursor` where the cursor is in the row, if it is on it.
+        """
+        length = len(text)
+        # the runs of the row drawn in one style
+        runs:list[tuple[int, int, str | None]] = []
+        pos = 0
+        for span_start, span_end, theme_type in spans:
+            span_start = max(span_start - start_col, pos)
+            span_end = min(span_end - start_col, length)
+            if span_end <= span_start:
+                if span_start >= length:
+                    break
+                continue
+            if span_start > pos:
+                runs.append((pos, span_start, plain))
+            # themes made before a language added a new kind of token draw it plainly
+            runs.append((span_start, span_end, styles.get(theme_type, plain)))
+            pos = span_end
+        if pos < length:
+            runs.append((pos, length, plain))
+
+        tabs = self._tab_glyphs(text) if "\t" in text else None
+        out:list[str] = []
+        drawn = None
+        for start, end, style in runs:
+            if style != drawn:
+                # every style starts with a reset, so only going back to no style needs one
+                out.append(style if style is not None else RESET_STYLE)
+                drawn = style
+            if cursor is not None and start <= cursor < end:
+                self._text(text, start, cursor, tabs, out)
+                char = text[cursor]
+                if char in "\n\r ":
+                    out.append(self.cursor_sym)
+                elif char == "\t":
+                    out.append(self.cursor_sym + tabs[1][tabs[0].index(cursor)][1:])
+                else:
+                    out.append(self.cursor_sym + char)
+                self._text(text, cursor + 1, end, tabs, out)
+            else:
+                self._text(text, start, end, tabs, out)
+        if cursor is not None and length <= cursor < length + self.width - str_weight(text, self.tab_size):
+            # past the end of the text, where the row is padded out to the width
+            if drawn is not None:
+                out.append(RESET_STYLE)
+                drawn = None
+            out.append(self.cursor_sym)
+        if drawn is not None:
+            out.append(RESET_STYLE)
+        return "".join(out)
+
+class RowCache:
+    """
+    The rows composed most recently, by everything that goes into composing one: the text of the row,
+    where in its line it starts, its spans (see `HighlightCache.span_key`) and where the cursor is on it.
+
+    What the rows are composed with (the width, the theme and the settings) is not in the key, the
+    cache gets cleared whenever that changes.  Once it holds `size` rows the one used longest ago goes.
+    """
+    def __init__(self, size:int = ROW_CACHE_ROWS) -> None:
+        self.size = size
+        self._rows:OrderedDict[Hashable, str] = OrderedDict()
+        self.hits = 0
+        "How many rows were found in the cache."
+        self.misses = 0
+        "How many rows had to be composed."
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, key:Hashable) -> str | None:
+        row = self._rows.get(key)
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._rows.move_to_end(key)
+        return row
+
+    def put(self, key:Hashable, row:str):
+        self._rows[key] = row
+        if len(self._rows) > self.size:
+            self._rows.popitem(last=False)
+
+    def clear(self):
+        "Forgets every row, the counts are kept."
+        self._rows.clear()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from array import array
+import os
+import stat
+import tempfile
+import threading as th
+from typing import Callable, Sequence
+from deadpad.parts.render.mapped_file import INDEX_BLOCK
+
+# the most bytes written at once
+SAVE_CHUNK = 1 << 20
+
+class BackgroundSave:
+    "Writes a snapshot of a document's text (see `PieceTable.ranges`) to a temp file on a thread and renames it over the file."
+    def __init__(self, path:str, ranges:Sequence[tuple], size:int, wake:Callable[[], None], index:bool = False) -> None:
+        self.path = os.path.realpath(path)
+        self.size = size
+        self.written = 0
+        self.error:str | None = None
+        # the newline index of the written file (see `MappedFile`), so it can be mapped again without counting
+        self.index:array | None = array('q', [0]) if index else None
+        self._lines = 0
+        self._block_fill = 0
+        self.done = th.Event()
+        self._wake = wake
+        self._thread = th.Thread(target=self._write, args=(ranges,), daemon=True)
+        self._thread.start()
+
+    @property
+    def progress(self):
+        "How much of the file has been written, from 0 to 1."
+        return min(1, self.written / max(self.size, 1))
+
+    def _write(self, ranges:Sequence[tuple]):
+        directory, name = os.path.split(self.path)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".deadpad-save", dir=directory)
+            with os.fdopen(fd, "wb") as file:
+                for buf, start, end in ranges:
+                    for chunk_start in range(start, end, SAVE_CHUNK):
+                        chunk_end = min(end, chunk_start + SAVE_CHUNK)
+                        chunk = buf[chunk_start:chunk_end]
+                        file.write(chunk)
+                        if self.index is not None:
+                            self._count(chunk)
+                        self.written += chunk_end - chunk_start
+                if self.index is not None and self._block_fill:
+                    # the last block of the file is a short one
+                    self.index.append(self._lines)
+                file.flush()
+                os.fsync(file.fileno())
+            self._copy_permissions(temp_path)
+            os.replace(temp_path, self.path)
+            temp_path = None
+            self._sync_directory(directory)
+        except BaseException as error:
+            # anything going wrong has to fail the save, or the document would count as saved
+            if isinstance(error, OSError):
+                self.error = error.strerror or str(error)
+            else:
+                self.error = f"{type(error).__name__}: {error}"
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+        finally:
+            self.done.set()
+            self._wake()
+
+    def _count(self, chunk:bytes):
+        "Adds the newlines in `chunk`, what was just written, to the index a block at a time."
+        pos = 0
+        while pos < len(chunk):
+            end = min(len(chunk), pos + INDEX_BLOCK - self._block_fill)
+            self._lines += chunk.count(b"\n", pos, end)
+            self._block_fill += end - pos
+            pos = end
+            if self._block_fill == INDEX_BLOCK:
+                self.index.append(self._lines)
+                self._block_fill = 0
+
+    def _copy_permissions(self, temp_path:str):
+        "Gives the temp file the mode and owner of the file it replaces."
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        os.chmod(temp_path, stat.S_IMODE(info.st_mode))
+        if hasattr(os, "chown"):
+            try:
+                os.chown(temp_path, info.st_uid, info.st_gid)
+            except OSError:
+                # only root can give a file away, the file just ends up owned by whoever saved it
+                pass
+
+    @staticmethod
+    def _sync_directory(directory:str):
+        "Makes the rename itself survive a crash, not every platform can open a directory for this."
+        try:
+            fd = os.open(directory or ".", os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def wait(self):
+        self._thread.join()
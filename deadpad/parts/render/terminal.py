@@ -0,0 +1,57 @@
+from __future__ import annotations
+import os
+import re
+import select
+import sys
+import time
+
+SYNC_REPLY = re.compile(rb"\x1b\[\?2026;(\d+)\$y")
+"The answer to asking about synchronized output (DEC mode 2026)."
+
+DEVICE_REPLY = re.compile(rb"\x1b\[\?(\d+)[;\d]*c")
+"The answer to the primary device attributes request, which every terminal sends."
+
+class Terminal:
+    "What the terminal we are drawing to can do, see `probe`."
+    def __init__(self, sync_output:bool = False, scroll_region:bool = False) -> None:
+        self.sync_output = sync_output
+        "Frames can be wrapped in DEC 2026 so the terminal shows them all at once."
+        self.scroll_region = scroll_region
+        "Rows can be shifted with DECSTBM and CSI S/T instead of being drawn again."
+
+def probe(timeout:float = 0.25) -> Terminal:
+    """
+    Asks the terminal what it supports, anything it does not answer for is left off
+    so the renderer falls back to drawing the rows again.
+
+    This reads from stdin, so it has to happen before the input handler starts.
+    """
+    try:
+        import termios
+        import tty
+    except ModuleNotFoundError:
+        return Terminal()
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return Terminal()
+    fd = sys.stdin.fileno()
+    orig = termios.tcgetattr(fd)
+    reply = b""
+    try:
+        tty.setcbreak(fd)
+        # the device attributes request goes last, once it is answered the rest have been too
+        sys.stdout.write("\x1b[?2026$p\x1b[c")
+        sys.stdout.flush()
+        end = time.monotonic() + timeout
+        while not DEVICE_REPLY.search(reply) and (left := end - time.monotonic()) > 0:
+            if select.select([fd], [], [], left)[0]:
+                reply += os.read(fd, 1024)
+    finally:
+        termios.tcsetattr(fd, termios.TCSANOW, orig)
+
+    sync = SYNC_REPLY.search(reply)
+    device = DEVICE_REPLY.search(reply)
+    return Terminal(
+        sync_output = sync is not None and sync.group(1) in {b"1", b"2"},
+        # anything claiming to be a VT220 or newer has scroll margins and SU/SD in practice
+        scroll_region = device is not None and int(device.group(1)) >= 62
+    )
@@ -7,17 +7,19 @@ import math
 import sys
 import time
 import shutil
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING
+from deadpad.parts.extension import load_parser
 from deadpad.parts.input import keys
-from deadpad.parts.render.document import Document, str_weight
+from deadpad.parts.render.document import Document
+from deadpad.parts.render.frame import CLEAR_SCREEN, Frame
+from deadpad.parts.render.highlight import HighlightCache
+from deadpad.parts.render.highlight_worker import HighlightWorker
+from deadpad.parts.render.rows import RowCache, RowComposer
 from deadpad.parts.input.input_handler import InputEvent, InputType
 from deadpad.parts.themes import RESET_STYLE, get_style
 if TYPE_CHECKING:
     from deadpad import Editor
 
-def move_cursor(y:int, x:int):
-    return "\033[%d;%dH" % (y, x)
-
 def line_len(row:list[str]):
     leng = 0
     for char in row:
@@ -36,6 +38,8 @@ class TextScreen:
         self.width = width - width_offset
         self.height = height-height_offset
         self._y_pos = 0
+        self._drawn_y_pos = 0
+        "Where the view was the last time it was drawn."
         self.document = document
         """
         This is a reference to the document we are editing.
@@ -44,19 +48,37 @@ class TextScreen:
         Rendering to the document will happen either on save or when the state's position on the document changes.
         """
 
-        self.state:list[list[None|bytes]] = [[] for _ in range(self.height)]
+        self.frame = Frame(master.terminal)
+        "What is on the terminal right now, so only what changed gets redrawn."
 
         self.footer_string = document.file_path
         self.edit_mode = True
+        self.command = b""
+        "The command being typed in command mode."
+        self.command_cursor = 0
         self.running = True
         self.master = master
         self.updated = True
         self.theme_data = self.master.theme_data
-        self.state = [[] for _ in range(self.height)]    
+        self.row_lines:list[int | None] = [None] * self.height
+        "The logical line each row on screen starts, or None for rows that continue a wrapped line."
+        self._shown_progress:int | tuple[int, int] = 100
+        "The indexing progress the footer last showed, and the saving progress while there is a save."
+        self.highlighter:HighlightWorker | None = None
+        "Lexes the document's highlighting off of the main loop, None if it has none or it gets lexed right here."
+        self._composer:RowComposer | None = None
+        self._composer_key:tuple | None = None
+        "The width, settings and theme the composer was built for."
+        self.row_cache = RowCache()
+        "The rows drawn lately, so a frame only composes the rows that changed."
+        self._cached_syntax:HighlightCache | None = None
+        "The highlighting the rows in the cache were drawn with."
         self.document.render_width = self.width
         self.document.update_state()
-        sys.stdout.write("\033c")
+        sys.stdout.write(CLEAR_SCREEN)
+        self.frame.reset()
         self.get_extensions()
+        self._offer_recovery()
 
     @property
     def line_number_width(self):
@@ -71,23 +93,84 @@ class TextScreen:
     
     def open_document(self, path:str):
         self._y_pos = 0
+        self._drawn_y_pos = 0
+        self.document.close()
         self.document = Document(self.master, self.width, path)
-        self.state = [[] for _ in range(self.height)]
+        self.document.render_width = self.width
+        self.document.update_state()
         self.footer_string = self.document.file_path
-        sys.stdout.write("\033c")
+        sys.stdout.write(CLEAR_SCREEN)
+        self.frame.reset()
         self.updated = True
         self.get_extensions()
+        self._offer_recovery()
+
+    def _offer_recovery(self):
+        "Asks in the footer whether to replay the edits a journal left behind, nothing can be edited until it is answered."
+        if self.document.recovered is not None:
+            edits, when = self.document.recovered
+            self.footer_string = f"'{self._short_path()}' has {len(edits)} unsaved edits from {datetime.datetime.fromtimestamp(when):%Y-%m-%d %H:%M}, replay them? (y/n)"
         
     def get_extensions(self):
-        self.highlight:Callable[[str], str] = lambda src: src
-        "The current active syntax highlighter."
-
+        "Hooks the highlighting of the extension for the document's file type up to the document."
+        self.close_highlighter()
+        self.document.syntax = None
         file_ext = self.document.file_path.split(".")[-1]
-        for extension in self.master.extensions.values():
-            if extension.FILE_EXT == file_ext:
-                if extension.parser:
-                    self.highlight = extension.parser.highlight
-                    
+        extension = self.master.file_types.get(file_ext)
+        if extension is None:
+            return
+        budget = extension.budget or self.master.settings["highlight_budget"]
+        # the parser is never built here, it only runs in the worker
+        # seeded with the theme's types so spans packed in other processes mostly use the same ids
+        self.document.syntax = HighlightCache(None, self.document._fetch_lines, self.document.buffer.line_count, theme_types=self.master.styles)
+        try:
+            self.highlighter = HighlightWorker(
+                extension.name, self.document.syntax, self.document._fetch_lines, self.master.events.wake,
+                load_parser, (extension.kind, extension.name, extension.path), budget, self.document.file_path
+            )
+        except OSError:
+            # no way to start another process, so lex on the main loop like before
+            self.document.syntax = None
+            if extension.parser:
+                self.document.syntax = HighlightCache(
+                    extension.parser.lex_line, self.document._fetch_lines, self.document.buffer.line_count,
+                    getattr(extension.parser, "end_state", None)
+                )
+
+    def _short_path(self):
+        # TODO make save message show maximum ammount of characters in file path.
+        flpw = math.floor(self.width/8)
+        return (self.document.file_path[:flpw]+'...') if len(self.document.file_path) > (flpw+3) else self.document.file_path
+
+    def save_document(self):
+        "Starts saving the document, the footer shows how far along it is until it is done."
+        if not self.document.save():
+            self.footer_string = f"No changes to save in '{self._short_path()}'"
+
+    def poll_saving(self):
+        "Says in the footer how the save went once it is over."
+        saving = self.document.poll_save()
+        if saving is None:
+            return
+        if saving.error is None:
+            self.footer_string = f"Last saved '{self._short_path()}' at {datetime.datetime.now()}. 📀"
+        else:
+            self.footer_string = f"Saving '{self._short_path()}' failed: {saving.error}"
+        self.updated = True
+
+    def close_highlighter(self):
+        if self.highlighter is not None:
+            self.highlighter.close()
+            self.highlighter = None
+
+    def poll_highlighting(self):
+        "Takes in whatever highlighting the worker has finished, and redraws if there was any."
+        if self.highlighter is not None and self.highlighter.poll():
+            self.updated = True
+
+    def highlight_timeout(self):
+        "How long the main loop can sleep before the highlighting worker has to be checked on, None for as long as it likes."
+        return self.highlighter.time_left() if self.highlighter is not None else None
 
     @property
     def y_pos(self):
@@ -108,80 +191,149 @@ class TextScreen:
         "The screen space y position of the cursor"
         return self.document.cursor.y - self.y_pos + math.floor(self.document.cursor.x / self.width)
 
+    def scroll_to_cursor(self, center:bool = False):
+        "Moves the view so the cursor is on screen, or into the middle of it if `center`."
+        cursor_row = self.document.cursor.y
+        if center:
+            self.y_pos = cursor_row - self.height // 2
+        elif cursor_row < self.y_pos:
+            self.y_pos = cursor_row
+        elif cursor_row >= self.y_pos + self.height:
+            self.y_pos = cursor_row - self.height + 1
+
     def render(self, new_width:int = None, new_height:int = None) -> str:
         # Resize terminal
         dim_changed = self.width != (new_width - width_offset) or self.height != (new_height - height_offset)
+        if dim_changed:
+            # keep the line at the top of the screen in place while everything rewraps around it
+            top_line, top_row = self.document.wrap.locate(self.y_pos)
         self.width = new_width - width_offset if new_width else self.width
         self.height = new_height - height_offset if new_height else self.height
         if dim_changed:
-            self.state = [[] for _ in range(self.height)]
-            
             self.document.render_width = self.width
             self.document.update_state()
-            sys.stdout.write("\033c")
+            self.y_pos = self.document.wrap.row_of_line(top_line) + top_row
+            sys.stdout.write(CLEAR_SCREEN)
+            self.frame.reset()
             
 
         # render the screen
 
-        screen = ""
-        doc_state = self.document.state
+        self.frame.scroll(0, self.height, self.y_pos - self._drawn_y_pos)
+        self._drawn_y_pos = self.y_pos
 
-        ln = 0
-        for dsln in range(max(self.y_pos, 0), min(self.y_pos + self.height, self.document.height)):
-            line = doc_state[dsln]
-            self.state[ln] = [char for char in line]
-            
-            # add spaces to rhs of text accounting for tabs
-            
-            self.state[ln].extend([None for _ in range(self.width - str_weight(self.state[ln]))])
-            ln += 1
-            
+        self.row_lines = [None] * self.height
+        syntax = self.document.syntax
+        # the text of each row, the column in its logical line that it starts at, and that line
+        row_texts:list[str] = []
+        row_cols:list[int] = []
+        row_line_nums:list[int] = []
+        next_col = 0
+        for line_num, sub_row, line in self.document.rows_from(self.y_pos):
+            ln = len(row_texts)
+            if ln >= self.height:
+                break
+            self.row_lines[ln] = line_num if sub_row == 0 else None
+            if sub_row == 0:
+                next_col = 0
+            elif ln == 0:
+                next_col = sum(len(chunk) for chunk in self.document.line_rows(line_num)[:sub_row])
+            row_texts.append(line)
+            row_cols.append(next_col)
+            next_col += len(line)
+            row_line_nums.append(line_num)
 
-        for y, row in enumerate(self.state):
-            src_line = ""
-            for x, col in enumerate(row):
-                if col != None:
-                    if y == self.cursor_y and x == self.cursor_x:
-                        if col in {'\n', ' '}:
-                            src_line += self.theme_data["cursor_sym"]
-                        elif col == '\t':
-                            src_line += self.theme_data["cursor_sym"] + self.theme_data["tab_sym"][1:len(self.theme_data["tab_sym"])] if self.master.settings["show_tabs"] else self.theme_data["cursor_sym"] + (' ' * (len(self.theme_data["tab_sym"])-1))
-                        else:
-                            src_line += self.theme_data["cursor_sym"] + col
-                    else:
-                        match col:
-                            case '\n':
-                                src_line += self.theme_data["paragraph_sym"] if self.master.settings["show_newlines"] else ''
-
-                            case '\t':
-                                src_line += self.theme_data["tab_sym"] if self.master.settings["show_tabs"] else (' ' * len(self.theme_data["tab_sym"]))
-                            case _:
-                                src_line += col
-                elif y == self.cursor_y and x == self.cursor_x:
-                    src_line += self.theme_data["cursor_sym"]
-            screen += src_line
-            if col != '\n':
-                screen += f'\n'
-    
-        screen = self.highlight(screen).replace(" ", " ")
-        screen = self._render_second_pass(screen)
+        # draw what there is now, the worker's spans get drawn once they come back
+        lex = self.highlighter is None
+        if syntax is not None and row_line_nums and not lex:
+            self.highlighter.request(row_line_nums[0], row_line_nums[-1])
+        if syntax is not self._cached_syntax:
+            # span keys only mean something to the cache that made them
+            self.row_cache.clear()
+            self._cached_syntax = syntax
+
+        composer = self._row_composer()
+        row_cache = self.row_cache
+        cursor_x = self.cursor_x
+        cursor_y = self.cursor_y
+        styles = self.master.styles
+        # characters no span covers are drawn in the language's default style
+        plain = styles.get("default") if syntax is not None else None
+        gutter = f"{get_style(bg=self.theme_data['line_number_bg'])}{{:^4}}{RESET_STYLE}|" if self.master.settings["show_line_numbers"] else None
+        parts:list[str] = []
+        for y in range(self.height):
+            if gutter is not None:
+                line_num = self.row_lines[y]
+                parts.append(gutter.format("" if line_num is None else line_num + 1))
+            if y < len(row_texts):
+                line_num = row_line_nums[y]
+                cursor = cursor_x if y == cursor_y else None
+                key = (row_texts[y], row_cols[y], syntax.span_key(line_num, lex) if syntax is not None else b"", cursor)
+                row = row_cache.get(key)
+                if row is None:
+                    spans = (syntax.spans(line_num) if lex else syntax.cached(line_num)) if syntax is not None else []
+                    row = composer.compose(row_texts[y], row_cols[y], spans, styles, plain, cursor)
+                    row_cache.put(key, row)
+                parts.append(row)
+            parts.append("\n")
+        parts.append(RESET_STYLE)
+        screen = "".join(parts)
 
         # command bar
         bchar = self.theme_data['CLI_bar_filler_char']
-        footer_bg = bchar * (self.width - len(self.footer_string)-5)
-        padding = ' ' if self.footer_string != "" else ''
+        footer = self.footer_string
+        if self.document.loading:
+            footer += f" (indexing {self.document.load_progress:.0%})"
+        if self.document.saving is not None:
+            footer += f" (saving {self.document.saving.progress:.0%})"
+        if self.highlighter is not None and self.highlighter.failed:
+            footer += f" ({self.highlighter.failed})"
+        footer_bg = bchar * (self.width - len(footer)-5)
+        padding = ' ' if footer != "" else ''
+
+        # the row under the footer is where commands get typed
+        command_bar = ""
+        if not self.edit_mode:
+            com_dec = self.command.decode(errors="replace")
+            command_bar = f"{self.theme_data['CLI_prefix']}{com_dec[:self.command_cursor]}{self.theme_data['cursor_sym']}{com_dec[self.command_cursor:]}"
+        command_bar += ' ' * (self.width - len(command_bar))
         
-        return f"{screen}\033[K{self.theme_data['emblem']} {bchar}{padding}{self.footer_string}{padding}{footer_bg}\n\033[K{' '*self.width}"
-
-    def _render_second_pass(self, src:str):
-        lines = src.split('\n')
-        lines.pop()
-        ret_screen = ""
-        for l_n, line in enumerate(lines):
-            if self.master.settings["show_line_numbers"]:
-                ret_screen += f"{get_style(bg=self.theme_data['line_number_bg'])}{(l_n+self.y_pos+1):^4}{RESET_STYLE}|"
-            ret_screen += line + '\n'
-        return ret_screen + RESET_STYLE
+        return f"{screen}{self.theme_data['emblem']} {bchar}{padding}{footer}{padding}{footer_bg}\n{command_bar}"
+
+    def _row_composer(self):
+        "The composer rows get drawn with, built again whenever the width, the theme or a setting it depends on changes."
+        settings = self.master.settings
+        key = (self.width, settings["tab_size"], settings["show_tabs"], settings["show_newlines"], id(self.theme_data), id(self.master.styles))
+        if self._composer_key != key:
+            self._composer = RowComposer(self.width, settings["tab_size"], settings["show_tabs"], settings["show_newlines"], self.theme_data)
+            self._composer_key = key
+            self.row_cache.clear()
+        return self._composer
+
+    def idle(self):
+        "Does a little of the work left over from a resize, returns True if there was any."
+        progress = int(self.document.load_progress * 100)
+        if self.document.saving is not None:
+            progress = (progress, int(self.document.saving.progress * 100))
+        shown = self.document.height
+        grew = self.document.poll()
+        if progress != self._shown_progress or grew and shown < self.y_pos + self.height:
+            # the indexing progress in the footer moved, or lines turned up where the screen was empty
+            self._shown_progress = progress
+            self.updated = True
+        if not self.document.wrap.pending or self.document.mapped is not None:
+            return False
+        top_line, top_row = self.document.wrap.locate(self.y_pos)
+        self.document.reflow_step()
+        self.y_pos = self.document.wrap.row_of_line(top_line) + top_row
+        return True
+
+    def handle_events(self, events:list[InputEvent]):
+        "Handles every input that came in since the last frame, the screen only gets drawn once after."
+        for event in events:
+            if not self.running:
+                break
+            self.handle_input(event)
 
     def handle_input(self, event:InputEvent | None):
         if event == None:
@@ -192,89 +344,96 @@ class TextScreen:
         # handle mouse and set update
         if event.type == InputType.MOUSE:
             if event.mouse_data.event_type == keys.MOUSE_SCROLL_UP:
-                self.y_pos -= self.master.settings["scroll_speed"]
+                self.y_pos -= self.master.settings["scroll_speed"] * event.count
                 self.updated = True
             elif event.mouse_data.event_type == keys.MOUSE_SCROLL_DOWN:
-                self.y_pos += self.master.settings["scroll_speed"]
+                self.y_pos += self.master.settings["scroll_speed"] * event.count
                 self.updated = True
             elif event.mouse_data.event_state == 'm':
-                self.document.cursor.x = event.mouse_data.col-1- self.line_number_width
-                self.document.cursor.y = self.y_pos + event.mouse_data.row - 1
+                self.document.cursor.place(event.mouse_data.col-1- self.line_number_width, min(self.y_pos + event.mouse_data.row - 1, self.document.height - 1))
                 self.updated = True
             
             return
         else:
             self.updated = True
 
+        if self.document.recovered is not None:
+            match key:
+                case b"y" | b"Y":
+                    edits, _ = self.document.recovered
+                    self.document.replay_journal()
+                    self.scroll_to_cursor(True)
+                    self.footer_string = f"Replayed {len(edits)} edits, save to keep them"
+                case b"n" | b"N":
+                    self.document.discard_journal()
+                    self.footer_string = self.document.file_path
+                case keys.ESC:
+                    # the journal stays for next time
+                    self.footer_string = f"EXITING"
+                    self.running = False
+            return
+
+        if event.type == InputType.PASTE:
+            if self.edit_mode:
+                self.document.paste(key)
+                self.scroll_to_cursor()
+            else:
+                # a command is one line
+                pasted = key.replace(b"\r", b"").replace(b"\n", b" ").translate(None, escapes)
+                self.command = self.command[:self.command_cursor] + pasted + self.command[self.command_cursor:]
+                self.command_cursor += len(pasted)
+            return
+
         # Edit vs command mode
         if self.edit_mode:
             self.footer_string = self.document.file_path if self.footer_string in {"COMMAND MODE",self.document.file_path} else self.footer_string
             
             match key:
                 case keys.CTRL_W: # ctrl w
-                    # TODO make save message show maximum ammount of characters in file path.
-                    flpw = math.floor(self.width/8)
-                    filep = (self.document.file_path[:flpw]+'...') if len(self.document.file_path) > (flpw+3) else self.document.file_path    
-                    self.footer_string = f"Last saved '{filep}' at {datetime.datetime.now()}. 📀"
+                    self.save_document()
+                    return
                 case keys.ESC: # esc
                     self.footer_string = f"EXITING"
                     self.running = False
-                case b'\n': # enter
-                    if self.cursor_y == self.height:
-                        self.y_pos += 1
-                case keys.BACKSPACE: # backspace
-                    if self.cursor_y == 0:
-                        self.y_pos -= 1
                 case keys.CTRL_O: # ctrl \
                     self.edit_mode = False
                     self.footer_string = "COMMAND MODE"
                     return
-                case keys.UP: # up
-                    if self.cursor_y == 0:
-                        self.y_pos -= 1
-                case keys.DOWN: # down
-                    if self.cursor_y == self.height:
-                        self.y_pos += 1
+                case keys.PAGE_UP: # page up
+                    self.y_pos -= self.height * event.count
+                    self.document.cursor.y -= self.height * event.count
+                    self.scroll_to_cursor()
+                    return
+                case keys.PAGE_DOWN: # page down
+                    self.y_pos += self.height * event.count
+                    self.document.cursor.y += self.height * event.count
+                    self.scroll_to_cursor()
+                    return
             self.document.handle_input(event)
+            # keep whatever the key did to the cursor on screen
+            self.scroll_to_cursor()
         
         # Command mode
         else:
-            sys.stdout.write(f"\r\033[K{self.theme_data['CLI_prefix']}{' ' * (self.width - len(self.theme_data['CLI_prefix']))}")
-            sys.stdout.flush()
-            # this is for doing commands
-            command = b""
-            cursor_pos = 0
-            while (event.key if (event := self.master.in_handler.get()) else None) != b'\n':
-                if not event:
-                    continue
-                curr_key = event.key
-                if curr_key != None:
-                    if curr_key.startswith(keys.MOUSE_PREFIX):
-                        continue
-                    match curr_key:
-                        case keys.BACKSPACE:
-                            command = command[:cursor_pos-1] + command[cursor_pos:]
-                            cursor_pos = max(cursor_pos-1, 0)
-                        case keys.LEFT:
-                            cursor_pos = max(cursor_pos-1, 0)
-                        case keys.RIGHT:
-                            cursor_pos = min(cursor_pos+1, len(command))
-                        case keys.UP | keys.DOWN:
-                            pass
-                        case _:
-                            try:
-                                curr_key = curr_key.translate(None, escapes)
-                                command = command[:cursor_pos] + curr_key + command[cursor_pos:]
-                                cursor_pos = min(cursor_pos+1, len(command))
-                            except UnicodeDecodeError:
-                                pass
-                    com_dec = command.decode()
-                    lhs_str = f"{self.theme_data['CLI_prefix']}{com_dec[:cursor_pos]}{self.theme_data['cursor_sym']}{com_dec[cursor_pos:]}"
-                    padding = ' ' * (self.width - len(lhs_str))
-                    sys.stdout.write(f"\r\033[K{lhs_str}{padding}")
-                    sys.stdout.flush()
-            self.master.run_command(command.decode())
-            sys.stdout.write("\033c")
-            self.edit_mode = True
-            self.updated = True
-
+            # this is for doing commands, one key at a time so the main loop never has to wait on it
+            match key:
+                case b'\n':
+                    command = self.command.decode()
+                    self.command = b""
+                    self.command_cursor = 0
+                    self.edit_mode = True
+                    self.footer_string = self.document.file_path
+                    self.master.run_command(command)
+                case keys.BACKSPACE:
+                    self.command = self.command[:max(self.command_cursor-1, 0)] + self.command[self.command_cursor:]
+                    self.command_cursor = max(self.command_cursor-1, 0)
+                case keys.LEFT:
+                    self.command_cursor = max(self.command_cursor - event.count, 0)
+                case keys.RIGHT:
+                    self.command_cursor = min(self.command_cursor + event.count, len(self.command))
+                case keys.UP | keys.DOWN:
+                    pass
+                case _:
+                    key = key.translate(None, escapes)
+                    self.command = self.command[:self.command_cursor] + key + self.command[self.command_cursor:]
+                    self.command_cursor = min(self.command_cursor+1, len(self.command))
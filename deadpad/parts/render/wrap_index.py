@@ -0,0 +1,264 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Callable
+
+# logical lines each block of the wrap index aims to hold
+BLOCK_SIZE = 256
+
+# wrapped lines kept around so re-rendering a line does not rewrap it
+CHUNK_CACHE_SIZE = 4096
+
+class Fenwick:
+    "A binary indexed tree of ints, used for the per-block line and row totals."
+    def __init__(self, values:list[int]) -> None:
+        self.size = len(values)
+        tree = [0] + list(values)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = sum(values)
+
+    def add(self, index:int, delta:int):
+        self.total += delta
+        index += 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def append(self, value:int):
+        self.size += 1
+        index = self.size
+        # the new node covers the values from index - lowbit(index) up to itself
+        self.tree.append(value + self.prefix(index - 1) - self.prefix(index - (index & -index)))
+        self.total += value
+
+    def prefix(self, index:int):
+        "The sum of the first `index` values."
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def search(self, target:int):
+        "The index of the value the `target`th unit falls inside of and how far into it `target` is."
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos, target
+
+class WrapIndex:
+    "Maps logical lines to the rows they wrap onto, in blocks that only get wrapped once something looks inside them."
+    def __init__(self, fetch:Callable[[int, int], list[str]], measure:Callable[[str, int, int], tuple[list[str], int]], width:int, tab_size:int, line_count:int) -> None:
+        self._fetch = fetch
+        self._measure = measure
+        self.width = width
+        self.tab_size = tab_size
+        self._chunks:OrderedDict[str, tuple[list[str], int]] = OrderedDict()
+        self.reset(line_count)
+
+    def reset(self, line_count:int):
+        "Forgets every line and starts over with `line_count` unwrapped lines."
+        self._line_totals = [BLOCK_SIZE] * (line_count // BLOCK_SIZE)
+        if line_count % BLOCK_SIZE or not self._line_totals:
+            self._line_totals.append(line_count % BLOCK_SIZE)
+        self._row_totals = list(self._line_totals)
+        self._blocks:list[array | None] = [None] * len(self._line_totals)
+        # unwrapped widths, so a resize only rewraps the lines that no longer fit
+        self._widths:list[array | None] = [None] * len(self._line_totals)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._lines = Fenwick(self._line_totals)
+        self._rows = Fenwick(self._row_totals)
+
+    @property
+    def rows(self):
+        "The number of visual rows in the document."
+        return self._rows.total
+
+    @property
+    def line_count(self):
+        return self._lines.total
+
+    @property
+    def pending(self):
+        "True while some blocks are still estimated."
+        return None in self._blocks
+
+    def grow(self, line_count:int):
+        "Adds unwrapped lines to the end until there are `line_count`, for files that are still loading."
+        extra = line_count - self.line_count
+        if extra <= 0:
+            return
+        last = len(self._blocks) - 1
+        room = BLOCK_SIZE - self._line_totals[last]
+        if room > 0:
+            # the last block might have been wrapped before the rest of its lines were found
+            take = min(room, extra)
+            self._blocks[last] = None
+            self._widths[last] = None
+            self._line_totals[last] += take
+            self._lines.add(last, take)
+            self._row_totals[last] += take
+            self._rows.add(last, take)
+            extra -= take
+        while extra > 0:
+            take = min(BLOCK_SIZE, extra)
+            self._blocks.append(None)
+            self._widths.append(None)
+            self._line_totals.append(take)
+            self._lines.append(take)
+            self._row_totals.append(take)
+            self._rows.append(take)
+            extra -= take
+
+    def set_width(self, width:int, tab_size:int = None):
+        "Changes the wrap width, the rows are only worked out again as they are needed."
+        tab_size = self.tab_size if tab_size is None else tab_size
+        if width == self.width and tab_size == self.tab_size:
+            return
+        if tab_size != self.tab_size:
+            # every width changes with the tab stops, so nothing we measured is any good
+            self._widths = [None] * len(self._widths)
+        for block, widths in enumerate(self._widths):
+            if widths is not None and (not widths or max(widths) <= width):
+                # every line in here still fits on a single row
+                self._blocks[block] = array('I', [1]) * len(widths)
+                self._row_totals[block] = len(widths)
+            else:
+                self._blocks[block] = None
+                self._row_totals[block] = max(self._line_totals[block], round(self._row_totals[block] * self.width / width))
+        self._chunks.clear()
+        self.width = width
+        self.tab_size = tab_size
+        self._rows = Fenwick(self._row_totals)
+
+    def measure(self, text:str) -> tuple[list[str], int]:
+        "The rows that the line `text` wraps onto and how wide it is unwrapped."
+        measured = self._chunks.get(text)
+        if measured is None:
+            measured = self._measure(text, self.width, self.tab_size)
+            self._chunks[text] = measured
+            if len(self._chunks) > CHUNK_CACHE_SIZE:
+                self._chunks.popitem(False)
+        else:
+            self._chunks.move_to_end(text)
+        return measured
+
+    def chunks(self, text:str) -> list[str]:
+        "The rows that the line `text` wraps onto."
+        return self.measure(text)[0]
+
+    def _wrap_block(self, block:int):
+        first = self._lines.prefix(block)
+        counts = array('I')
+        widths = array('I')
+        for text in self._fetch(first, first + self._line_totals[block]):
+            rows, width = self.measure(text)
+            counts.append(len(rows))
+            widths.append(width)
+        self._blocks[block] = counts
+        self._widths[block] = widths
+        total = sum(counts)
+        self._rows.add(block, total - self._row_totals[block])
+        self._row_totals[block] = total
+        return counts
+
+    def _block_counts(self, block:int) -> array:
+        counts = self._blocks[block]
+        return self._wrap_block(block) if counts is None else counts
+
+    def _find_line(self, line:int):
+        "The block holding `line` and the index of the line inside of it."
+        block, index = self._lines.search(line)
+        if block >= len(self._blocks):
+            block = len(self._blocks) - 1
+            index = self._line_totals[block]
+        return block, index
+
+    def locate(self, row:int) -> tuple[int, int]:
+        "Which logical line `row` is on, and which of that line's rows it is."
+        row = min(max(row, 0), self.rows - 1)
+        while True:
+            block, rest = self._rows.search(row)
+            block = min(block, len(self._blocks) - 1)
+            counts = self._blocks[block]
+            if counts is None:
+                # wrapping the block can change its size, so look again
+                self._wrap_block(block)
+                row = min(row, self.rows - 1)
+                continue
+            ends = list(accumulate(counts))
+            index = min(bisect_right(ends, rest), len(counts) - 1)
+            sub_row = rest - (ends[index-1] if index else 0)
+            return self._lines.prefix(block) + index, min(sub_row, counts[index] - 1)
+
+    def row_of_line(self, line:int) -> int:
+        "The first row of the logical line `line`."
+        block, index = self._find_line(line)
+        counts = self._block_counts(block)
+        return self._rows.prefix(block) + sum(counts[:index])
+
+    def splice(self, line:int, remove:int, texts:list[str]):
+        "Replaces the `remove` lines from `line` on with the lines in `texts`."
+        first, index = self._find_line(line)
+        last = first
+        line_total = self._line_totals[first]
+        # the lines being removed can run over into the blocks after this one
+        while index + remove > line_total and last + 1 < len(self._blocks):
+            last += 1
+            line_total += self._line_totals[last]
+        if None in self._blocks[first:last + 1]:
+            # the document has already been edited, so a block that was never wrapped has to be
+            # wrapped from its lines as they are now, `texts` and all
+            start = line - index
+            measured = [self.measure(text) for text in self._fetch(start, start + line_total - remove + len(texts))]
+            counts = [len(rows) for rows, _ in measured]
+            widths = [width for _, width in measured]
+        else:
+            counts = [count for block in range(first, last + 1) for count in self._blocks[block]]
+            widths = [width for block in range(first, last + 1) for width in self._widths[block]]
+            measured = [self.measure(text) for text in texts]
+            counts[index:index + remove] = [len(rows) for rows, _ in measured]
+            widths[index:index + remove] = [width for _, width in measured]
+
+        blocks = [array('I', counts[i:i + BLOCK_SIZE]) for i in range(0, len(counts), BLOCK_SIZE)] or [array('I')]
+        block_widths = [array('I', widths[i:i + BLOCK_SIZE]) for i in range(0, len(widths), BLOCK_SIZE)] or [array('I')]
+        if len(blocks) == 1 and first == last:
+            self._blocks[first] = blocks[0]
+            self._widths[first] = block_widths[0]
+            self._lines.add(first, len(counts) - self._line_totals[first])
+            self._rows.add(first, sum(counts) - self._row_totals[first])
+            self._line_totals[first] = len(counts)
+            self._row_totals[first] = sum(counts)
+            return
+        if len(blocks) > 1 and len(blocks[-1]) < BLOCK_SIZE // 2:
+            blocks[-2].extend(blocks.pop())
+            block_widths[-2].extend(block_widths.pop())
+        self._blocks[first:last + 1] = blocks
+        self._widths[first:last + 1] = block_widths
+        self._line_totals[first:last + 1] = [len(block) for block in blocks]
+        self._row_totals[first:last + 1] = [sum(block) for block in blocks]
+        self._rebuild()
+
+    def reflow_step(self, blocks:int = 2):
+        "Wraps a few of the blocks that are still estimated, returns True if any were left to do."
+        done = 0
+        for block, counts in enumerate(self._blocks):
+            if counts is None:
+                self._wrap_block(block)
+                done += 1
+                if done >= blocks:
+                    break
+        return done > 0
@@ -37,4 +37,15 @@ def get_style(fg:str = "white", bg:str = "default", style:str = "default"):
     """
     Returns the ascii escape code for the color requested
     """
-    return f"\x1b[{STYLES[style]};{FG_COLORS[fg]};{BG_COLORS[bg]}m"
\ No newline at end of file
+    return f"\x1b[{STYLES[style]};{FG_COLORS[fg]};{BG_COLORS[bg]}m"
+
+def compile_styles(language_theme:dict[str, dict[str, str]]) -> dict[str, str]:
+    """
+    Turns the language section of a theme into the escape code for each of its entries, done once
+    when the theme is loaded.  Every code starts with a reset so switching from one to another never
+    needs a reset in between.
+    """
+    return {
+        theme_type: f"\x1b[0;{STYLES[theme['style']]};{FG_COLORS[theme['color_fg']]};{BG_COLORS[theme['color_bg']]}m"
+        for theme_type, theme in language_theme.items()
+    }